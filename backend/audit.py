@@ -0,0 +1,366 @@
+"""Deterministic audit trail built from the run state in a single pass.
+
+Totals, per-stage metrics and the per-`coac_event_key` decision traces are
+computed here rather than by the auditing agent. The agent writes the
+report's `SECTIONS` independently, each from its stage metrics and a small
+sample of examples; `assemble` joins them under a locally rendered summary.
+
+`sha256_state_hash` is the SHA-256 of the canonical JSON of the four state
+sources, i.e. of
+
+    json.dumps({key: state[key] for key in SOURCES}, sort_keys=True,
+               separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+fed to the hash in chunks instead of being materialized.
+"""
+import hashlib
+import heapq
+import json
+import logging
+import os
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Iterator
+
+logger = logging.getLogger(__name__)
+
+AUDIT_SAMPLE_SIZE = int(os.getenv("AUDIT_SAMPLE_SIZE", "20"))
+_HASH_BUFFER = 1 << 16
+
+# State key -> stage that produced it, in pipeline order.
+SOURCES = {
+    "validation_results": "Validation",
+    "breaks_found_global": "Break Detection",
+    "updated_classified_breaks": "Classification",
+    "corrections_list": "Correction",
+}
+
+_SEVERITY_RANK = {"critical": 0, "major": 1, "moderate": 2, "minor": 3}
+_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def _chunks(value: Any) -> Iterator[str]:
+    """Canonical JSON of `value`, split at container boundaries so no list is encoded at once."""
+    if isinstance(value, dict):
+        yield "{"
+        for position, key in enumerate(sorted(value)):
+            yield f"{',' if position else ''}{_encoder.encode(key)}:"
+            yield from _chunks(value[key])
+        yield "}"
+    elif isinstance(value, (list, tuple)):
+        yield "["
+        for position, item in enumerate(value):
+            if position:
+                yield ","
+            # Items are flat records; encoding each whole keeps this at C speed
+            yield _encoder.encode(item)
+        yield "]"
+    else:
+        yield _encoder.encode(value)
+
+
+def state_hash(state: dict[str, Any]) -> str:
+    digest = hashlib.sha256()
+    buffer: list[str] = []
+    size = 0
+    for chunk in _chunks({key: state.get(key) for key in SOURCES}):
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= _HASH_BUFFER:
+            digest.update("".join(buffer).encode("utf-8"))
+            buffer, size = [], 0
+    digest.update("".join(buffer).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _unwrap(value: Any, key: str) -> Any:
+    """Stored stage outputs are unwrapped; the workflow's empty defaults still carry their wrapper key."""
+    return value[key] if isinstance(value, dict) and key in value else value
+
+
+def _ratio(part: int, whole: int) -> float:
+    return round(part / whole, 4) if whole else 0.0
+
+
+def _mean(values: list[float]) -> float | None:
+    return round(sum(values) / len(values), 4) if values else None
+
+
+def _label(break_id: Any) -> Any:
+    """Schema break ids are floats; render 3.0 as 3."""
+    return int(break_id) if isinstance(break_id, float) and break_id.is_integer() else break_id
+
+
+def _record(records: dict[str, dict[str, Any]], key: Any) -> dict[str, Any]:
+    key = str(key)
+    if key not in records:
+        records[key] = {"coac_event_key": key, "breaks": [], "classifications": [], "corrections": [], "issues": []}
+    return records[key]
+
+
+def _status(record: dict[str, Any]) -> str:
+    corrections = record["corrections"]
+    if any(item.get("requires_human_review") for item in corrections):
+        return "pending_review"
+    if corrections and all(item.get("auto_applied") for item in corrections):
+        return "corrected"
+    if record["breaks"] or record["classifications"]:
+        return "open"
+    return "reconciled"
+
+
+def build(state: dict[str, Any], available: set[str], generated_at: str | None = None) -> dict[str, Any]:
+    """Audit trail, detailed records and final report metadata for `state`.
+
+    `available` names the state keys that hold a stage's output; the others
+    are reported as missing sources.
+    """
+    validation = state.get("validation_results") or {}
+    plan = validation.get("mapping_plan") or {}
+    breaks = _unwrap(state.get("breaks_found_global"), "breaks_found") or []
+    classified = _unwrap(state.get("updated_classified_breaks"), "classified_breaks") or {}
+    auto = classified.get("auto_candidates") or []
+    manual = classified.get("manual_candidates") or []
+    corrections = _unwrap(state.get("corrections_list"), "corrections") or []
+
+    records: dict[str, dict[str, Any]] = {}
+    break_types: Counter = Counter()
+    severities: Counter = Counter()
+    differences: list[float] = []
+    for item in breaks:
+        _record(records, item.get("coac_event_key"))["breaks"].append(item)
+        break_types[item.get("break_type")] += 1
+        severities[item.get("severity")] += 1
+        if isinstance(item.get("difference_value"), (int, float)):
+            differences.append(abs(item["difference_value"]))
+
+    classified_ids: dict[Any, str] = {}
+    categories: Counter = Counter()
+    priorities: Counter = Counter()
+    confidences: list[float] = []
+    missing_rationale = 0
+    for decision, items in (("auto", auto), ("manual", manual)):
+        for item in items:
+            record = _record(records, item.get("coac_event_key"))
+            record["classifications"].append({**item, "decision": decision})
+            classified_ids[item.get("break_id")] = record["coac_event_key"]
+            categories[item.get("category")] += 1
+            priorities[item.get("priority")] += 1
+            if isinstance(item.get("confidence"), (int, float)):
+                confidences.append(item["confidence"])
+            if not record["breaks"]:
+                record["issues"].append(f"Classified break {_label(item.get('break_id'))} has no detected break")
+            if not str(item.get("rationale") or "").strip():
+                missing_rationale += 1
+                record["issues"].append(f"Classified break {_label(item.get('break_id'))} has no rationale")
+
+    correction_types: Counter = Counter()
+    auto_applied = human_review = reversible = missing_justification = unlinked = 0
+    for item in corrections:
+        record = _record(records, item.get("coac_event_key"))
+        record["corrections"].append(item)
+        correction_types[item.get("correction_type")] += 1
+        auto_applied += bool(item.get("auto_applied"))
+        human_review += bool(item.get("requires_human_review"))
+        reversible += bool(item.get("verified_reversible"))
+        if classified_ids.get(item.get("break_id")) != record["coac_event_key"]:
+            unlinked += 1
+            record["issues"].append(f"Correction for break {_label(item.get('break_id'))} matches no classified break of this event")
+        if not str(item.get("justification") or "").strip():
+            missing_justification += 1
+            record["issues"].append(f"Correction for break {_label(item.get('break_id'))} has no justification")
+
+    detailed_records = [records[key] for key in sorted(records)]
+    statuses: Counter = Counter()
+    for record in detailed_records:
+        record["status"] = _status(record)
+        statuses[record["status"]] += 1
+
+    missing = [key for key in SOURCES if key not in available]
+    trail = [
+        {
+            "stage": "Validation",
+            "source": "validation_results",
+            "missing": "validation_results" in missing,
+            "metrics": {
+                "mapped_columns": len(plan.get("mapped_columns") or []),
+                "derived_relationships": len(plan.get("derived_relationships") or []),
+                "contextual_relationships": len(plan.get("contextual_relationships") or []),
+                "manual_review": len(validation.get("manual_review") or []),
+                "critical": validation.get("critical"),
+            },
+        },
+        {
+            "stage": "Break Detection",
+            "source": "breaks_found_global",
+            "missing": "breaks_found_global" in missing,
+            "metrics": {
+                "total_breaks": len(breaks),
+                "by_break_type": dict(break_types.most_common()),
+                "by_severity": dict(severities.most_common()),
+                "critical_ratio": _ratio(severities["critical"], len(breaks)),
+                "mean_abs_difference": _mean(differences),
+            },
+        },
+        {
+            "stage": "Classification",
+            "source": "updated_classified_breaks",
+            "missing": "updated_classified_breaks" in missing,
+            "metrics": {
+                "auto_candidates": len(auto),
+                "manual_candidates": len(manual),
+                "approved_for_auto_correction": sum(bool(item.get("approved_for_auto_correction")) for item in auto),
+                "mean_confidence": _mean(confidences),
+                "by_category": dict(categories.most_common()),
+                "by_priority": dict(priorities.most_common()),
+                "missing_rationale": missing_rationale,
+            },
+        },
+        {
+            "stage": "Correction",
+            "source": "corrections_list",
+            "missing": "corrections_list" in missing,
+            "metrics": {
+                "total_corrections": len(corrections),
+                "auto_applied": auto_applied,
+                "requires_human_review": human_review,
+                "verified_reversible": reversible,
+                "reversible_ratio": _ratio(reversible, len(corrections)),
+                "by_correction_type": dict(correction_types.most_common()),
+                "missing_justification": missing_justification,
+                "unlinked_corrections": unlinked,
+            },
+        },
+    ]
+    metadata = {
+        "generated_at": generated_at or datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "agents_involved": len(SOURCES) - len(missing),
+        "total_events": len(detailed_records),
+        "total_breaks": len(breaks),
+        "auto_candidates": len(auto),
+        "manual_candidates": len(manual),
+        "auto_corrections_applied": auto_applied,
+        "manual_reviews_pending": human_review,
+        "derived_relationships_detected": len(plan.get("derived_relationships") or []),
+        "contextual_relationships_detected": len(plan.get("contextual_relationships") or []),
+        "events_by_status": dict(statuses.most_common()),
+        "events_with_issues": sum(bool(record["issues"]) for record in detailed_records),
+        "missing_sources": missing,
+        "critical_issues": bool(missing) or validation.get("critical") is True,
+        "sha256_state_hash": state_hash(state),
+    }
+    return {"audit_trail": trail, "detailed_records": detailed_records, "final_report": {"text": None, "metadata": metadata}}
+
+
+def _sample_order(record: dict[str, Any]) -> tuple:
+    severity = min((_SEVERITY_RANK.get(item.get("severity"), len(_SEVERITY_RANK)) for item in record["breaks"]), default=len(_SEVERITY_RANK))
+    return (not record["issues"], severity, record["status"] != "pending_review", record["coac_event_key"])
+
+
+def sample(report: dict[str, Any], size: int = AUDIT_SAMPLE_SIZE) -> list[dict[str, Any]]:
+    """The records most worth narrating: those with issues first, then by severity and pending review."""
+    return heapq.nsmallest(size, report["detailed_records"], key=_sample_order)
+
+
+@dataclass(frozen=True)
+class Section:
+    name: str
+    title: str
+    brief: str
+
+
+# Written independently and assembled in this order; the stage sections follow `audit_trail`.
+SECTIONS = (
+    Section("validation", "Validation", "Summarize the mapping plan validation: mapped, derived and contextual relationships, columns sent to manual review and whether the plan was critical."),
+    Section("break_detection", "Break Detection", "Analyse the detected breaks: volume, break types, severity mix and magnitude of differences, illustrated with the example breaks."),
+    Section("classification", "Classification", "Explain the classification decisions: auto versus manual split, confidence, categories and priorities, and the rationale patterns in the examples."),
+    Section("correction", "Correction", "Review the corrections: applied versus pending human review, reversibility, correction types, and every issue listed in the examples."),
+    Section("appendix", "Detailed Reasoning Highlights", "For each example event write a `### Event <coac_event_key>` heading followed by its decision summary: what was detected, how it was classified and what correction followed, citing any issues."),
+)
+
+
+def _without_timestamps(item: dict[str, Any]) -> dict[str, Any]:
+    # Detection and correction times differ between otherwise identical runs
+    return {key: value for key, value in item.items() if key not in ("timestamp", "timestamp_detected")}
+
+
+def _section_examples(report: dict[str, Any], name: str, size: int) -> list[dict[str, Any]]:
+    records = report["detailed_records"]
+    if name == "break_detection":
+        breaks = (item for record in records for item in record["breaks"])
+        return [_without_timestamps(item) for item in heapq.nsmallest(size, breaks, key=lambda item: (
+            _SEVERITY_RANK.get(item.get("severity"), len(_SEVERITY_RANK)), -abs(item.get("difference_value") or 0), item.get("coac_event_key"),
+        ))]
+    if name == "classification":
+        classifications = (item for record in records for item in record["classifications"])
+        return heapq.nsmallest(size, classifications, key=lambda item: (
+            item["decision"] != "manual", item.get("confidence") or 0, item.get("coac_event_key"),
+        ))
+    if name == "correction":
+        flagged = heapq.nsmallest(size, (record for record in records if record["corrections"]), key=lambda record: (
+            not record["issues"], record["status"] != "pending_review", record["coac_event_key"],
+        ))
+        return [{"coac_event_key": record["coac_event_key"], "issues": record["issues"], "corrections": [_without_timestamps(item) for item in record["corrections"]]} for record in flagged]
+    if name == "appendix":
+        return [{**record, "breaks": [_without_timestamps(item) for item in record["breaks"]], "corrections": [_without_timestamps(item) for item in record["corrections"]]} for record in sample(report, size)]
+    return []
+
+
+def section_input(report: dict[str, Any], section: Section, size: int = AUDIT_SAMPLE_SIZE) -> str:
+    """Compact, key-sorted JSON of what one section is written from.
+
+    Run-specific values (generation time, state hash, timestamps) are left
+    out so unchanged inputs render byte-identical and hit the section cache.
+    """
+    metadata = report["final_report"]["metadata"]
+    stage = next((entry for entry in report["audit_trail"] if entry["stage"] == section.title), None)
+    return json.dumps({
+        "section": section.title,
+        "missing_sources": metadata["missing_sources"],
+        "critical_issues": metadata["critical_issues"],
+        "stage": stage,
+        "totals": {key: metadata[key] for key in ("total_events", "total_breaks", "events_by_status", "events_with_issues")} if stage is None else None,
+        "examples": _section_examples(report, section.name, size),
+    }, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def fallback_section(report: dict[str, Any], section: Section) -> str:
+    """Plain metric bullets used when a section could not be generated."""
+    stage = next((entry for entry in report["audit_trail"] if entry["stage"] == section.title), None)
+    if stage is None:
+        return "_Event-level highlights could not be generated; see the detailed records._"
+    return "\n".join(f"- **{key.replace('_', ' ').capitalize()}:** {value}" for key, value in stage["metrics"].items())
+
+
+def summary(metadata: dict[str, Any]) -> str:
+    lines = [
+        f"- **Events reconciled:** {metadata['total_events']}",
+        f"- **Breaks detected:** {metadata['total_breaks']}",
+        f"- **Auto / manual candidates:** {metadata['auto_candidates']} / {metadata['manual_candidates']}",
+        f"- **Corrections auto-applied:** {metadata['auto_corrections_applied']}",
+        f"- **Manual reviews pending:** {metadata['manual_reviews_pending']}",
+        f"- **Events with audit issues:** {metadata['events_with_issues']}",
+    ]
+    if metadata["missing_sources"]:
+        lines += [f"\n> **⚠️ Missing Source:** `state.{key}` not found — {SOURCES[key]} data incomplete." for key in metadata["missing_sources"]]
+    return "\n".join(lines)
+
+
+def footer(metadata: dict[str, Any]) -> str:
+    return (
+        f"**Generated at:** {metadata['generated_at']}  \n"
+        f"**Agents involved:** {metadata['agents_involved']}  \n"
+        f"**SHA-256 State Hash:** `{metadata['sha256_state_hash']}`"
+    )
+
+
+def assemble(report: dict[str, Any], texts: dict[str, str]) -> str:
+    """The Markdown report: local summary, the generated sections in `SECTIONS` order, and the footer."""
+    metadata = report["final_report"]["metadata"]
+    parts = ["# NBIM–Custody Reconciliation Audit Report", "## Summary", summary(metadata), "## Stage Overviews"]
+    for section in SECTIONS:
+        heading = f"### {section.title}" if section.name != "appendix" else f"## {section.title}"
+        parts += [heading, texts[section.name].strip()]
+    parts += ["---", footer(metadata)]
+    return "\n\n".join(parts) + "\n"
@@ -0,0 +1,282 @@
+"""Synthetic NBIM and custody dividend bookings with injected, labelled breaks.
+
+NBIM rows use the camel-case names from the validation prompt (`GrossAmount`,
+`TaxAmount`, `NetAmount`, `TaxRate`); custody rows use `GROSS_DIV_AMT` and
+`WHT_AMT`, carry ISO dates and may split one event over several rows. At most
+one break is injected per event and every injected break is written to the
+label file, so detection can be scored against ground truth.
+
+    cd backend
+    python -m benchmarks.datasets --rows 1000000 --seed 7 --out-dir /tmp/recon-1m
+"""
+import argparse
+import csv
+import io
+import random
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Iterable, TextIO
+
+NBIM_HEADER = ("CoacEventKey", "ISIN", "Account", "RecordDate", "PaymentDate", "Currency",
+               "GrossAmount", "TaxAmount", "NetAmount", "TaxRate")
+CUSTODY_HEADER = ("COAC_EVENT_KEY", "ISIN", "CUSTODIAN_ACCOUNT", "RECORD_DATE", "PAY_DATE", "CCY",
+                  "GROSS_DIV_AMT", "WHT_AMT")
+LABEL_HEADER = ("coac_event_key", "injected_break", "expected_break_type", "category", "nbim_field",
+                "nbim_value", "custody_value")
+
+# Injected break -> (break_type the engine should report, classification category)
+BREAK_KINDS = {
+    "gross_amount": ("amount_mismatch", "data_entry_error"),
+    "tax_amount": ("amount_mismatch", "data_entry_error"),
+    "rounding": ("amount_mismatch", "rounding_issue"),
+    "payment_date_t1": ("date_mismatch", "timing_difference"),
+    "currency": ("currency_mismatch", "system_mapping_error"),
+    "missing_in_custody": ("missing_record", "missing_record"),
+    "missing_in_nbim": ("missing_record", "missing_record"),
+}
+DEFAULT_BREAK_RATES = {
+    "gross_amount": 0.01,
+    "tax_amount": 0.005,
+    "rounding": 0.005,
+    "payment_date_t1": 0.01,
+    "currency": 0.002,
+    "missing_in_custody": 0.002,
+    "missing_in_nbim": 0.002,
+}
+TAX_RATES = (0.0, 0.15, 0.25, 0.30, 0.35)
+CURRENCIES = ("USD", "EUR", "GBP", "JPY", "CHF", "NOK", "SEK")
+FLUSH_ROWS = 50_000
+
+MAPPING_PLAN = {
+    "mapped_columns": [
+        {"nbim_column": "Account", "custody_column": "CUSTODIAN_ACCOUNT", "mapping_type": "direct", "formula": "", "confidence": 100},
+        {"nbim_column": "RecordDate", "custody_column": "RECORD_DATE", "mapping_type": "direct", "formula": "", "confidence": 100},
+        {"nbim_column": "PaymentDate", "custody_column": "PAY_DATE", "mapping_type": "direct", "formula": "", "confidence": 100},
+        {"nbim_column": "Currency", "custody_column": "CCY", "mapping_type": "direct", "formula": "", "confidence": 100},
+        {"nbim_column": "GrossAmount", "custody_column": "GROSS_DIV_AMT", "mapping_type": "aggregated", "formula": "", "confidence": 100},
+        {"nbim_column": "TaxAmount", "custody_column": "WHT_AMT", "mapping_type": "aggregated", "formula": "", "confidence": 100},
+        {"nbim_column": "NetAmount", "custody_column": "GROSS_DIV_AMT, WHT_AMT", "mapping_type": "derived", "formula": "GROSS_DIV_AMT - WHT_AMT", "confidence": 95},
+        {"nbim_column": "TaxRate", "custody_column": "GROSS_DIV_AMT, WHT_AMT", "mapping_type": "derived", "formula": "WHT_AMT / GROSS_DIV_AMT", "confidence": 90},
+    ],
+    "derived_relationships": [],
+    "contextual_relationships": [],
+    "unmapped_columns_nbim": ["ISIN"],
+    "unmapped_columns_custody": ["ISIN"],
+}
+VALIDATION_RESULTS = {
+    "structural_validation": {"missing_in_nbim": [], "missing_in_custody": [], "datatype_mismatches": [], "empty_or_null_cells": []},
+    "mapping_plan": MAPPING_PLAN,
+    "manual_review": [],
+    "critical": False,
+    "summary": "Synthetic dataset mapping plan.",
+}
+
+_BASE_DATE = date(2024, 1, 1)
+_DAYS = 760
+_NBIM_DATES = [(_BASE_DATE + timedelta(days=i)).strftime("%d.%m.%Y") for i in range(_DAYS)]
+_CUSTODY_DATES = [(_BASE_DATE + timedelta(days=i)).isoformat() for i in range(_DAYS)]
+
+
+def _money(cents: int) -> str:
+    sign = "-" if cents < 0 else ""
+    cents = abs(cents)
+    return f"{sign}{cents // 100}.{cents % 100:02d}"
+
+
+def _split(total: int, parts: int, rng: random.Random) -> list[int]:
+    """Split integer cents into `parts` positive pieces that sum exactly to `total`."""
+    if parts == 1 or total < parts * 100:
+        return [total]
+    cuts = sorted(rng.sample(range(1, 100), parts - 1))
+    pieces = [total * (b - a) // 100 for a, b in zip([0, *cuts], [*cuts, 100])]
+    pieces[-1] += total - sum(pieces)
+    return pieces
+
+
+def _prorate(total: int, weights: list[int]) -> list[int]:
+    """Split integer cents in proportion to `weights`, summing exactly to `total`."""
+    weight_sum = sum(weights) or 1
+    pieces = [total * weight // weight_sum for weight in weights]
+    pieces[-1] += total - sum(pieces)
+    return pieces
+
+
+def _pick_break(rng: random.Random, rates: dict[str, float]) -> str | None:
+    roll = rng.random()
+    for kind, rate in rates.items():
+        if roll < rate:
+            return kind
+        roll -= rate
+    return None
+
+
+def generate(rows: int, nbim: TextIO, custody: TextIO, labels: TextIO, *, seed: int = 42,
+             break_rates: dict[str, float] | None = None, split_rate: float = 0.3) -> dict[str, Any]:
+    """Write `rows` dividend events as NBIM, custody and label CSVs (semicolon-separated).
+
+    Rows are generated and written in blocks, so memory stays flat for any `rows`.
+    Returns row counts and injected break counts per kind.
+    """
+    rates = dict(DEFAULT_BREAK_RATES if break_rates is None else break_rates)
+    unknown = set(rates) - set(BREAK_KINDS)
+    if unknown:
+        raise ValueError(f"Unknown break kinds: {', '.join(sorted(unknown))}")
+    if sum(rates.values()) > 1:
+        raise ValueError("Break rates must sum to at most 1")
+
+    rng = random.Random(seed)
+    injected = {kind: 0 for kind in rates}
+    counts = {"events": rows, "nbim_rows": 0, "custody_rows": 0}
+    nbim.write(";".join(NBIM_HEADER) + "\n")
+    custody.write(";".join(CUSTODY_HEADER) + "\n")
+    labels.write(";".join(LABEL_HEADER) + "\n")
+    nbim_block: list[str] = []
+    custody_block: list[str] = []
+    label_block: list[str] = []
+
+    for index in range(rows):
+        key = str(950_000_000 + index)
+        isin = f"{rng.choice(('US', 'NO', 'GB', 'JP', 'DE'))}{index:09d}{index % 10}"
+        account = f"ACC{8_200_000 + rng.randrange(400)}"
+        pay_day = rng.randrange(14, _DAYS - 2)
+        record_day = pay_day - rng.randrange(3, 14)
+        currency = rng.choice(CURRENCIES)
+        gross = rng.randrange(100_000, 500_000_000)
+        rate = rng.choice(TAX_RATES)
+        tax = round(gross * rate)
+        kind = _pick_break(rng, rates)
+
+        if kind != "missing_in_nbim":
+            nbim_block.append(";".join((
+                key, isin, account, _NBIM_DATES[record_day], _NBIM_DATES[pay_day], currency,
+                _money(gross), _money(tax), _money(gross - tax), f"{tax / gross:.6f}",
+            )))
+
+        custody_gross, custody_tax, custody_pay_day, custody_currency = gross, tax, pay_day, currency
+        label = None
+        if kind == "gross_amount":
+            custody_gross += rng.choice((-1, 1)) * rng.randrange(50_000, max(50_001, gross // 2))
+            label = ("GrossAmount", _money(gross), _money(custody_gross))
+        elif kind == "tax_amount":
+            custody_tax += (1 if tax == 0 else rng.choice((-1, 1))) * rng.randrange(10_000, max(10_001, tax // 2, gross // 20))
+            label = ("TaxAmount", _money(tax), _money(custody_tax))
+        elif kind == "rounding":
+            custody_gross += rng.choice((-1, 1)) * rng.randrange(2, 6)
+            label = ("GrossAmount", _money(gross), _money(custody_gross))
+        elif kind == "payment_date_t1":
+            custody_pay_day += 1
+            label = ("PaymentDate", _NBIM_DATES[pay_day], _CUSTODY_DATES[custody_pay_day])
+        elif kind == "currency":
+            custody_currency = rng.choice([c for c in CURRENCIES if c != currency])
+            label = ("Currency", currency, custody_currency)
+        elif kind == "missing_in_custody":
+            label = ("CoacEventKey", key, "")
+        elif kind == "missing_in_nbim":
+            label = ("CoacEventKey", "", key)
+
+        if kind != "missing_in_custody":
+            parts = rng.choice((2, 3)) if rng.random() < split_rate else 1
+            gross_parts = _split(custody_gross, parts, rng)
+            for part_gross, part_tax in zip(gross_parts, _prorate(custody_tax, gross_parts)):
+                custody_block.append(";".join((
+                    key, isin, account, _CUSTODY_DATES[record_day], _CUSTODY_DATES[custody_pay_day], custody_currency,
+                    _money(part_gross), _money(part_tax),
+                )))
+
+        if kind is not None:
+            injected[kind] += 1
+            expected_type, category = BREAK_KINDS[kind]
+            label_block.append(";".join((key, kind, expected_type, category, *label)))
+
+        if len(custody_block) >= FLUSH_ROWS:
+            counts["nbim_rows"] += len(nbim_block)
+            counts["custody_rows"] += len(custody_block)
+            _flush(nbim, nbim_block)
+            _flush(custody, custody_block)
+            _flush(labels, label_block)
+
+    counts["nbim_rows"] += len(nbim_block)
+    counts["custody_rows"] += len(custody_block)
+    _flush(nbim, nbim_block)
+    _flush(custody, custody_block)
+    _flush(labels, label_block)
+    return {**counts, "seed": seed, "split_rate": split_rate, "break_rates": rates, "injected": injected}
+
+
+def _flush(stream: TextIO, block: list[str]) -> None:
+    if block:
+        stream.write("\n".join(block) + "\n")
+        block.clear()
+
+
+def generate_text(rows: int, **kwargs) -> tuple[str, str, str]:
+    """In-memory variant of `generate` returning the NBIM, custody and label CSV text."""
+    nbim, custody, labels = io.StringIO(), io.StringIO(), io.StringIO()
+    generate(rows, nbim, custody, labels, **kwargs)
+    return nbim.getvalue(), custody.getvalue(), labels.getvalue()
+
+
+def read_labels(stream: Iterable[str]) -> list[dict[str, str]]:
+    return list(csv.DictReader(stream, delimiter=";"))
+
+
+def score(breaks: list[dict[str, Any]], labels: list[dict[str, str]]) -> dict[str, Any]:
+    """Event-level precision and recall of detected breaks against the label file.
+
+    A label counts as found when a break with its `expected_break_type` was
+    reported for its `coac_event_key`; recall is also given per injected kind.
+    """
+    detected = {(item["coac_event_key"], item["break_type"]) for item in breaks}
+    expected = {(label["coac_event_key"], label["expected_break_type"]) for label in labels}
+    true_positives = len(detected & expected)
+    by_kind: dict[str, list[int]] = {}
+    for label in labels:
+        found = (label["coac_event_key"], label["expected_break_type"]) in detected
+        hits = by_kind.setdefault(label["injected_break"], [0, 0])
+        hits[0] += found
+        hits[1] += 1
+    return {
+        "expected": len(expected),
+        "detected": len(detected),
+        "true_positives": true_positives,
+        "precision": true_positives / len(detected) if detected else 1.0,
+        "recall": true_positives / len(expected) if expected else 1.0,
+        "recall_by_kind": {kind: found / total for kind, (found, total) in sorted(by_kind.items())},
+    }
+
+
+def _parse_rates(pairs: list[str]) -> dict[str, float]:
+    rates = dict(DEFAULT_BREAK_RATES)
+    for pair in pairs:
+        kind, _, value = pair.partition("=")
+        rates[kind] = float(value)
+    return rates
+
+
+def main_cli(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, required=True, help="dividend events (NBIM rows before missing_in_nbim breaks)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--split-rate", type=float, default=0.3, help="share of events split over 2-3 custody rows")
+    parser.add_argument("--break-rate", action="append", default=[], metavar="KIND=RATE",
+                        help=f"override an injection rate; kinds: {', '.join(BREAK_KINDS)}")
+    parser.add_argument("--out-dir", type=Path, required=True)
+    args = parser.parse_args(argv)
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    with open(args.out_dir / "nbim.csv", "w", encoding="utf-8", newline="") as nbim, \
+            open(args.out_dir / "custody.csv", "w", encoding="utf-8", newline="") as custody, \
+            open(args.out_dir / "labels.csv", "w", encoding="utf-8", newline="") as labels:
+        stats = generate(args.rows, nbim, custody, labels, seed=args.seed,
+                         break_rates=_parse_rates(args.break_rate), split_rate=args.split_rate)
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {stats['nbim_rows']} NBIM rows, {stats['custody_rows']} custody rows and "
+          f"{sum(stats['injected'].values())} labelled breaks to {args.out_dir} in {elapsed:.1f}s", file=sys.stderr)
+    return stats
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,270 @@
+"""Offline end-to-end benchmark of `run_workflow` against a stub model.
+
+Runs every route at several dataset sizes and splits wall time into model time
+(spent inside the stub, including synthetic latency) and our own time:
+ingestion, prompt assembly, session state, the rest of the workflow and
+response serialization. Datasets come from `benchmarks.datasets`, so break
+detection is scored against its labels in the same run. Results are written as
+JSON for comparison over time. With `--streamed` every route runs the way
+`/api/run-workflow/stream` does: stages are streamed from the stub and their
+progress events are rendered as SSE, and each sample also reports the event
+count, SSE bytes and time to the first streamed item.
+
+    cd backend
+    python -m benchmarks.pipeline --sizes 100 1000 10000 --repeat 3 --model-latency-ms 50
+    python -m benchmarks.pipeline --sizes 1000 --streamed --model-ms-per-token 0.05
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from pathlib import Path
+
+_workdir = tempfile.mkdtemp(prefix="reconciliation-bench-")
+os.environ.setdefault("MAPPING_CACHE_PATH", os.path.join(_workdir, "mapping_cache.sqlite3"))
+os.environ.setdefault("SESSION_STORE_PATH", os.path.join(_workdir, "sessions.sqlite3"))
+os.environ.setdefault("REPORT_CACHE_PATH", os.path.join(_workdir, "report_cache.sqlite3"))
+os.environ.setdefault("RESPONSE_CACHE_PATH", os.path.join(_workdir, "response_cache.sqlite3"))
+# The stub model has no quota; the scheduler's budgets would only measure themselves
+os.environ.setdefault("MODEL_RPM_LIMIT", "0")
+os.environ.setdefault("MODEL_TPM_LIMIT", "0")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-stub")
+
+from agents import set_tracing_disabled  # noqa: E402
+from fastapi import UploadFile  # noqa: E402
+
+import main  # noqa: E402
+import progress  # noqa: E402
+import server  # noqa: E402
+from benchmarks import datasets  # noqa: E402
+from benchmarks.stub_model import ModelClock, canned_responders, install  # noqa: E402
+from mapping_cache import mapping_plan_cache  # noqa: E402
+from report_cache import report_section_cache  # noqa: E402
+from response_cache import response_cache  # noqa: E402
+from session_store import session_store  # noqa: E402
+
+ROUTE_REQUESTS = {
+    "breaks_identifier": "Identify breaks between the uploaded NBIM and custody bookings.",
+    "breaks_fixes": "Fix the breaks that were approved for auto correction.",
+    "report_generation": "Generate the reconciliation audit report.",
+}
+
+
+class Timings:
+    """Adds the wall time of wrapped callables into named buckets."""
+
+    def __init__(self):
+        self.seconds: dict[str, float] = {}
+
+    def add(self, bucket: str, seconds: float) -> None:
+        self.seconds[bucket] = self.seconds.get(bucket, 0.0) + seconds
+
+    def wrap(self, owner, attr: str, bucket: str) -> None:
+        original = getattr(owner, attr)
+        timings = self
+        if asyncio.iscoroutinefunction(original):
+            @wraps(original)
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    timings.add(bucket, time.perf_counter() - started)
+        else:
+            @wraps(original)
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    timings.add(bucket, time.perf_counter() - started)
+        setattr(owner, attr, timed)
+
+
+async def run_streamed(workflow_kwargs: dict) -> tuple[dict, dict]:
+    """`run_workflow` with a progress reporter attached, as the streaming endpoint runs it.
+
+    Returns the result and stream measurements; events are rendered as SSE once the run is done.
+    """
+    reporter = progress.ProgressReporter()
+
+    async def run_with_progress() -> dict:
+        progress.use_reporter(reporter)
+        return await main.run_workflow(**workflow_kwargs)
+
+    result = await asyncio.create_task(run_with_progress())
+    events = []
+    while not reporter.queue.empty():
+        events.append(reporter.queue.get_nowait())
+    item_ms = [data["elapsed_ms"] for event, data in events if event == "item"]
+    return result, {
+        "stream_events": len(events),
+        "stream_items": len(item_ms),
+        "stream_bytes": sum(len(progress.format_sse(event, data).encode("utf-8")) for event, data in events),
+        "first_item_s": min(item_ms) / 1000 if item_ms else None,
+    }
+
+
+async def run_route(route: str, files: dict[str, bytes], run_id: str | None, clock: ModelClock, timings: Timings,
+                    labels: list[dict] | None = None, streamed: bool = False) -> tuple[dict, str]:
+    """One request through `_prepare_run` and `run_workflow`, streamed if asked; returns its measurements and run_id."""
+    clock.reset()
+    timings.seconds.clear()
+    uploads = {name: UploadFile(io.BytesIO(data), filename=f"{name}.csv") for name, data in files.items()}
+
+    started = time.perf_counter()
+    prepared = await server._prepare_run(ROUTE_REQUESTS[route], None, run_id, uploads.get("nbim"), uploads.get("custody"))
+    prepared_at = time.perf_counter()
+    prepare_state_s = timings.seconds.get("session_state", 0.0)
+    stream: dict = {}
+    if streamed:
+        result, stream = await run_streamed(prepared["workflow_kwargs"])
+    else:
+        result = await main.run_workflow(**prepared["workflow_kwargs"])
+    workflow_at = time.perf_counter()
+    body = json.dumps(server._success_payload(prepared, result))
+    finished = time.perf_counter()
+
+    prepare_s = prepared_at - started
+    workflow_s = workflow_at - prepared_at
+    ingestion_s = timings.seconds.get("ingestion", 0.0)
+    state_s = timings.seconds.get("session_state", 0.0)
+    measurements = {
+        "route": result["routing"]["route"],
+        "total_s": finished - started,
+        "model_s": clock.seconds,
+        "own_s": finished - started - clock.seconds,
+        "ingestion_s": ingestion_s,
+        "prompt_assembly_s": prepare_s - ingestion_s - prepare_state_s,
+        "session_state_s": state_s,
+        "workflow_own_s": workflow_s - clock.seconds - (state_s - prepare_state_s),
+        "serialization_s": finished - workflow_at,
+        "model_calls": clock.calls,
+        "model_input_tokens": clock.input_tokens,
+        "model_output_tokens": clock.output_tokens,
+        "response_bytes": len(body),
+        **stream,
+    }
+    if labels is not None:
+        found = session_store.get(prepared["run_id"], ["breaks_found_global"])["breaks_found_global"]["breaks_found"]
+        measurements["detection"] = datasets.score(found, labels)
+    return measurements, prepared["run_id"]
+
+
+def summarize(samples: list[dict]) -> dict:
+    summary = {}
+    for key in samples[0]:
+        values = [sample[key] for sample in samples]
+        if isinstance(values[0], float):
+            summary[key] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+        else:
+            summary[key] = values[-1]
+    return summary
+
+
+async def benchmark(sizes: list[int], repeat: int, seed: int, clock: ModelClock, timings: Timings, streamed: bool = False) -> list[dict]:
+    results = []
+    for events in sizes:
+        nbim_csv, custody_csv, label_csv = datasets.generate_text(events, seed=seed)
+        files = {"nbim": nbim_csv.encode("utf-8"), "custody": custody_csv.encode("utf-8")}
+        labels = datasets.read_labels(io.StringIO(label_csv))
+        samples: dict[str, list[dict]] = {route: [] for route in ROUTE_REQUESTS}
+        for _ in range(repeat):
+            # Every repetition pays for every model call, as a first upload of a layout would
+            mapping_plan_cache.invalidate()
+            report_section_cache.invalidate()
+            response_cache.invalidate()
+            sample, run_id = await run_route("breaks_identifier", files, None, clock, timings, labels, streamed)
+            samples["breaks_identifier"].append(sample)
+            for route in ("breaks_fixes", "report_generation"):
+                sample, _ = await run_route(route, {}, run_id, clock, timings, streamed=streamed)
+                samples[route].append(sample)
+        for route, route_samples in samples.items():
+            results.append({
+                "route": route,
+                "events": events,
+                "nbim_bytes": len(files["nbim"]),
+                "custody_bytes": len(files["custody"]),
+                "repeat": repeat,
+                "streamed": streamed,
+                **summarize(route_samples),
+            })
+            print(f"{route:<18} events={events:<8} total={results[-1]['total_s']['median'] * 1000:9.1f} ms"
+                  f"  own={results[-1]['own_s']['median'] * 1000:9.1f} ms  model={results[-1]['model_s']['median'] * 1000:9.1f} ms",
+                  file=sys.stderr)
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main_cli(argv: list[str] | None = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="dividend events per dataset")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42, help="dataset generator seed")
+    parser.add_argument("--model-latency-ms", type=float, default=0.0, help="synthetic latency per model call")
+    parser.add_argument("--model-ms-per-token", type=float, default=0.0, help="synthetic latency per output token")
+    parser.add_argument("--streamed", action="store_true", help="stream every stage and measure the SSE progress events")
+    parser.add_argument("--responses", type=Path, help="JSON object of recorded outputs keyed by agent attribute in main.py")
+    parser.add_argument("--output", type=Path, help="result file (default: benchmarks/results/pipeline-<UTC timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    set_tracing_disabled(True)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    clock = ModelClock()
+    responders = canned_responders(datasets.VALIDATION_RESULTS)
+    if args.responses:
+        recorded = json.loads(args.responses.read_text())
+        responders.update({name: (lambda text, output=output: output) for name, output in recorded.items()})
+    install(main, responders, clock, args.model_latency_ms / 1000, args.model_ms_per_token / 1000)
+
+    timings = Timings()
+    timings.wrap(server, "ingest_upload", "ingestion")
+    for method in ("create", "exists", "get", "put"):
+        timings.wrap(session_store, method, "session_state")
+
+    started_at = datetime.now(timezone.utc)
+    results = asyncio.run(benchmark(args.sizes, args.repeat, args.seed, clock, timings, args.streamed))
+    report = {
+        "benchmark": "pipeline",
+        "started_at": started_at.isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "sizes": args.sizes,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "model_latency_ms": args.model_latency_ms,
+            "model_ms_per_token": args.model_ms_per_token,
+            "responses": str(args.responses) if args.responses else None,
+            "streamed": args.streamed,
+            "break_detection_mode": main.BREAK_DETECTION_MODE,
+        },
+        "results": results,
+    }
+    output = args.output or Path(__file__).parent / "results" / f"pipeline-{started_at:%Y%m%dT%H%M%SZ}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Wrote {output}", file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import re
+import time
+from typing import Any, AsyncIterator, Callable
+
+from agents import Agent, Usage
+from agents.items import ModelResponse
+from agents.models.interface import Model
+from openai.types.responses import (
+    Response,
+    ResponseCompletedEvent,
+    ResponseOutputMessage,
+    ResponseOutputText,
+    ResponseTextDeltaEvent,
+    ResponseUsage,
+)
+from openai.types.responses.response_usage import InputTokensDetails, OutputTokensDetails
+
+from pagination import cursor_of
+from sharding import estimate_tokens
+
+_CONTEXT_BLOCK = re.compile(r"--- CONTEXT (\w+) START ---\n(.*?)\n--- CONTEXT \1 END ---", re.DOTALL)
+_PAGE_BLOCK = re.compile(r"--- PAGE START ---\npage_size: (\d+)\ncursor: (.*)\n")
+# Characters of canned output per streamed text delta.
+STREAM_CHUNK_CHARS = 64
+
+
+class ModelClock:
+    """Accumulates time spent inside stub model calls, so callers can subtract it from wall time.
+
+    Overlapping concurrent calls are counted once: `seconds` is the wall time
+    during which at least one call was in flight.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._active = 0
+        self._since = 0.0
+
+    def reset(self) -> None:
+        self.__init__()
+
+    def enter(self) -> None:
+        if self._active == 0:
+            self._since = time.perf_counter()
+        self._active += 1
+
+    def leave(self) -> None:
+        self._active -= 1
+        if self._active == 0:
+            self.seconds += time.perf_counter() - self._since
+
+
+def input_text(input: str | list) -> str:
+    if isinstance(input, str):
+        return input
+    parts = []
+    for item in input:
+        content = item.get("content") if isinstance(item, dict) else None
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+    return "\n\n".join(parts)
+
+
+def context_blocks(text: str) -> dict[str, Any]:
+    return {label: json.loads(body) for label, body in _CONTEXT_BLOCK.findall(text)}
+
+
+def _classified(text: str) -> dict:
+    breaks = context_blocks(text).get("breaks_found", {}).get("breaks_found", [])
+    auto, manual = [], []
+    for index, item in enumerate(breaks, start=1):
+        base = {
+            "break_id": item.get("break_id", index),
+            "coac_event_key": item["coac_event_key"],
+            "break_type": item["break_type"],
+            "mapping_type": item["mapping_type"],
+            "priority": {"major": "high", "moderate": "medium"}.get(item["severity"], "low"),
+        }
+        if item["severity"] == "minor":
+            auto.append({**base, "category": "rounding_issue", "confidence": 95, "recommended_action": "auto_fix",
+                         "approved_for_auto_correction": False, "rationale": "Within rounding tolerance."})
+        else:
+            manual.append({**base, "category": "data_entry_error", "confidence": 60, "recommended_action": "manual_review",
+                           "rationale": "Monetary discrepancy needs review."})
+    summary = {"total_breaks": len(breaks), "auto_batch_size": len(auto), "manual_batch_size": len(manual),
+               "awaiting_user_confirmation": bool(auto)}
+    return {"classified_breaks": {"auto_candidates": auto, "manual_candidates": manual, "summary": summary}}
+
+
+def _page(text: str, items_key: str, items: list[dict], cursor_fields: tuple[str, ...]) -> dict:
+    """The slice of `items` a paged agent would return for the PAGE block in `text`."""
+    match = _PAGE_BLOCK.search(text)
+    if match is None:
+        return {items_key: items, "next_cursor": None}
+    page_size, cursor = int(match.group(1)), match.group(2)
+    start = 0
+    if cursor != "null":
+        start = next((index + 1 for index, item in enumerate(items) if cursor_of(item, cursor_fields) == cursor), len(items))
+    page = items[start:start + page_size]
+    more = start + page_size < len(items)
+    return {items_key: page, "next_cursor": cursor_of(page[-1], cursor_fields) if more else None}
+
+
+def _corrections(text: str) -> dict:
+    classified = context_blocks(text).get("classified_breaks", {})
+    corrections = [
+        {"break_id": item["break_id"], "coac_event_key": item["coac_event_key"], "break_type": item["break_type"],
+         "mapping_type": item["mapping_type"], "correction_type": "numeric_adjustment", "original_value": "",
+         "corrected_value": "", "justification": item["rationale"], "auto_applied": False,
+         "requires_human_review": True, "verified_reversible": True, "timestamp": "2025-01-01T00:00:00Z"}
+        for item in sorted(classified.get("auto_candidates", []) + classified.get("manual_candidates", []), key=lambda item: item["break_id"])
+    ]
+    summary = {"total_corrections": len(corrections), "auto_corrections_applied": 0,
+               "manual_reviews_pending": len(corrections), "reversible_corrections": len(corrections),
+               "critical_issues": False}
+    return {**_page(text, "corrections", corrections, ("break_id",)), "summary": summary}
+
+
+def canned_responders(validation_results: dict) -> dict[str, Callable[[str], str]]:
+    """Deterministic outputs per `main` agent attribute, sized by what the agent was given."""
+    return {
+        "agent": lambda text: json.dumps({"response_type": "breaks_identifier"}),
+        "validation_agent": lambda text: json.dumps(validation_results),
+        "break_classifier": lambda text: json.dumps({"breaks_found": [], "next_cursor": None}),
+        "break_commentator": lambda text: json.dumps({"comments": [
+            {"break_index": item["break_index"], "comment": f"Stub: {item['comment']}"} for item in json.loads(text)
+        ]}),
+        "classification_agent": lambda text: json.dumps(_classified(text)),
+        "correction_agent": lambda text: json.dumps(_corrections(text)),
+        "auditing_agent": lambda text: "# Reconciliation Audit Report\n\nGenerated by the stub model.\n",
+        "agent1": lambda text: "Please choose one of the supported requests.",
+    }
+
+
+class StubModel(Model):
+    """Offline `Model` that answers from a responder after a synthetic delay.
+
+    The delay is `latency_s` plus `per_output_token_s` for every estimated output
+    token; all time spent here is added to the shared `ModelClock`. Streamed
+    calls replay the same output as text deltas of `STREAM_CHUNK_CHARS`, the
+    latency before the first and each delta's token delay before it.
+    """
+
+    def __init__(self, respond: Callable[[str], str], clock: ModelClock, latency_s: float = 0.0, per_output_token_s: float = 0.0):
+        self.respond = respond
+        self.clock = clock
+        self.latency_s = latency_s
+        self.per_output_token_s = per_output_token_s
+
+    def _answer(self, system_instructions: str | None, input) -> tuple[str, int, int]:
+        text = input_text(input)
+        output = self.respond(text)
+        return output, estimate_tokens(system_instructions or "") + estimate_tokens(text), estimate_tokens(output)
+
+    def _count(self, input_tokens: int, output_tokens: int) -> None:
+        self.clock.calls += 1
+        self.clock.input_tokens += input_tokens
+        self.clock.output_tokens += output_tokens
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *,
+                           previous_response_id=None, conversation_id=None, prompt=None, **kwargs) -> ModelResponse:
+        self.clock.enter()
+        try:
+            output, input_tokens, output_tokens = self._answer(system_instructions, input)
+            delay = self.latency_s + self.per_output_token_s * output_tokens
+            if delay > 0:
+                await asyncio.sleep(delay)
+        finally:
+            self.clock.leave()
+        self._count(input_tokens, output_tokens)
+        return ModelResponse(
+            output=[_message(output)],
+            usage=Usage(requests=1, input_tokens=input_tokens, output_tokens=output_tokens, total_tokens=input_tokens + output_tokens),
+            response_id=None,
+        )
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *,
+                              previous_response_id=None, conversation_id=None, prompt=None, **kwargs) -> AsyncIterator:
+        self.clock.enter()
+        try:
+            output, input_tokens, output_tokens = self._answer(system_instructions, input)
+            if self.latency_s > 0:
+                await asyncio.sleep(self.latency_s)
+            for sequence, start in enumerate(range(0, len(output), STREAM_CHUNK_CHARS)):
+                delta = output[start:start + STREAM_CHUNK_CHARS]
+                if self.per_output_token_s > 0:
+                    await asyncio.sleep(self.per_output_token_s * estimate_tokens(delta))
+                yield ResponseTextDeltaEvent(
+                    type="response.output_text.delta", item_id="msg_stub", output_index=0, content_index=0,
+                    delta=delta, logprobs=[], sequence_number=sequence,
+                )
+        finally:
+            self.clock.leave()
+        self._count(input_tokens, output_tokens)
+        response = Response(
+            id="resp_stub",
+            created_at=time.time(),
+            model="stub",
+            object="response",
+            output=[_message(output)],
+            parallel_tool_calls=False,
+            tool_choice="auto",
+            tools=[],
+            usage=ResponseUsage(
+                input_tokens=input_tokens,
+                # Constructed unvalidated: the detail fields required differ between openai releases
+                input_tokens_details=InputTokensDetails.model_construct(cached_tokens=0),
+                output_tokens=output_tokens,
+                output_tokens_details=OutputTokensDetails.model_construct(reasoning_tokens=0),
+                total_tokens=input_tokens + output_tokens,
+            ),
+        )
+        yield ResponseCompletedEvent(type="response.completed", response=response, sequence_number=-(-len(output) // STREAM_CHUNK_CHARS))
+
+
+def _message(output: str) -> ResponseOutputMessage:
+    return ResponseOutputMessage(
+        id="msg_stub",
+        type="message",
+        role="assistant",
+        status="completed",
+        content=[ResponseOutputText(type="output_text", text=output, annotations=[])],
+    )
+
+
+def install(module, responders: dict[str, Callable[[str], str]], clock: ModelClock, latency_s: float = 0.0, per_output_token_s: float = 0.0) -> None:
+    """Point every `Agent` defined on `module` at a stub model, keyed by attribute name."""
+    for name, value in vars(module).items():
+        if isinstance(value, Agent):
+            value.model = StubModel(responders[name], clock, latency_s, per_output_token_s)
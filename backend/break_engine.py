@@ -0,0 +1,618 @@
+import logging
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import count
+from typing import Any, Iterable, Mapping
+
+import numpy as np
+
+from formulas import FORMULA_CACHE_SIZE, Formula, FormulaError, compile_formula
+from ingestion import parse_number
+
+logger = logging.getLogger(__name__)
+
+Columns = Mapping[str, np.ndarray]
+
+# Cash differences below this are rounding noise and never become a break.
+AMOUNT_TOLERANCE = 0.01
+# Rates and per-share figures are compared on a much finer scale.
+RATE_TOLERANCE = 1e-4
+CRITICAL_COMMENT = "Upstream mapping flagged critical; downstream auto-fix should pause."
+SEVERITY_RANK = {"minor": 0, "moderate": 1, "major": 2}
+# An amount difference is material from this share of the larger side, or from MATERIAL_AMOUNT for cash.
+MATERIAL_RELATIVE_DIFFERENCE = 1e-3
+MATERIAL_AMOUNT = 1.0
+# Severity of a material amount mismatch by NBIM field (rule E), matched on normalized names in order.
+# Net cash not tying out is major at any size; a field matching no entry is moderate.
+_AMOUNT_SEVERITY = (
+    (re.compile(r"^(total)?net(amount|amt|cash|dividend|payment|value)"), "major"),
+    (re.compile(r"^(total)?gross"), "moderate"),
+    (re.compile(r"tax|wht|withholding|reclaim"), "moderate"),
+)
+
+_KEY_ALIASES = ("coaceventkey", "eventkey")
+_COMPOSITE_KEY_ROLES = (
+    ("isin",),
+    ("recorddate", "exdate"),
+    ("paymentdate", "paydate", "settlementdate"),
+    ("account", "custodianaccount", "bankaccount", "bankaccounts", "portfolio"),
+)
+_NON_ADDITIVE_MARKERS = ("rate", "pershare", "pct", "percent", "price")
+_DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%Y%m%d", "%m/%d/%Y")
+
+
+class EngineUnavailable(ValueError):
+    """Raised when the datasets or mapping plan cannot be reconciled locally."""
+
+
+@dataclass
+class FieldSpec:
+    """One NBIM field compared against its Custody expression."""
+
+    nbim_field: str
+    custody_field: str
+    mapping_type: str
+    formula: str
+    expression: Formula
+    kind: str
+    additive: bool
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def _strip_source(name: str) -> str:
+    """Drop `NBIM.` / `Custody.` prefixes the validation agent likes to emit."""
+    name = name.strip()
+    for prefix in ("nbim.", "custody."):
+        if name.lower().startswith(prefix):
+            return name[len(prefix):]
+    return name
+
+
+def _resolve(columns: Columns, name: str) -> str | None:
+    name = _strip_source(name)
+    if name in columns:
+        return name
+    wanted = _normalize(name)
+    for column in columns:
+        if _normalize(column) == wanted:
+            return column
+    return None
+
+
+def _find_alias(columns: Columns, aliases: tuple[str, ...]) -> str | None:
+    by_norm = {_normalize(column): column for column in columns}
+    for alias in aliases:
+        if alias in by_norm:
+            return by_norm[alias]
+    return None
+
+
+def to_float(values: np.ndarray) -> np.ndarray:
+    """Coerce cells to float64, mapping blanks and junk to NaN."""
+    if values.dtype.kind == "f":
+        return values
+    try:
+        return values.astype(np.float64)
+    except (TypeError, ValueError):
+        pass
+    out = np.full(len(values), np.nan)
+    for i, raw in enumerate(values):
+        number = parse_number(str(raw))
+        if number is not None:
+            out[i] = number
+    return out
+
+
+def _parse_date(cell: str) -> int | None:
+    cell = cell.strip()
+    if not cell:
+        return None
+    if "T" in cell:
+        cell = cell.split("T", 1)[0]
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(cell, fmt).toordinal()
+        except ValueError:
+            continue
+    return None
+
+
+def to_days(values: np.ndarray) -> np.ndarray:
+    """Coerce date strings to `datetime64[D]`, parsing each distinct value once."""
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[D]")
+    uniques, inverse = np.unique(values.astype(str), return_inverse=True)
+    parsed = np.full(len(uniques), np.datetime64("NaT"), dtype="datetime64[D]")
+    for i, cell in enumerate(uniques):
+        ordinal = _parse_date(cell)
+        if ordinal is not None:
+            parsed[i] = np.datetime64(datetime.fromordinal(ordinal).date(), "D")
+    return parsed[inverse]
+
+
+def _infer_kind(name: str, values: np.ndarray) -> str | None:
+    if values.dtype.kind == "f":
+        return "amount"
+    if values.dtype.kind == "M":
+        return "date"
+    sample = [str(v) for v in values[:1000] if str(v).strip()]
+    if not sample:
+        return None
+    if not np.isnan(to_float(np.array(sample, dtype=object))).any():
+        return "amount"
+    if all(_parse_date(v) is not None for v in sample):
+        return "date"
+    normalized = _normalize(name)
+    if "currenc" in normalized or "ccy" in normalized:
+        return "currency"
+    return None
+
+
+def _is_additive(name: str) -> bool:
+    normalized = _normalize(name)
+    return not any(marker in normalized for marker in _NON_ADDITIVE_MARKERS)
+
+
+def _amount_severity(spec: FieldSpec, nbim_values: np.ndarray, custody_values: np.ndarray) -> np.ndarray:
+    """Per-event severity of an amount mismatch from the field's role and the size of the difference."""
+    normalized = _normalize(spec.nbim_field)
+    severity = next((level for pattern, level in _AMOUNT_SEVERITY if pattern.search(normalized)), "moderate")
+    if severity == "major":
+        return np.full(len(nbim_values), "major", dtype=object)
+    difference = np.abs(nbim_values - custody_values)
+    with np.errstate(invalid="ignore"):
+        material = difference >= MATERIAL_RELATIVE_DIFFERENCE * np.maximum(np.abs(nbim_values), np.abs(custody_values))
+        if spec.additive:
+            material |= difference >= MATERIAL_AMOUNT
+    return np.where(material, severity, "minor").astype(object)
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def _custody_formula(columns: tuple[str, ...], expression: str) -> Formula | None:
+    """Compile an expression against the custody columns; cached per header and expression."""
+    try:
+        return compile_formula(expression, lambda name: _resolve(dict.fromkeys(columns), name))
+    except FormulaError as e:
+        logger.warning(f"Custody expression not compilable, field not compared: {e}")
+        return None
+
+
+def _field_specs(validation_results: dict[str, Any], nbim: Columns, custody: Columns, key_columns: set[str]) -> list[FieldSpec]:
+    plan = validation_results.get("mapping_plan") or {}
+    structural = validation_results.get("structural_validation") or {}
+    unusable = {_normalize(_strip_source(item.get("column", ""))) for item in structural.get("datatype_mismatches") or []}
+
+    candidates: list[tuple[str, str, str, str]] = []
+    for item in plan.get("mapped_columns") or []:
+        mapping_type = (item.get("mapping_type") or "direct").lower()
+        expression = item.get("custody_column") or ""
+        if "derived" in mapping_type and item.get("formula"):
+            expression = item["formula"]
+        candidates.append((item.get("nbim_column", ""), expression, mapping_type, item.get("formula") or ""))
+    for item in plan.get("derived_relationships") or []:
+        candidates.append((item.get("nbim_field", ""), item.get("formula", ""), "derived", item.get("formula") or ""))
+
+    specs: list[FieldSpec] = []
+    seen: set[str] = set()
+    for nbim_name, expression, mapping_type, formula in candidates:
+        nbim_field = _resolve(nbim, nbim_name)
+        if nbim_field is None or nbim_field in key_columns or nbim_field in seen:
+            continue
+        if _normalize(nbim_field) in unusable:
+            continue
+        if "=" in expression:
+            expression = expression.split("=", 1)[1]
+        compiled = _custody_formula(tuple(custody), expression.replace("←", ""))
+        if compiled is None:
+            logger.debug(f"Skipping {nbim_field}: custody expression {expression!r} not resolvable")
+            continue
+        if any(_normalize(column) in unusable for column in compiled.columns):
+            continue
+        kind = _infer_kind(nbim_field, nbim[nbim_field])
+        if kind is None or (kind != "amount" and compiled.column is None):
+            continue
+        seen.add(nbim_field)
+        specs.append(FieldSpec(
+            nbim_field=nbim_field,
+            custody_field=compiled.text,
+            mapping_type=mapping_type,
+            formula=formula,
+            expression=compiled,
+            kind=kind,
+            additive=_is_additive(nbim_field),
+        ))
+    return specs
+
+
+def _key_columns(nbim: Columns, custody: Columns, validation_results: dict[str, Any]) -> tuple[list[str], list[str]]:
+    """Pick the `coac_event_key` column, or compose one from ISIN/dates/account."""
+    nbim_key = _find_alias(nbim, _KEY_ALIASES)
+    custody_key = _find_alias(custody, _KEY_ALIASES)
+    if nbim_key and custody_key:
+        return [nbim_key], [custody_key]
+
+    direct = {}
+    for item in (validation_results.get("mapping_plan") or {}).get("mapped_columns") or []:
+        if (item.get("mapping_type") or "").lower() == "direct":
+            direct[_normalize(_strip_source(item.get("nbim_column", "")))] = item.get("custody_column", "")
+
+    nbim_cols: list[str] = []
+    custody_cols: list[str] = []
+    for aliases in _COMPOSITE_KEY_ROLES:
+        nbim_col = _find_alias(nbim, aliases)
+        if nbim_col is None:
+            continue
+        custody_col = _resolve(custody, direct[_normalize(nbim_col)]) if _normalize(nbim_col) in direct else None
+        custody_col = custody_col or _find_alias(custody, aliases)
+        if custody_col is None:
+            continue
+        nbim_cols.append(nbim_col)
+        custody_cols.append(custody_col)
+    if not nbim_cols or _find_alias({c: None for c in nbim_cols}, ("isin",)) is None:
+        raise EngineUnavailable("No coac_event_key or ISIN-based composite key available")
+    return nbim_cols, custody_cols
+
+
+def _as_text(values: np.ndarray) -> np.ndarray:
+    """Render a typed column as stripped strings usable in join keys."""
+    if values.dtype.kind == "f":
+        finite = np.isfinite(values)
+        if np.all(values[finite] == np.round(values[finite])):
+            return np.where(finite, np.nan_to_num(values).astype(np.int64).astype(str), "")
+        return np.where(finite, values.astype(str), "")
+    if values.dtype.kind == "M":
+        return np.where(np.isnat(values), "", values.astype("datetime64[D]").astype(str))
+    return np.char.strip(values.astype(str))
+
+
+def _factorize(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Distinct values in first-seen order and each row's code, with one hash lookup per row."""
+    cells = values.tolist()
+    index = dict(zip(dict.fromkeys(cells), count()))
+    codes = np.fromiter(map(index.__getitem__, cells), dtype=np.int64, count=len(cells))
+    uniques = np.empty(len(index), dtype=object)
+    uniques[:] = list(index)
+    return uniques, codes
+
+
+def _distinct(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    if values.dtype.kind == "O":
+        return _factorize(values)
+    # Fixed-width values factorize faster with numpy's sort than through a dict
+    uniques, codes = np.unique(values, return_inverse=True)
+    return uniques, codes.reshape(-1)
+
+
+def _key_text(name: str, uniques: np.ndarray, composite: bool) -> np.ndarray:
+    text = _as_text(uniques)
+    if composite and _infer_kind(name, text) == "date":
+        # Composite keys must not depend on each side's date formatting.
+        days = to_days(text)
+        text = np.where(np.isnat(days), text, days.astype(str))
+    return text
+
+
+def _key_part(name: str, nbim_values: np.ndarray, custody_values: np.ndarray, composite: bool) -> tuple[np.ndarray, np.ndarray]:
+    """Key text of each distinct value of one key column pair, and each row's code into it.
+
+    Codes cover NBIM rows first, then custody rows. Normalisation (stripping,
+    date parsing) runs once per distinct value.
+    """
+    if nbim_values.dtype.kind == custody_values.dtype.kind:
+        sides = [np.concatenate([nbim_values, custody_values])]
+    else:
+        sides = [nbim_values, custody_values]
+    texts, codes, offset = [], [], 0
+    for values in sides:
+        uniques, side_codes = _distinct(values)
+        text = _key_text(name, uniques, composite).astype(object)
+        # Distinct numbers and dates render to distinct text, and unchanged strings stay distinct
+        if len(sides) == 1 and (uniques.dtype.kind != "O" or (text == uniques).all()):
+            return text, side_codes
+        texts.append(text)
+        codes.append(side_codes + offset)
+        offset += len(uniques)
+    text, remap = _factorize(np.concatenate(texts))
+    return text, remap[np.concatenate(codes)]
+
+
+def _event_codes(nbim: Columns, custody: Columns, nbim_cols: list[str], custody_cols: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Key strings and per-row key codes of both datasets in one shared code space."""
+    composite = len(nbim_cols) > 1
+    parts = []
+    combined = None
+    for nbim_col, custody_col in zip(nbim_cols, custody_cols):
+        text, codes = _key_part(nbim_col, nbim[nbim_col], custody[custody_col], composite)
+        parts.append((text, codes))
+        if combined is None:
+            combined = codes
+        else:
+            # Renumber after every part so the mixed-radix code stays within int64
+            _, combined = np.unique(combined * len(text) + codes, return_inverse=True)
+            combined = combined.reshape(-1)
+    if len(parts) == 1:
+        keys, codes = parts[0]
+    else:
+        _, first, combined = np.unique(combined, return_index=True, return_inverse=True)
+        joined = np.empty(len(first), dtype=object)
+        joined[:] = ["|".join(values) for values in zip(*(text[codes[first]].tolist() for text, codes in parts))]
+        keys, remap = _factorize(joined)
+        codes = remap[combined.reshape(-1)]
+    n_nbim = len(nbim[nbim_cols[0]])
+    return keys, codes[:n_nbim], codes[n_nbim:]
+
+
+class _Side:
+    """Per-key aggregates for one dataset, indexed by global key code."""
+
+    def __init__(self, columns: Columns, codes: np.ndarray, n_keys: int):
+        self.columns = columns
+        self.codes = codes
+        self.n_keys = n_keys
+        self.counts = np.bincount(codes, minlength=n_keys)
+        self.present = self.counts > 0
+        unique_codes, first_rows = np.unique(codes, return_index=True)
+        self.first_row = np.full(n_keys, -1)
+        self.first_row[unique_codes] = first_rows
+        self._numeric: dict[tuple[str, str | None], np.ndarray] = {}
+
+    def numeric(self, name: str, aggregate: str | None = None) -> np.ndarray:
+        """Per-key values of a numeric column: summed if additive or `aggregate` is "sum", else averaged."""
+        if (name, aggregate) not in self._numeric:
+            values = to_float(self.columns[name])
+            valid = ~np.isnan(values)
+            sums = np.bincount(self.codes[valid], weights=values[valid], minlength=self.n_keys)
+            valid_counts = np.bincount(self.codes[valid], minlength=self.n_keys)
+            summed = aggregate == "sum" or (aggregate is None and _is_additive(name))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                aggregated = sums if summed else sums / valid_counts
+            aggregated[valid_counts == 0] = np.nan
+            self._numeric[name, aggregate] = aggregated
+        return self._numeric[name, aggregate]
+
+    def first(self, name: str) -> np.ndarray:
+        values = self.columns[name]
+        if values.dtype.kind == "f":
+            out = np.full(self.n_keys, np.nan)
+        elif values.dtype.kind == "M":
+            out = np.full(self.n_keys, np.datetime64("NaT"), dtype=values.dtype)
+        else:
+            out = np.full(self.n_keys, None, dtype=object)
+        rows = self.first_row >= 0
+        out[rows] = values[self.first_row[rows]]
+        return out
+
+    def evaluate(self, formula: Formula) -> np.ndarray:
+        """Evaluate a compiled formula over per-key aggregates."""
+        return formula.evaluate(self.numeric, self.n_keys)
+
+
+def _format_number(value: float) -> str:
+    text = f"{value:.6f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def _format_day(value: np.datetime64) -> str:
+    return str(value.astype("datetime64[D]"))
+
+
+def event_keys(nbim: Columns, custody: Columns, validation_results: dict[str, Any]) -> tuple[list[str], list[str], np.ndarray, np.ndarray]:
+    """Key columns and per-row `coac_event_key` strings for both datasets.
+
+    Rows without a usable key get an empty string.
+    """
+    if not nbim or not custody:
+        raise EngineUnavailable("Both datasets must contain a header and rows")
+    nbim_key_cols, custody_key_cols = _key_columns(nbim, custody, validation_results)
+    keys, nbim_codes, custody_codes = _event_codes(nbim, custody, nbim_key_cols, custody_key_cols)
+    return nbim_key_cols, custody_key_cols, keys[nbim_codes], keys[custody_codes]
+
+
+@dataclass
+class EventJoin:
+    """Both datasets hash-joined on `coac_event_key`.
+
+    `keys[code]` is the key of event `code`; `nbim` and `custody` hold the
+    per-event aggregates of each side, so several custody rows booked against
+    one event are rolled up before they are compared (additive fields summed,
+    rates and prices averaged).
+    """
+
+    nbim_key_columns: list[str]
+    custody_key_columns: list[str]
+    keys: np.ndarray
+    nbim: _Side
+    custody: _Side
+
+    @property
+    def matched(self) -> np.ndarray:
+        """Codes of events booked on both sides."""
+        return np.flatnonzero(self.nbim.present & self.custody.present)
+
+    @property
+    def nbim_only(self) -> np.ndarray:
+        return np.flatnonzero(self.nbim.present & ~self.custody.present)
+
+    @property
+    def custody_only(self) -> np.ndarray:
+        return np.flatnonzero(self.custody.present & ~self.nbim.present)
+
+    def summary(self) -> dict[str, int]:
+        return {
+            "events": len(self.keys),
+            "matched": int((self.nbim.present & self.custody.present).sum()),
+            "nbim_only": int((self.nbim.present & ~self.custody.present).sum()),
+            "custody_only": int((self.custody.present & ~self.nbim.present).sum()),
+            "nbim_rows": len(self.nbim.codes),
+            "custody_rows": len(self.custody.codes),
+        }
+
+
+def join_events(nbim: Columns, custody: Columns, validation_results: dict[str, Any]) -> EventJoin:
+    """Hash-join both datasets on `coac_event_key`; rows without a key are dropped."""
+    if not nbim or not custody:
+        raise EngineUnavailable("Both datasets must contain a header and rows")
+    nbim_key_cols, custody_key_cols = _key_columns(nbim, custody, validation_results)
+    keys, nbim_codes, custody_codes = _event_codes(nbim, custody, nbim_key_cols, custody_key_cols)
+
+    empty = np.flatnonzero(keys == "")
+    if len(empty):
+        code = int(empty[0])
+        nbim_valid = nbim_codes != code
+        custody_valid = custody_codes != code
+        logger.info(f"Dropping {int((~nbim_valid).sum() + (~custody_valid).sum())} rows without coac_event_key")
+        nbim = {name: values[nbim_valid] for name, values in nbim.items()}
+        custody = {name: values[custody_valid] for name, values in custody.items()}
+        nbim_codes = nbim_codes[nbim_valid]
+        custody_codes = custody_codes[custody_valid]
+        keys = np.delete(keys, code)
+        nbim_codes = nbim_codes - (nbim_codes > code)
+        custody_codes = custody_codes - (custody_codes > code)
+
+    return EventJoin(
+        nbim_key_cols, custody_key_cols, keys,
+        _Side(nbim, nbim_codes, len(keys)), _Side(custody, custody_codes, len(keys)),
+    )
+
+
+def detect_breaks(nbim: Columns, custody: Columns, validation_results: dict[str, Any]) -> list[dict[str, Any]]:
+    """Detect breaks between NBIM and Custody columns using the mapping plan.
+
+    Returns dicts shaped like `BreakClassifierSchema__BreaksFoundItem`, with the
+    severity rules (E) and deduplication rule (F) of the break classifier
+    prompt applied, sorted by `coac_event_key`.
+    """
+    join = join_events(nbim, custody, validation_results)
+    nbim_key_cols, custody_key_cols = join.nbim_key_columns, join.custody_key_columns
+    all_keys = join.keys
+    n_keys = len(all_keys)
+    left, right = join.nbim, join.custody
+    both = left.present & right.present
+
+    critical = bool(validation_results.get("critical"))
+    specs = _field_specs(validation_results, left.columns, right.columns, set(nbim_key_cols))
+    timestamp = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    currency_spec = next((spec for spec in specs if spec.kind == "currency"), None)
+    currencies = left.first(currency_spec.nbim_field) if currency_spec else None
+
+    breaks: list[dict[str, Any]] = []
+
+    def emit(code: int, spec_fields: dict[str, Any], severity: str, comment: str) -> None:
+        if critical:
+            severity = "major"
+            comment = f"{comment} {CRITICAL_COMMENT}"
+        breaks.append({
+            "coac_event_key": str(all_keys[code]),
+            **spec_fields,
+            "severity": severity,
+            "comment": comment,
+            "upstream_critical_flag": critical,
+            "timestamp_detected": timestamp,
+        })
+
+    key_label = " + ".join(nbim_key_cols)
+    custody_key_label = " + ".join(custody_key_cols)
+    for code in join.nbim_only:
+        emit(int(code), {
+            "break_type": "missing_record", "mapping_type": "key",
+            "nbim_field": key_label, "custody_field": custody_key_label,
+            "nbim_value": str(all_keys[code]), "custody_value": None,
+            "formula": "", "difference_value": None,
+        }, "major", "Event booked in NBIM but absent in Custody.")
+    for code in join.custody_only:
+        emit(int(code), {
+            "break_type": "missing_record", "mapping_type": "key",
+            "nbim_field": key_label, "custody_field": custody_key_label,
+            "nbim_value": None, "custody_value": str(all_keys[code]),
+            "formula": "", "difference_value": None,
+        }, "moderate", "Event present in Custody but not booked in NBIM.")
+
+    for spec in specs:
+        fields = {"mapping_type": spec.mapping_type, "nbim_field": spec.nbim_field,
+                  "custody_field": spec.custody_field, "formula": spec.formula}
+        if spec.kind == "amount":
+            nbim_values = left.numeric(spec.nbim_field)
+            custody_values = right.evaluate(spec.expression)
+            difference = nbim_values - custody_values
+            tolerance = AMOUNT_TOLERANCE if spec.additive else RATE_TOLERANCE
+            with np.errstate(invalid="ignore"):
+                mask = both & ~np.isnan(difference) & (np.abs(difference) >= tolerance)
+            severity = _amount_severity(spec, nbim_values, custody_values)
+            for code in np.flatnonzero(mask):
+                nv, cv = _format_number(nbim_values[code]), _format_number(custody_values[code])
+                suffix = f" ({currencies[code]})" if currencies is not None and currencies[code] else ""
+                emit(int(code), {
+                    **fields, "break_type": "amount_mismatch",
+                    "nbim_value": nv, "custody_value": cv,
+                    "difference_value": round(float(difference[code]), 6),
+                }, severity[code], f"{spec.nbim_field} mismatch {nv} vs {cv}{suffix}.")
+        elif spec.kind == "date":
+            nbim_days = to_days(left.first(spec.nbim_field))
+            custody_days = to_days(right.first(spec.expression.column))
+            comparable = both & ~np.isnat(nbim_days) & ~np.isnat(custody_days)
+            mask = comparable & (nbim_days != custody_days)
+            for code in np.flatnonzero(mask):
+                offset = int(np.busday_count(nbim_days[code], custody_days[code]))
+                if offset == 0:
+                    offset = int((custody_days[code] - nbim_days[code]).astype(int))
+                nv, cv = _format_day(nbim_days[code]), _format_day(custody_days[code])
+                emit(int(code), {
+                    **fields, "break_type": "date_mismatch",
+                    "nbim_value": nv, "custody_value": cv,
+                    "difference_value": float(offset),
+                }, "minor" if abs(offset) <= 1 else "moderate",
+                    f"{spec.nbim_field} differs by {abs(offset)} business day(s): {nv} vs {cv}.")
+        else:
+            nbim_values = np.char.upper(np.char.strip(left.first(spec.nbim_field).astype(str)))
+            custody_values = np.char.upper(np.char.strip(right.first(spec.expression.column).astype(str)))
+            mask = both & (nbim_values != custody_values)
+            for code in np.flatnonzero(mask):
+                emit(int(code), {
+                    **fields, "break_type": "currency_mismatch",
+                    "nbim_value": str(nbim_values[code]), "custody_value": str(custody_values[code]),
+                    "difference_value": None,
+                }, "moderate", f"Currency {nbim_values[code]} vs {custody_values[code]}; possible FX settlement.")
+
+    breaks = merge_breaks([breaks])
+    logger.info(f"Break engine compared {n_keys} events across {len(specs)} fields: {len(breaks)} breaks")
+    return breaks
+
+
+def deduplicate(breaks: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Apply rule (F): one break per key, type, NBIM value and Custody value.
+
+    When duplicates collide the most severe one is kept.
+    """
+    unique: dict[tuple, dict[str, Any]] = {}
+    for item in breaks:
+        identity = (item["coac_event_key"], item["break_type"], item["nbim_value"], item["custody_value"])
+        kept = unique.get(identity)
+        if kept is None or SEVERITY_RANK.get(item["severity"], 0) > SEVERITY_RANK.get(kept["severity"], 0):
+            unique[identity] = item
+    return list(unique.values())
+
+
+def merge_breaks(batches: Iterable[list[dict[str, Any]]]) -> list[dict[str, Any]]:
+    """Merge break lists from several detectors or shards into one sorted, deduplicated list."""
+    breaks = deduplicate([item for batch in batches for item in batch])
+    breaks.sort(key=lambda item: (item["coac_event_key"], item["break_type"], item["nbim_field"]))
+    return breaks
+
+
+def breaks_needing_comment(breaks: list[dict[str, Any]], limit: int) -> list[int]:
+    """Indices of breaks whose templated comment should be rewritten by the LLM.
+
+    Only non-minor amount and missing-record breaks carry enough ambiguity to
+    warrant a narrative; the most severe ones are picked first.
+    """
+    wanted = [
+        index for index, item in enumerate(breaks)
+        if item["severity"] != "minor" and item["break_type"] in ("amount_mismatch", "missing_record")
+    ]
+    wanted.sort(key=lambda index: -SEVERITY_RANK.get(breaks[index]["severity"], 0))
+    return sorted(wanted[:limit])
@@ -0,0 +1,406 @@
+"""Deterministic application of `correction_agent` output to the run's NBIM bookings.
+
+Approved corrections (`auto_applied` and not `requires_human_review`) are
+resolved to NBIM cells through `breaks_found` and written column by column
+in one vectorized pass. Each application is appended to the run's patch log
+with the exact previous and new value of every cell it touched. Undo appends
+the inverse patch, and the corrected dataset is rebuilt by replaying the log
+over the uploaded file.
+"""
+import io
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+
+import break_engine
+from ingestion import CsvTable, parse_date, parse_number
+from session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+# Only the internal bookings are corrected; custody data is the external reference.
+DATASET = "nbim"
+MAX_REPORTED_SKIPS = 100
+# `breaks_found` values are rendered with six decimals, so LLM-copied originals are only that exact.
+VALUE_TOLERANCE = 5e-7
+# Applying and undoing replay the log and then append to it; a run's writers are serialized on one of these.
+_RUN_LOCKS = [threading.Lock() for _ in range(64)]
+
+
+class PatchConflict(ValueError):
+    """Raised when a patch cannot be undone, e.g. later patches changed the same cells."""
+
+
+@dataclass
+class Patch:
+    """Cell changes per column: row indices, previous and new values, and the source of each cell.
+
+    `sources` describes the corrections behind the patch; `cells[column][3]`
+    indexes into it.
+    """
+
+    cells: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = field(default_factory=dict)
+    sources: list[dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def cell_count(self) -> int:
+        return sum(len(rows) for rows, _, _, _ in self.cells.values())
+
+    def apply(self, table: CsvTable) -> None:
+        for name, (rows, _, new, _) in self.cells.items():
+            table.assign(name, rows, new.tolist() if table.types[name] == "text" else new)
+
+    def inverted(self, sources: list[dict[str, Any]]) -> "Patch":
+        return Patch({name: (rows, new, old, origin) for name, (rows, old, new, origin) in self.cells.items()}, sources)
+
+    def to_bytes(self) -> bytes:
+        arrays = {
+            "columns": _json_array(list(self.cells)),
+            "sources": _json_array(self.sources),
+        }
+        for position, (rows, old, new, origin) in enumerate(self.cells.values()):
+            if old.dtype == object:
+                old, new = old.astype(str), new.astype(str)
+            arrays.update({f"{position}.rows": rows, f"{position}.old": old, f"{position}.new": new, f"{position}.source": origin})
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Patch":
+        with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+            columns = json.loads(archive["columns"].tobytes())
+            return cls(
+                {
+                    name: tuple(archive[f"{position}.{part}"] for part in ("rows", "old", "new", "source"))
+                    for position, name in enumerate(columns)
+                },
+                json.loads(archive["sources"].tobytes()),
+            )
+
+
+def _json_array(value: Any) -> np.ndarray:
+    return np.frombuffer(json.dumps(value, separators=(",", ":")).encode("utf-8"), dtype=np.uint8)
+
+
+def _same(current: np.ndarray, expected: np.ndarray) -> np.ndarray:
+    """Element-wise equality that treats NaN and NaT as equal to themselves."""
+    equal = current == expected
+    if current.dtype.kind in "fM":
+        missing = np.isnat if current.dtype.kind == "M" else np.isnan
+        equal |= missing(current) & missing(expected)
+    return equal
+
+
+def _run_lock(run_id: str) -> threading.Lock:
+    return _RUN_LOCKS[hash(run_id) % len(_RUN_LOCKS)]
+
+
+def _base(run_id: str) -> str | None:
+    """SHA-256 of the run's current NBIM upload; patches only apply to the upload they were made against."""
+    stored = session_store.get_table(run_id, DATASET, with_data=False)
+    return stored[0] if stored else None
+
+
+def _replay(run_id: str, through: int | None = None) -> tuple[CsvTable, str, list[dict[str, Any]]] | None:
+    """The uploaded table with the run's patch log applied in order, its digest and the replayed patch summaries.
+
+    Patches recorded against an earlier upload of the same run are ignored.
+    """
+    stored = session_store.get_table(run_id, DATASET)
+    if stored is None:
+        return None
+    base, data = stored
+    table = CsvTable.from_bytes(data)
+    replayed = []
+    for summary, data in session_store.get_patches(run_id, through):
+        if summary["base"] == base:
+            Patch.from_bytes(data).apply(table)
+            replayed.append(summary)
+    return table, base, replayed
+
+
+def _parse(kind: str, value: Any) -> Any:
+    text = "" if value is None else str(value).strip()
+    if kind == "number":
+        return parse_number(text)
+    if kind == "date":
+        days = parse_date(text)
+        return None if days is None else np.datetime64(days, "D")
+    return text or None
+
+
+def _matches(kind: str, current: np.ndarray, expected: np.ndarray) -> np.ndarray:
+    """Per cell: does the dataset value equal `expected`, up to the six decimals breaks are reported with."""
+    if kind == "number":
+        with np.errstate(invalid="ignore"):
+            return np.abs(current - expected) < VALUE_TOLERANCE
+    if kind == "date":
+        return current == expected
+    return np.char.upper(np.char.strip(current.astype(str))) == np.char.upper(expected.astype(str))
+
+
+def build_patch(table: CsvTable, custody: CsvTable, corrections: list[dict[str, Any]], state: dict[str, Any]) -> tuple[Patch, Counter, list[dict[str, Any]]]:
+    """Resolve approved corrections to NBIM cells.
+
+    Corrections are matched to breaks one by one; checking them against the
+    dataset happens per column in bulk. Returns the patch plus skip reasons
+    counted and the first `MAX_REPORTED_SKIPS` skipped corrections.
+    """
+    validation_results = state.get("validation_results") or {}
+    approved = [item for item in corrections if item.get("auto_applied") and not item.get("requires_human_review")]
+    skipped: Counter = Counter()
+    examples: list[dict[str, Any]] = []
+
+    def skip(item: dict[str, Any], reason: str) -> None:
+        skipped[reason] += 1
+        if len(examples) < MAX_REPORTED_SKIPS:
+            examples.append({"break_id": item.get("break_id"), "coac_event_key": item.get("coac_event_key"), "reason": reason})
+
+    if validation_results.get("critical"):
+        for item in approved:
+            skip(item, "upstream validation critical")
+        return Patch(), skipped, examples
+    if not approved:
+        return Patch(), skipped, examples
+
+    breaks: dict[tuple[str, str], list[dict[str, Any]]] = {}
+    for item in (state.get("breaks_found_global") or {}).get("breaks_found") or []:
+        breaks.setdefault((item["coac_event_key"], item["break_type"]), []).append(item)
+
+    columns = table.columns()
+    _, _, nbim_keys, _ = break_engine.event_keys(columns, custody.columns(), validation_results)
+    wanted = {item["coac_event_key"] for item in approved}
+    rows_by_key: dict[str, list[int]] = {}
+    keys = nbim_keys.tolist()
+    for row in np.flatnonzero(np.fromiter((key in wanted for key in keys), dtype=bool, count=len(keys))).tolist():
+        rows_by_key.setdefault(keys[row], []).append(row)
+
+    parsed: dict[tuple[str, Any], Any] = {}
+
+    def parse(kind: str, value: Any) -> Any:
+        if (kind, value) not in parsed:
+            parsed[kind, value] = _parse(kind, value)
+        return parsed[kind, value]
+
+    def same(kind: str | None, a: Any, b: Any) -> bool:
+        if kind is None:
+            return str(a).strip() == str(b).strip()
+        a, b = parse(kind, a), parse(kind, b)
+        if a is None or b is None:
+            return False
+        if kind == "number":
+            return abs(a - b) < VALUE_TOLERANCE
+        return a == b if kind == "date" else a.upper() == b.upper()
+
+    # Per column: target rows, new and claimed original value per cell, and the correction behind it
+    pending: list[dict[str, Any]] = []
+    cells: dict[str, tuple[list[int], list[Any], list[Any], list[int]]] = {}
+    for item in approved:
+        key = item["coac_event_key"]
+        candidates = breaks.get((key, item["break_type"]), [])
+        if len(candidates) > 1:
+            candidates = [c for c in candidates if same(table.types.get(c["nbim_field"]), c.get("nbim_value"), item.get("original_value"))]
+        if len(candidates) != 1:
+            skip(item, "no matching break" if not candidates else "ambiguous break")
+            continue
+        found = candidates[0]
+        column = found["nbim_field"]
+        if found.get("mapping_type") == "key" or column not in table.types:
+            skip(item, "not a cell correction")
+            continue
+        rows = rows_by_key.get(key)
+        if not rows:
+            skip(item, "event not in dataset")
+            continue
+        kind = table.types[column]
+        if kind == "number" and len(rows) > 1:
+            skip(item, "event has several NBIM rows")
+            continue
+        new = parse(kind, item.get("corrected_value"))
+        if new is None:
+            skip(item, "unreadable corrected_value")
+            continue
+        original = parse(kind, item.get("original_value"))
+        target_rows, new_values, originals, owners = cells.setdefault(column, ([], [], [], []))
+        target_rows.extend(rows)
+        new_values.extend([new] * len(rows))
+        originals.extend([original] * len(rows))
+        owners.extend([len(pending)] * len(rows))
+        pending.append(item)
+
+    # The dataset is authoritative for previous values: a stale original means the correction no longer fits
+    reasons = np.full(len(pending), "", dtype=object)
+    cell_counts = np.zeros(len(pending), dtype=np.int64)
+    done_counts = np.zeros(len(pending), dtype=np.int64)
+    stale_counts = np.zeros(len(pending), dtype=np.int64)
+    arrays = {}
+    for column, (target_rows, new_values, originals, owners) in cells.items():
+        kind = table.types[column]
+        dtype = columns[column].dtype if kind != "text" else object
+        rows = np.array(target_rows, dtype=np.int64)
+        owner = np.array(owners, dtype=np.int64)
+        new = np.empty(len(rows), dtype=dtype)
+        new[:] = new_values
+        claimed = np.array([value is not None for value in originals])
+        original = np.empty(len(rows), dtype=dtype)
+        original[:] = [value if value is not None else new_value for value, new_value in zip(originals, new_values)]
+        current = columns[column][rows]
+        stale = claimed & ~_matches(kind, current, original)
+        done = _matches(kind, current, new)
+        cell_counts += np.bincount(owner, minlength=len(pending))
+        done_counts += np.bincount(owner, weights=done, minlength=len(pending)).astype(np.int64)
+        stale_counts += np.bincount(owner, weights=stale, minlength=len(pending)).astype(np.int64)
+        arrays[column] = (rows, current, new, owner)
+    # A re-applied correction no longer matches its claimed original, so "already applied" is decided first
+    item_done = (cell_counts > 0) & (done_counts == cell_counts)
+    reasons[item_done] = "already applied"
+    reasons[~item_done & (stale_counts > 0)] = "original_value does not match dataset"
+
+    for column, (rows, current, new, owner) in arrays.items():
+        # Later corrections of a cell already claimed by an earlier one are duplicates
+        keep = reasons[owner] == ""
+        order = np.flatnonzero(keep)
+        _, first = np.unique(rows[order], return_index=True)
+        duplicate = np.ones(len(order), dtype=bool)
+        duplicate[first] = False
+        duplicate_owners = np.unique(owner[order[duplicate]])
+        reasons[duplicate_owners[reasons[duplicate_owners] == ""]] = "duplicate"
+
+    accepted = reasons == ""
+    for index in np.flatnonzero(~accepted).tolist():
+        skip(pending[index], reasons[index])
+    source_of = np.cumsum(accepted) - 1
+    patch = Patch(sources=[
+        {key: pending[index].get(key) for key in ("break_id", "coac_event_key", "break_type", "correction_type")}
+        for index in np.flatnonzero(accepted).tolist()
+    ])
+    for column, (rows, current, new, owner) in arrays.items():
+        keep = accepted[owner]
+        if keep.any():
+            patch.cells[column] = (rows[keep], current[keep], new[keep], source_of[owner[keep]])
+    return patch, skipped, examples
+
+
+def apply_corrections(run_id: str, corrections: list[dict[str, Any]], state: dict[str, Any]) -> dict[str, Any] | None:
+    """Apply approved corrections to the run's NBIM dataset and append them to the patch log.
+
+    Returns None when the run has no stored NBIM and custody uploads.
+    """
+    with _run_lock(run_id):
+        return _apply_corrections(run_id, corrections, state)
+
+
+def _apply_corrections(run_id: str, corrections: list[dict[str, Any]], state: dict[str, Any]) -> dict[str, Any] | None:
+    replayed = _replay(run_id)
+    custody = session_store.get_table(run_id, "custody")
+    if replayed is None or custody is None:
+        return None
+    table, base, _ = replayed
+    started = time.perf_counter()
+    patch, skipped, examples = build_patch(table, CsvTable.from_bytes(custody[1]), corrections, state)
+    resolved_at = time.perf_counter()
+    patch.apply(table)
+    applied_at = time.perf_counter()
+    summary = {
+        "kind": "apply",
+        "base": base,
+        "corrections_applied": len(patch.sources),
+        "cells_changed": patch.cell_count,
+        "columns": {name: len(rows) for name, (rows, _, _, _) in patch.cells.items()},
+        "skipped": dict(skipped),
+    }
+    logger.info(f"Resolved {len(corrections)} corrections in {(resolved_at - started) * 1000:.1f} ms, "
+                f"applied {patch.cell_count} cells in {(applied_at - resolved_at) * 1000:.1f} ms")
+    if patch.cell_count:
+        summary["seq"] = session_store.append_patch(run_id, summary, patch.to_bytes())
+    else:
+        summary["seq"] = None
+    return {**summary, "skipped_examples": examples}
+
+
+def patch_log(run_id: str) -> list[dict[str, Any]]:
+    """Summaries of the run's patches against its current upload, oldest first."""
+    base = _base(run_id)
+    return [summary for summary, _ in session_store.get_patches(run_id, with_data=False) if summary["base"] == base]
+
+
+def _find(run_id: str, seq: int) -> tuple[dict[str, Any], Patch]:
+    base = _base(run_id)
+    for summary, data in session_store.get_patches(run_id, seq):
+        if summary["seq"] == seq and summary["base"] == base:
+            return summary, Patch.from_bytes(data)
+    raise KeyError(f"Unknown patch {seq} for run {run_id}")
+
+
+def audit(run_id: str, seq: int) -> dict[str, Any]:
+    """Every cell a patch changed, with its previous and new value and the correction behind it."""
+    summary, patch = _find(run_id, seq)
+    changes = []
+    for column, (rows, old, new, origin) in patch.cells.items():
+        for row, previous, value, source in zip(rows.tolist(), old.tolist(), new.tolist(), origin.tolist()):
+            changes.append({"row": row, "column": column, "previous": _json_value(previous), "new": _json_value(value), **patch.sources[source]})
+    changes.sort(key=lambda change: (change["row"], change["column"]))
+    return {"patch": summary, "changes": changes}
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, float) and value != value:
+        return None
+    return value if isinstance(value, (str, int, float)) or value is None else str(value)
+
+
+def _undone(history: list[dict[str, Any]], seq: int) -> bool:
+    """Whether patch `seq` is reverted: undone by a patch that was not itself undone (a redo)."""
+    return any(item.get("undoes") == seq and not _undone(history, item["seq"]) for item in history)
+
+
+def undo(run_id: str, seq: int) -> dict[str, Any]:
+    """Append the inverse of patch `seq`; undoing an undo patch redoes what it reverted.
+
+    Raises KeyError for an unknown patch and PatchConflict if it is currently
+    undone or later patches changed any of its cells.
+    """
+    with _run_lock(run_id):
+        return _undo(run_id, seq)
+
+
+def _undo(run_id: str, seq: int) -> dict[str, Any]:
+    summary, patch = _find(run_id, seq)
+    replayed = _replay(run_id)
+    if replayed is None:
+        raise KeyError(f"Run {run_id} has no stored {DATASET} dataset")
+    table, _, history = replayed
+    if _undone(history, seq):
+        raise PatchConflict(f"Patch {seq} was already undone")
+    columns = table.columns(list(patch.cells))
+    changed = sum(int((~_same(columns[name][rows], new)).sum()) for name, (rows, _, new, _) in patch.cells.items())
+    if changed:
+        raise PatchConflict(f"{changed} cells of patch {seq} were changed by later patches")
+    inverse = patch.inverted([{**source, "undoes": seq} for source in patch.sources])
+    undo_summary = {
+        "kind": "undo",
+        "base": summary["base"],
+        "undoes": seq,
+        "corrections_applied": len(inverse.sources),
+        "cells_changed": inverse.cell_count,
+        "columns": summary["columns"],
+        "skipped": {},
+    }
+    undo_summary["seq"] = session_store.append_patch(run_id, undo_summary, inverse.to_bytes())
+    return undo_summary
+
+
+def corrected_csv(run_id: str, through: int | None = None) -> str | None:
+    """The NBIM dataset with the patch log replayed, optionally only up to patch `through`.
+
+    Written in the uploaded file's dialect: its delimiter, decimal separator and date formats.
+    """
+    replayed = _replay(run_id, through)
+    return None if replayed is None else replayed[0].export_csv()
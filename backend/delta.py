@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+import break_engine
+from ingestion import CsvTable
+
+logger = logging.getLogger(__name__)
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, applied element-wise."""
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def _column_hashes(table: CsvTable, name: str) -> np.ndarray:
+    if table.types[name] == "text":
+        # Hash each distinct value once and gather by code
+        dictionary = table.dictionary(name)
+        hashed = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little") for value in dictionary),
+            dtype=np.uint64, count=len(dictionary),
+        )
+        return hashed[table.codes(name)]
+    values = table.columns([name])[name]
+    if values.dtype.kind == "f":
+        return np.where(np.isnan(values), np.nan, values).view(np.uint64)
+    return values.view(np.int64).view(np.uint64)
+
+
+def row_hashes(table: CsvTable) -> np.ndarray:
+    """A 64-bit hash of every row's typed values, in column order."""
+    h = np.zeros(len(table), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for position, name in enumerate(table.header):
+            h = _mix(h ^ (_column_hashes(table, name) + _GOLDEN * np.uint64(position + 1)))
+    return h
+
+
+def _sum_by_key(keys: np.ndarray, hashes: np.ndarray, all_keys: np.ndarray) -> np.ndarray:
+    """Per-key wrapping sum of row hashes: order-insensitive, but sensitive to duplicated rows."""
+    sums = np.zeros(len(all_keys), dtype=np.uint64)
+    if len(keys):
+        codes = np.searchsorted(all_keys, keys)
+        order = np.argsort(codes, kind="stable")
+        sorted_codes = codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        with np.errstate(over="ignore"):
+            sums[sorted_codes[starts]] = np.add.reduceat(hashes[order], starts)
+    return sums
+
+
+def event_digests(nbim: CsvTable, custody: CsvTable, validation_results: dict[str, Any]) -> dict[str, str]:
+    """Digest of each `coac_event_key`'s NBIM and custody rows; rows without a key are ignored."""
+    _, _, nbim_keys, custody_keys = break_engine.event_keys(nbim.columns(), custody.columns(), validation_results)
+    all_keys = np.unique(np.concatenate([nbim_keys, custody_keys]))
+    nbim_sums = _sum_by_key(nbim_keys, row_hashes(nbim), all_keys)
+    custody_sums = _sum_by_key(custody_keys, row_hashes(custody), all_keys)
+    return {
+        str(key): f"{int(n):016x}{int(c):016x}"
+        for key, n, c in zip(all_keys.tolist(), nbim_sums.tolist(), custody_sums.tolist())
+        if key != ""
+    }
+
+
+def basis(layout: str, validation_results: dict[str, Any]) -> str:
+    """Digests are only comparable between runs with the same layout and mapping plan."""
+    plan = json.dumps(validation_results.get("mapping_plan", {}), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{layout}:{plan}".encode("utf-8")).hexdigest()
+
+
+@dataclass
+class EventDelta:
+    inserted: set[str]
+    changed: set[str]
+    deleted: set[str]
+    unchanged: set[str]
+
+    @property
+    def reprocess(self) -> set[str]:
+        return self.inserted | self.changed
+
+    def summary(self) -> dict[str, int]:
+        return {name: len(getattr(self, name)) for name in ("inserted", "changed", "deleted", "unchanged")}
+
+
+def diff(previous: dict[str, str], current: dict[str, str]) -> EventDelta:
+    inserted = current.keys() - previous.keys()
+    deleted = previous.keys() - current.keys()
+    common = current.keys() & previous.keys()
+    changed = {key for key in common if current[key] != previous[key]}
+    return EventDelta(set(inserted), changed, set(deleted), common - changed)
+
+
+def restrict(nbim: CsvTable, custody: CsvTable, validation_results: dict[str, Any], keys: set[str]) -> tuple[CsvTable, CsvTable]:
+    """Both tables reduced to the rows of the given events."""
+    _, _, nbim_keys, custody_keys = break_engine.event_keys(nbim.columns(), custody.columns(), validation_results)
+    # Set membership: np.isin on object arrays degrades to a pairwise comparison
+    def rows(row_keys: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(np.fromiter((key in keys for key in row_keys.tolist()), dtype=bool, count=len(row_keys)))
+
+    return nbim.take(rows(nbim_keys)), custody.take(rows(custody_keys))
+
+
+def carry_forward_breaks(previous: list[dict[str, Any]], unchanged: set[str]) -> list[dict[str, Any]]:
+    return [item for item in previous if item["coac_event_key"] in unchanged]
+
+
+def merge_classified(previous: dict[str, Any], unchanged: set[str], new: dict[str, Any] | None, total_breaks: int) -> dict[str, Any]:
+    """Carried-forward candidates of unchanged events plus the new classification, renumbered."""
+    auto = [item for item in previous.get("auto_candidates", []) if item["coac_event_key"] in unchanged]
+    manual = [item for item in previous.get("manual_candidates", []) if item["coac_event_key"] in unchanged]
+    if new is not None:
+        auto += new["auto_candidates"]
+        manual += new["manual_candidates"]
+    for break_id, item in enumerate(auto + manual, start=1):
+        item["break_id"] = break_id
+    return {
+        "auto_candidates": auto,
+        "manual_candidates": manual,
+        "summary": {
+            "total_breaks": total_breaks,
+            "auto_batch_size": len(auto),
+            "manual_batch_size": len(manual),
+            "awaiting_user_confirmation": any(not item["approved_for_auto_correction"] for item in auto),
+        },
+    }
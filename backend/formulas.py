@@ -0,0 +1,290 @@
+"""Safe compiler for `mapping_plan` formulas such as `GROSS_DIV_AMT - WHT_AMT`.
+
+Formulas are parsed with a whitelisted grammar, never `eval`:
+
+    expression := term (("+" | "-") term)*
+    term       := unary (("*" | "/") unary)*
+    unary      := "-" unary | atom
+    atom       := NUMBER | COLUMN | FUNCTION "(" expression ("," expression)* ")"
+                | AGGREGATE "(" COLUMN ")" | "(" expression ")"
+
+with FUNCTION one of `abs`, `min`, `max` and `round`, and AGGREGATE `sum`.
+A compiled `Formula` evaluates over whole columns with NumPy; division by
+zero yields NaN. Columns are read through an operand callback, which also
+receives the aggregate, so `sum(GROSS_AMOUNT)` totals the rows behind each
+value whatever the column's default aggregation.
+"""
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMULA_CACHE_SIZE = int(os.getenv("FORMULA_CACHE_SIZE", "1024"))
+
+_TOKEN_RE = re.compile(r"\s*(?:(\d+(?:\.\d*)?|\.\d+)|([A-Za-z_][\w.]*)|([-+*/(),]))")
+_FUNCTIONS = {"abs": (1, 1), "min": (2, None), "max": (2, None), "round": (1, 2)}
+_AGGREGATES = {"sum"}
+_PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2}
+
+# Parsed nodes are plain tuples so they can be cached and shared:
+#   ("number", text) | ("column", name) | ("negate", node)
+#   ("binary", operator, left, right) | ("call", function, (node, ...))
+#   ("aggregate", function, name)
+Node = tuple
+
+
+class FormulaError(ValueError):
+    """Raised for formulas outside the grammar or referring to unknown columns."""
+
+
+def _tokenize(expression: str) -> list[tuple[str, str]]:
+    tokens: list[tuple[str, str]] = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN_RE.match(expression, position)
+        if not match:
+            raise FormulaError(f"Unexpected character {expression[position:].strip()[:1]!r} in {expression!r}")
+        number, name, symbol = match.groups()
+        tokens.append(("number", number) if number else ("name", name) if name else ("symbol", symbol))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.position = 0
+
+    def parse(self) -> Node:
+        if not self.tokens:
+            raise FormulaError("Empty formula")
+        node = self.expression_()
+        if self.position != len(self.tokens):
+            raise FormulaError(f"Unexpected {self.tokens[self.position][1]!r} in {self.expression!r}")
+        return node
+
+    def peek(self) -> tuple[str, str] | None:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self, symbol: str | None = None) -> tuple[str, str]:
+        token = self.peek()
+        if token is None:
+            raise FormulaError(f"Unexpected end of {self.expression!r}")
+        if symbol is not None and token != ("symbol", symbol):
+            raise FormulaError(f"Expected {symbol!r} but found {token[1]!r} in {self.expression!r}")
+        self.position += 1
+        return token
+
+    def binary(self, operand: Callable[[], Node], operators: str) -> Node:
+        node = operand()
+        while (token := self.peek()) is not None and token[0] == "symbol" and token[1] in operators:
+            self.position += 1
+            node = ("binary", token[1], node, operand())
+        return node
+
+    def expression_(self) -> Node:
+        return self.binary(self.term, "+-")
+
+    def term(self) -> Node:
+        return self.binary(self.unary, "*/")
+
+    def unary(self) -> Node:
+        if self.peek() == ("symbol", "-"):
+            self.position += 1
+            return ("negate", self.unary())
+        return self.atom()
+
+    def atom(self) -> Node:
+        kind, text = self.take()
+        if kind == "number":
+            return ("number", text)
+        if kind == "symbol":
+            if text != "(":
+                raise FormulaError(f"Unexpected {text!r} in {self.expression!r}")
+            node = self.expression_()
+            self.take(")")
+            return node
+        if self.peek() != ("symbol", "("):
+            return ("column", text)
+        function = text.lower()
+        if function in _AGGREGATES:
+            self.take("(")
+            kind, name = self.take()
+            if kind != "name":
+                raise FormulaError(f"{function}() takes a column name, not {name!r}")
+            self.take(")")
+            return ("aggregate", function, name)
+        if function not in _FUNCTIONS:
+            raise FormulaError(f"Function {text!r} is not allowed in {self.expression!r}")
+        self.take("(")
+        arguments = [self.expression_()]
+        while self.peek() == ("symbol", ","):
+            self.position += 1
+            arguments.append(self.expression_())
+        self.take(")")
+        least, most = _FUNCTIONS[function]
+        if len(arguments) < least or (most is not None and len(arguments) > most):
+            raise FormulaError(f"{function}() takes {least}{'' if most == least else '+' if most is None else f'-{most}'} arguments")
+        if function == "round" and len(arguments) == 2 and arguments[1][0] != "number":
+            raise FormulaError("round() digits must be a literal number")
+        return ("call", function, tuple(arguments))
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def parse(expression: str) -> Node:
+    """Parse a formula into a node tree; cached per expression string."""
+    return _Parser(expression).parse()
+
+
+def _columns(node: Node) -> list[str]:
+    if node[0] == "column":
+        return [node[1]]
+    if node[0] == "aggregate":
+        return [node[2]]
+    if node[0] == "negate":
+        return _columns(node[1])
+    if node[0] == "binary":
+        return _columns(node[2]) + _columns(node[3])
+    if node[0] == "call":
+        return [name for argument in node[2] for name in _columns(argument)]
+    return []
+
+
+def _bind(node: Node, resolve: Callable[[str], str | None], unknown: list[str]) -> Node:
+    if node[0] == "column":
+        column = resolve(node[1])
+        if column is None:
+            unknown.append(node[1])
+            return node
+        return ("column", column)
+    if node[0] == "aggregate":
+        column = resolve(node[2])
+        if column is None:
+            unknown.append(node[2])
+            return node
+        return ("aggregate", node[1], column)
+    if node[0] == "negate":
+        return ("negate", _bind(node[1], resolve, unknown))
+    if node[0] == "binary":
+        return ("binary", node[1], _bind(node[2], resolve, unknown), _bind(node[3], resolve, unknown))
+    if node[0] == "call":
+        return ("call", node[1], tuple(_bind(argument, resolve, unknown) for argument in node[2]))
+    return node
+
+
+def _render(node: Node, parent: int = 0, right: bool = False) -> str:
+    if node[0] in ("number", "column"):
+        return node[1]
+    if node[0] == "negate":
+        return f"-{_render(node[1], 3)}"
+    if node[0] == "aggregate":
+        return f"{node[1]}({node[2]})"
+    if node[0] == "call":
+        return f"{node[1]}({', '.join(_render(argument) for argument in node[2])})"
+    precedence = _PRECEDENCE[node[1]]
+    text = f"{_render(node[2], precedence)} {node[1]} {_render(node[3], precedence, right=True)}"
+    # Right operands of the same precedence keep their parentheses: a - (b - c)
+    if precedence < parent or (right and precedence == parent):
+        return f"({text})"
+    return text
+
+
+# operand(name, aggregate) supplies a column; aggregate is None for a bare reference
+Operand = Callable[[str, str | None], np.ndarray]
+
+
+def _divide(left, right):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(right == 0, np.nan, np.divide(left, right))
+
+
+_BINARY = {"+": np.add, "-": np.subtract, "*": np.multiply, "/": _divide}
+
+
+def _compile(node: Node) -> Callable[[Operand], np.ndarray | float]:
+    """Turn a bound node tree into nested closures over whole columns."""
+    if node[0] == "number":
+        value = float(node[1])
+        return lambda operand: value
+    if node[0] == "column":
+        name = node[1]
+        return lambda operand: operand(name, None)
+    if node[0] == "aggregate":
+        function, name = node[1], node[2]
+        return lambda operand: operand(name, function)
+    if node[0] == "negate":
+        inner = _compile(node[1])
+        return lambda operand: np.negative(inner(operand))
+    if node[0] == "binary":
+        function, left, right = _BINARY[node[1]], _compile(node[2]), _compile(node[3])
+
+        def binary(operand: Operand):
+            with np.errstate(invalid="ignore", over="ignore"):
+                return function(left(operand), right(operand))
+        return binary
+    arguments = [_compile(argument) for argument in node[2]]
+    if node[1] == "abs":
+        return lambda operand: np.abs(arguments[0](operand))
+    if node[1] == "round":
+        digits = int(float(node[2][1][1])) if len(arguments) == 2 else 0
+        return lambda operand: np.round(arguments[0](operand), digits)
+    reduce = np.minimum if node[1] == "min" else np.maximum
+
+    def extreme(operand: Operand):
+        result = arguments[0](operand)
+        for argument in arguments[1:]:
+            result = reduce(result, argument(operand))
+        return result
+    return extreme
+
+
+@dataclass(frozen=True)
+class Formula:
+    """A formula bound to concrete column names, ready to evaluate."""
+
+    source: str
+    text: str
+    columns: tuple[str, ...]
+    node: Node = field(repr=False)
+    _function: Callable[[Operand], np.ndarray | float] = field(repr=False, compare=False)
+
+    @property
+    def column(self) -> str | None:
+        """The column name when the formula is a bare column reference."""
+        return self.node[1] if self.node[0] == "column" else None
+
+    def evaluate(self, operand: Operand, length: int) -> np.ndarray:
+        """Evaluate with `operand(name, aggregate)` supplying each column; returns float64 of `length`."""
+        result = self._function(operand)
+        return np.broadcast_to(np.asarray(result, dtype=np.float64), (length,)).copy()
+
+
+def compile_formula(expression: str, resolve: Callable[[str], str | None]) -> Formula:
+    """Parse `expression` and bind its column references through `resolve`.
+
+    Raises `FormulaError` for syntax outside the grammar, unresolvable columns
+    or nesting too deep for the recursive parser.
+    """
+    try:
+        node = parse(expression.strip())
+        unknown: list[str] = []
+        bound = _bind(node, resolve, unknown)
+        if unknown:
+            raise FormulaError(f"Unknown column(s) {', '.join(unknown)} in {expression!r}")
+        return Formula(
+            source=expression,
+            text=_render(bound),
+            columns=tuple(dict.fromkeys(_columns(bound))),
+            node=bound,
+            _function=_compile(bound),
+        )
+    except RecursionError:
+        raise FormulaError(f"Formula nested too deeply: {expression[:80]!r}") from None
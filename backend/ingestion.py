@@ -0,0 +1,674 @@
+import asyncio
+import codecs
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sys
+from array import array
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from itertools import accumulate, count
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.getenv("CSV_CHUNK_SIZE", str(1024 * 1024)))
+# Rows of each file that are still shown verbatim to the validation agent.
+PREVIEW_ROWS = int(os.getenv("CSV_PREVIEW_ROWS", "500"))
+# Rows of each file a prompt may carry when a preview is expanded to the whole table.
+EXPAND_MAX_ROWS = int(os.getenv("CSV_EXPAND_MAX_ROWS", "20000"))
+INFER_ROWS = 1000
+MAX_REPORTED_ERRORS = 100
+PREVIEW_NOTE = "[preview: first"
+
+_NAT = np.iinfo(np.int64).min
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%Y%m%d", "%m/%d/%Y")
+
+
+@dataclass
+class ParseError:
+    line: int
+    message: str
+
+
+_NUMBER_PATTERNS = {
+    mark: re.compile(rf"[+-]?(?:\d{{1,3}}(?:{re.escape(group)}\d{{3}})+|\d*)(?:{re.escape(mark)}\d*)?(?:[eE][+-]?\d+)?")
+    for mark, group in ((".", ","), (",", "."))
+}
+
+
+def decimal_mark(cell: str) -> str | None:
+    """The decimal separator a numeric cell evidently uses, or None when it shows none or is ambiguous.
+
+    `1,5`, `1.234,56` and `1,234,567` are unambiguous; `1,000` may be a thousand
+    or one and is decided by the rest of its column.
+    """
+    cell = cell.strip().replace(" ", "").replace("\u00a0", "")
+    commas, dots = cell.count(","), cell.count(".")
+    if commas and dots:
+        return "," if cell.rfind(",") > cell.rfind(".") else "."
+    if commas + dots == 0:
+        return None
+    mark = "," if commas else "."
+    if commas + dots > 1:
+        return "." if mark == "," else ","
+    whole, fraction = cell.split(mark)
+    if len(fraction) != 3 or whole.lstrip("+-") in ("", "0"):
+        return mark
+    return None
+
+
+def parse_number(cell: str, decimal: str | None = None) -> float | None:
+    """Parse a numeric cell in `1 234,56`, `1.234,56` or `1,234.56` style.
+
+    `decimal` is the column's decimal separator. Without it the cell's own
+    separators must be unambiguous, so `1,000` is rejected rather than guessed.
+    """
+    cell = cell.strip().replace(" ", "").replace("\u00a0", "")
+    if not cell:
+        return None
+    if "," in cell or "." in cell:
+        mark = decimal or decimal_mark(cell)
+        if mark is None or not _NUMBER_PATTERNS[mark].fullmatch(cell):
+            return None
+        cell = cell.replace("." if mark == "," else ",", "").replace(mark, ".")
+    try:
+        return float(cell)
+    except ValueError:
+        return None
+
+
+def parse_date(cell: str, fmt: str | None = None) -> int | None:
+    """Parse a date cell into days since 1970-01-01, trying the column's format `fmt` first."""
+    cell = cell.strip().split("T", 1)[0]
+    if not cell:
+        return None
+    for candidate in ((fmt,) if fmt else ()) + _DATE_FORMATS:
+        try:
+            return datetime.strptime(cell, candidate).toordinal() - _EPOCH_ORDINAL
+        except ValueError:
+            continue
+    return None
+
+
+def _date_formats(cell: str) -> list[str]:
+    """Every known format the date cell parses in, e.g. both day-first and month-first for `04/01/2025`."""
+    cell = cell.strip().split("T", 1)[0]
+    formats = []
+    for fmt in _DATE_FORMATS:
+        try:
+            datetime.strptime(cell, fmt)
+        except ValueError:
+            continue
+        formats.append(fmt)
+    return formats
+
+
+def _infer_type(values: list[str], delimiter: str) -> tuple[str, str | None]:
+    """The column type of a sample, plus the decimal separator or date format the column is written in."""
+    sample = [value.strip() for value in values if value.strip()]
+    if not sample:
+        return "text", None
+    digits_only = [value.lstrip("-") for value in sample if value.lstrip("-").isdigit()]
+    # Identifiers such as accounts keep leading zeros and long keys keep precision.
+    if any((len(value) > 1 and value.startswith("0")) or len(value) > 15 for value in digits_only):
+        return "text", None
+    # Without an unambiguous cell, `;`-separated files are taken to use a decimal comma.
+    decimal = next(filter(None, map(decimal_mark, sample)), "," if delimiter == ";" else ".")
+    if all(parse_number(value, decimal) is not None for value in sample):
+        return "number", decimal
+    matches = [_date_formats(value) for value in sample]
+    if all(matches):
+        # The format every cell fits; with mixed formats the most common one
+        shared = set.intersection(*map(set, matches))
+        fmt = next((fmt for fmt in _DATE_FORMATS if fmt in shared), None)
+        return "date", fmt or Counter(fmt for formats in matches for fmt in formats).most_common(1)[0][0]
+    return "text", None
+
+
+def _quote(cell: str, delimiter: str) -> str:
+    if delimiter in cell or '"' in cell or "\n" in cell:
+        return '"' + cell.replace('"', '""') + '"'
+    return cell
+
+
+class CsvTable:
+    """Column-typed table filled incrementally while a CSV streams in.
+
+    Numbers are stored as float64, dates as `datetime64[D]` day counts and
+    everything else dictionary-encoded: an int32 code per row into a
+    per-column dictionary of distinct strings, in first-seen order. Once the
+    upload is complete `freeze()` packs each dictionary into one string plus
+    offsets and drops the lookup used for encoding.
+    """
+
+    def __init__(self, header: list[str], types: dict[str, str], formats: dict[str, str] | None = None, delimiter: str = ";"):
+        self.header = header
+        self.types = dict(types)
+        # How the source file writes each number and date column (decimal separator or
+        # strptime format) and its delimiter; exports reproduce them.
+        self.formats = dict(formats or {})
+        self.delimiter = delimiter
+        self.row_count = 0
+        self._data: dict[str, array] = {}
+        self._lookup: dict[str, dict[str, int]] = {}
+        self._dictionaries: dict[str, np.ndarray] = {}
+        self._packed: dict[str, tuple[str, array]] = {}
+        for name in header:
+            if types[name] == "number":
+                self._data[name] = array("d")
+            elif types[name] == "date":
+                self._data[name] = array("q")
+            else:
+                self._data[name] = array("i")
+                self._lookup[name] = {}
+        self._date_cache: dict[tuple[str | None, str], int | None] = {}
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def append_rows(self, rows: list[list[str]], lines: list[int], errors: list[ParseError]) -> None:
+        """Append a batch of already width-normalised rows column by column.
+
+        Types are inferred from the first rows only, so a later cell that does
+        not fit its number or date column turns the whole column into text
+        rather than being lost; the widening is reported in `errors`.
+        """
+        if not rows:
+            return
+        if self._packed:
+            raise RuntimeError("cannot append to a frozen table")
+        for name, values in zip(self.header, zip(*rows)):
+            kind = self.types[name]
+            if kind == "number":
+                parsed, failed = self._numbers(name, values)
+            elif kind == "date":
+                parsed, failed = self._dates(name, values)
+            if kind != "text" and failed is not None:
+                errors.append(ParseError(lines[failed], f"{name}: {values[failed]!r} is not a {kind}; column stored as text"))
+                self._widen(name)
+                kind = "text"
+            if kind == "number":
+                self._data[name].frombytes(parsed.tobytes())
+            elif kind == "date":
+                self._data[name].extend(parsed)
+            else:
+                lookup = self._lookup[name]
+                # setdefault evaluates len() first, so a new value gets the next code
+                self._data[name].extend([lookup.setdefault(value, len(lookup)) for value in values])
+        self.row_count += len(rows)
+
+    def _numbers(self, name: str, values: tuple[str, ...]) -> tuple[np.ndarray, int | None]:
+        """Parsed cells and the index of the first non-blank cell that is not a number, if any."""
+        decimal = self.formats.get(name)
+        # float() reads `1.500` as one and a half, which is wrong in a decimal-comma column
+        if decimal != ",":
+            raw = np.array(values, dtype=object)
+            try:
+                return np.where(raw == "", np.nan, raw).astype(np.float64), None
+            except ValueError:
+                pass
+        out = np.full(len(values), np.nan)
+        for i, cell in enumerate(values):
+            number = parse_number(cell, decimal)
+            if number is not None:
+                out[i] = number
+            elif cell.strip():
+                return out, i
+        return out, None
+
+    def _dates(self, name: str, values: tuple[str, ...]) -> tuple[list[int], int | None]:
+        """Parsed cells and the index of the first non-blank cell that is not a date, if any."""
+        out = []
+        fmt = self.formats.get(name)
+        for i, cell in enumerate(values):
+            if (fmt, cell) not in self._date_cache:
+                self._date_cache[fmt, cell] = parse_date(cell, fmt)
+            days = self._date_cache[fmt, cell]
+            if days is None:
+                if cell.strip():
+                    return out, i
+                days = _NAT
+            out.append(days)
+        return out, None
+
+    def _widen(self, name: str) -> None:
+        """Turn a number or date column into a text column holding the rows stored so far, written as in the file."""
+        cells = self._cells(name, source_format=True)
+        self.types[name] = "text"
+        self.formats.pop(name, None)
+        lookup: dict[str, int] = {}
+        self._lookup[name] = lookup
+        self._data[name] = array("i", [lookup.setdefault(value, len(lookup)) for value in cells])
+
+    def codes(self, name: str) -> np.ndarray:
+        """Zero-copy int32 view of a text column's dictionary codes."""
+        data = self._data[name]
+        return np.frombuffer(data, dtype=np.int32) if len(data) else np.empty(0, dtype=np.int32)
+
+    def dictionary(self, name: str) -> np.ndarray:
+        """The distinct values of a text column, indexed by code."""
+        if name in self._packed:
+            text, offsets = self._packed[name]
+            out = np.empty(len(offsets) - 1, dtype=object)
+            out[:] = [text[start:end] for start, end in zip(offsets, offsets[1:])]
+            return out
+        lookup = self._lookup[name]
+        cached = self._dictionaries.get(name)
+        if cached is None or len(cached) != len(lookup):
+            cached = np.empty(len(lookup), dtype=object)
+            cached[:] = list(lookup)
+            self._dictionaries[name] = cached
+        return cached
+
+    def freeze(self) -> None:
+        """Pack every text dictionary; the table becomes read-only."""
+        for name, lookup in self._lookup.items():
+            offsets = array("q", [0])
+            offsets.extend(accumulate(map(len, lookup)))
+            self._packed[name] = ("".join(lookup), offsets)
+        self._lookup = {}
+        self._dictionaries = {}
+
+    def take(self, rows: np.ndarray) -> "CsvTable":
+        """A new table holding only the given row indices, in that order; dictionaries are shared."""
+        table = CsvTable(self.header, self.types, self.formats, self.delimiter)
+        for name in self.header:
+            if self.types[name] == "text":
+                table._data[name].frombytes(self.codes(name)[rows].tobytes())
+                if name in self._packed:
+                    table._packed[name] = self._packed[name]
+                    table._lookup.pop(name)
+                else:
+                    table._lookup[name] = self._lookup[name]
+                continue
+            values = self.columns([name])[name]
+            if self.types[name] == "number":
+                table._data[name].frombytes(values[rows].tobytes())
+            else:
+                table._data[name].frombytes(values[rows].view(np.int64).tobytes())
+        table.row_count = len(rows)
+        return table
+
+    def _cells(self, name: str, source_format: bool = False) -> list[str]:
+        """Every cell of a number or date column rendered as text; blanks stay blank.
+
+        Canonical (`1234.5`, ISO dates) unless `source_format` asks for the
+        column's format in the uploaded file.
+        """
+        values = self.columns([name])[name]
+        fmt = self.formats.get(name) if source_format else None
+        if self.types[name] == "number":
+            cells = [("" if v != v else (str(int(v)) if v.is_integer() else repr(v))) for v in values.tolist()]
+            return [cell.replace(".", fmt) for cell in cells] if fmt and fmt != "." else cells
+        if fmt is None:
+            return np.where(np.isnat(values), "", values.astype(str)).tolist()
+        days, inverse = np.unique(values, return_inverse=True)
+        text = ["" if day is None else day.strftime(fmt) for day in days.tolist()]
+        return [text[index] for index in inverse.tolist()]
+
+    def render_rows(self, delimiter: str = ";", source_format: bool = False) -> list[str]:
+        """Render every row back to delimited text, e.g. for LLM prompts."""
+        rendered: list[list[str]] = []
+        for name in self.header:
+            if self.types[name] == "text":
+                quoted = [_quote(v, delimiter) for v in self.dictionary(name).tolist()]
+                rendered.append([quoted[code] for code in self.codes(name).tolist()])
+            else:
+                rendered.append([_quote(cell, delimiter) for cell in self._cells(name, source_format)])
+        return [delimiter.join(row) for row in zip(*rendered)]
+
+    def columns(self, names: list[str] | None = None) -> dict[str, np.ndarray]:
+        """Numpy views over the stored columns.
+
+        Numeric and date columns are zero-copy; text columns are decoded into
+        object arrays that reference the dictionary strings. Use `codes()` and
+        `dictionary()` to work on the encoded form directly.
+        """
+        out: dict[str, np.ndarray] = {}
+        for name in names or self.header:
+            data = self._data[name]
+            if self.types[name] == "number":
+                out[name] = np.frombuffer(data, dtype=np.float64) if len(data) else np.empty(0)
+            elif self.types[name] == "date":
+                view = np.frombuffer(data, dtype=np.int64) if len(data) else np.empty(0, dtype=np.int64)
+                out[name] = view.view("datetime64[D]")
+            else:
+                out[name] = self.dictionary(name)[self.codes(name)]
+        return out
+
+    def memory_usage(self) -> dict[str, int]:
+        """Approximate resident bytes per column: the typed buffer plus, for text, its dictionary."""
+        usage = {}
+        for name in self.header:
+            data = self._data[name]
+            size = data.buffer_info()[1] * data.itemsize
+            if name in self._packed:
+                text, offsets = self._packed[name]
+                size += sys.getsizeof(text) + offsets.buffer_info()[1] * offsets.itemsize
+            elif self.types[name] == "text":
+                lookup = self._lookup[name]
+                size += sys.getsizeof(lookup) + sum(sys.getsizeof(value) for value in lookup)
+            usage[name] = size
+        return usage
+
+    def encode(self, name: str, values: list[str]) -> np.ndarray:
+        """Dictionary codes of `values` in a text column, adding values not seen before."""
+        if name not in self._packed:
+            lookup = self._lookup[name]
+            return np.fromiter((lookup.setdefault(value, len(lookup)) for value in values), dtype=np.int32, count=len(values))
+        text, offsets = self._packed[name]
+        index = dict(zip(self.dictionary(name).tolist(), count()))
+        new = [value for value in dict.fromkeys(values) if value not in index]
+        if new:
+            # A fresh offsets array: dictionaries may be shared with tables made by take()
+            end = offsets[-1]
+            offsets = array("q", offsets)
+            offsets.extend(end + length for length in accumulate(map(len, new)))
+            self._packed[name] = (text + "".join(new), offsets)
+            index.update(zip(new, count(len(index))))
+        return np.fromiter(map(index.__getitem__, values), dtype=np.int32, count=len(values))
+
+    def assign(self, name: str, rows: np.ndarray, values: np.ndarray | list[str]) -> np.ndarray:
+        """Overwrite cells of one column in place and return their previous values.
+
+        Allowed on frozen tables, since the row count does not change.
+        """
+        if self.types[name] == "text":
+            codes = self.codes(name)
+            previous = self.dictionary(name)[codes[rows]]
+            codes[rows] = self.encode(name, list(values))
+            return previous
+        view = self.columns([name])[name]
+        previous = view[rows].copy()
+        view[rows] = values
+        return previous
+
+    def to_bytes(self) -> bytes:
+        """Serialize to an `.npz` archive; text dictionaries are stored as UTF-8 plus offsets."""
+        meta = {"header": self.header, "types": self.types, "formats": self.formats, "delimiter": self.delimiter}
+        arrays = {"meta": np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)}
+        for position, name in enumerate(self.header):
+            if self.types[name] == "text":
+                encoded = [value.encode("utf-8") for value in self.dictionary(name).tolist()]
+                arrays[f"{position}.codes"] = self.codes(name)
+                arrays[f"{position}.dictionary"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+                arrays[f"{position}.offsets"] = np.fromiter(accumulate(map(len, encoded), initial=0), dtype=np.int64, count=len(encoded) + 1)
+            else:
+                arrays[str(position)] = self.columns([name])[name]
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CsvTable":
+        with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+            meta = json.loads(archive["meta"].tobytes().decode("utf-8"))
+            table = cls(meta["header"], meta["types"], meta.get("formats"), meta.get("delimiter", ";"))
+            for position, name in enumerate(table.header):
+                if table.types[name] == "text":
+                    blob = archive[f"{position}.dictionary"].tobytes()
+                    offsets = archive[f"{position}.offsets"].tolist()
+                    values = [blob[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+                    table._data[name].frombytes(archive[f"{position}.codes"].tobytes())
+                    table._lookup[name] = dict(zip(values, count()))
+                else:
+                    table._data[name].frombytes(archive[str(position)].view(np.uint8).tobytes())
+            table.row_count = len(table._data[table.header[0]]) if table.header else 0
+        table.freeze()
+        return table
+
+    def to_csv(self, delimiter: str = ";", source_format: bool = False) -> str:
+        rows = [delimiter.join(_quote(name, delimiter) for name in self.header), *self.render_rows(delimiter, source_format)]
+        return "\n".join(rows) + "\n"
+
+    def export_csv(self) -> str:
+        """The table written in the dialect of its uploaded file: delimiter, decimal separator and date formats."""
+        return self.to_csv(self.delimiter, source_format=True)
+
+
+def csv_block(label: str, text: str) -> str:
+    return f"\n\n--- {label} CSV START ---\n{text}\n--- {label} CSV END ---\n"
+
+
+def expand_preview(sources: str, label: str, table: CsvTable, max_rows: int = EXPAND_MAX_ROWS) -> str:
+    """`sources` with the truncated preview block of `label` replaced by the rows of `table`.
+
+    At most `max_rows` rows are inlined; a longer table keeps a preview note,
+    so `has_preview` still reports the prompt as incomplete.
+    """
+    pattern = re.compile(rf"--- {re.escape(label)} CSV START ---\n{re.escape(PREVIEW_NOTE)} (\d+).*?\n--- {re.escape(label)} CSV END ---", re.S)
+
+    def expand(match: re.Match) -> str:
+        if len(table) <= max_rows:
+            return csv_block(label, table.to_csv().rstrip("\n")).strip()
+        if int(match.group(1)) >= max_rows:
+            return match.group(0)
+        note = f"{PREVIEW_NOTE} {max_rows} of {len(table)} rows, capped by CSV_EXPAND_MAX_ROWS]\n"
+        return csv_block(label, note + table.take(np.arange(max_rows)).to_csv().rstrip("\n")).strip()
+
+    return pattern.sub(expand, sources)
+
+
+def has_preview(sources: str) -> bool:
+    """Whether any CSV block in `sources` holds only a preview of its file."""
+    return PREVIEW_NOTE in sources
+
+
+@dataclass
+class IngestedCsv:
+    filename: str | None
+    table: CsvTable
+    sha256: str
+    byte_count: int
+    error_count: int
+    errors: list[ParseError] = field(default_factory=list)
+    preview: str = ""
+    preview_rows: int = 0
+    preview_truncated: bool = False
+
+    @property
+    def row_count(self) -> int:
+        return len(self.table)
+
+    def prompt_block(self, label: str) -> str:
+        """The delimited CSV block appended to the prompt, limited to the preview rows."""
+        note = ""
+        if self.preview_truncated:
+            note = f"{PREVIEW_NOTE} {self.preview_rows} of {self.row_count} rows, sha256 {self.sha256}]\n"
+        return csv_block(label, f"{note}{self.preview}")
+
+    def summary(self) -> dict:
+        return {
+            "filename": self.filename,
+            "rows": self.row_count,
+            "bytes": self.byte_count,
+            "sha256": self.sha256,
+            "memory_bytes": sum(self.table.memory_usage().values()),
+            "parse_error_count": self.error_count,
+            "parse_errors": [{"line": e.line, "message": e.message} for e in self.errors],
+        }
+
+
+class CsvStreamParser:
+    """Incremental CSV parser fed with raw byte chunks.
+
+    Quoted fields may span chunk boundaries and physical lines. Rows are
+    buffered until column types can be inferred, then appended to a
+    `CsvTable` batch by batch, so only the typed table stays resident.
+    """
+
+    def __init__(self, preview_rows: int = PREVIEW_ROWS, infer_rows: int = INFER_ROWS):
+        self.preview_rows = preview_rows
+        self.infer_rows = infer_rows
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="ignore")
+        self._hash = hashlib.sha256()
+        self._bytes = 0
+        self._pending = ""
+        self._record: list[str] = []
+        self._record_quotes = 0
+        self._record_line = 0
+        self._line = 0
+        self._delimiter: str | None = None
+        self._header: list[str] | None = None
+        self._buffer: list[list[str]] = []
+        self._buffer_lines: list[int] = []
+        self._preview: list[str] = []
+        self._records = 0
+        self._errors: list[ParseError] = []
+        self._error_count = 0
+        self.table: CsvTable | None = None
+
+    def feed(self, data: bytes) -> None:
+        self._hash.update(data)
+        self._bytes += len(data)
+        text = self._pending + self._decoder.decode(data)
+        lines = text.split("\n")
+        self._pending = lines.pop()
+        self._consume(lines)
+
+    def close(self, filename: str | None = None) -> IngestedCsv:
+        text = self._pending + self._decoder.decode(b"", final=True)
+        self._pending = ""
+        self._consume([text] if text else [])
+        if self._record:
+            self._error(self._record_line, "unterminated quoted field at end of file")
+            self._complete_record()
+        self._flush(force=True)
+        if self.table is None:
+            self.table = CsvTable(self._header or [], {name: "text" for name in self._header or []}, delimiter=self._delimiter or ";")
+        self.table.freeze()
+        return IngestedCsv(
+            filename=filename,
+            table=self.table,
+            sha256=self._hash.hexdigest(),
+            byte_count=self._bytes,
+            error_count=self._error_count,
+            errors=self._errors,
+            preview="\n".join(self._preview),
+            preview_rows=min(self._records, self.preview_rows),
+            preview_truncated=self._records > self.preview_rows,
+        )
+
+    def _consume(self, lines: list[str]) -> None:
+        if self._header is not None and not self._record and not any('"' in line for line in lines):
+            self._consume_plain(lines)
+            return
+        for line in lines:
+            self._line += 1
+            if line.endswith("\r"):
+                line = line[:-1]
+            if not self._record:
+                self._record_line = self._line
+            self._record.append(line)
+            self._record_quotes += line.count('"')
+            if self._record_quotes % 2 == 0:
+                self._complete_record()
+        self._flush()
+
+    def _consume_plain(self, lines: list[str]) -> None:
+        """Fast path for batches without any quoting: one split per line."""
+        first_line = self._line + 1
+        self._line += len(lines)
+        delimiter = self._delimiter
+        width = len(self._header)
+        for offset, line in enumerate(lines):
+            if line.endswith("\r"):
+                line = line[:-1]
+            if not line.strip():
+                continue
+            self._records += 1
+            if self._records <= self.preview_rows:
+                self._preview.append(line)
+            row = line.split(delimiter)
+            if len(row) != width:
+                self._error(first_line + offset, f"expected {width} fields, found {len(row)}")
+                row = row[:width] if len(row) > width else row + [""] * (width - len(row))
+            self._buffer.append(row)
+            self._buffer_lines.append(first_line + offset)
+        self._flush()
+
+    def _complete_record(self) -> None:
+        raw = "\n".join(self._record)
+        self._record = []
+        self._record_quotes = 0
+        if not raw.strip():
+            return
+        if self._header is None:
+            self._delimiter = ";" if raw.count(";") > raw.count(",") else ","
+            self._header = [name.strip() for name in next(csv.reader([raw], delimiter=self._delimiter))]
+            self._preview.append(raw)
+            return
+        self._records += 1
+        if self._records <= self.preview_rows:
+            self._preview.append(raw)
+        if '"' in raw:
+            row = next(csv.reader([raw], delimiter=self._delimiter))
+        else:
+            row = raw.split(self._delimiter)
+        width = len(self._header)
+        if len(row) != width:
+            self._error(self._record_line, f"expected {width} fields, found {len(row)}")
+            row = row[:width] if len(row) > width else row + [""] * (width - len(row))
+        self._buffer.append(row)
+        self._buffer_lines.append(self._record_line)
+
+    def _flush(self, force: bool = False) -> None:
+        if self._header is None:
+            return
+        if self.table is None:
+            if len(self._buffer) < self.infer_rows and not force:
+                return
+            columns = list(zip(*self._buffer)) or [() for _ in self._header]
+            inferred = {name: _infer_type(list(values), self._delimiter) for name, values in zip(self._header, columns)}
+            types = {name: kind for name, (kind, _) in inferred.items()}
+            formats = {name: fmt for name, (_, fmt) in inferred.items() if fmt}
+            self.table = CsvTable(self._header, types, formats, self._delimiter)
+        errors: list[ParseError] = []
+        self.table.append_rows(self._buffer, self._buffer_lines, errors)
+        for error in errors:
+            self._error(error.line, error.message)
+        self._buffer = []
+        self._buffer_lines = []
+
+    def _error(self, line: int, message: str) -> None:
+        self._error_count += 1
+        if len(self._errors) < MAX_REPORTED_ERRORS:
+            self._errors.append(ParseError(line, message))
+
+
+async def ingest_upload(upload, chunk_size: int = CHUNK_SIZE) -> IngestedCsv:
+    """Stream a FastAPI `UploadFile` into a typed table without holding the raw file.
+
+    Parsing runs in a worker thread per chunk so the event loop stays responsive.
+    """
+    parser = CsvStreamParser()
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        await asyncio.to_thread(parser.feed, chunk)
+    ingested = parser.close(filename=upload.filename)
+    logger.info(
+        f"Ingested {upload.filename}: {ingested.row_count} rows, {ingested.byte_count} bytes, "
+        f"sha256={ingested.sha256[:12]}, {ingested.error_count} parse errors"
+    )
+    for error in ingested.errors[:5]:
+        logger.warning(f"{upload.filename} line {error.line}: {error.message}")
+    return ingested
+
+
+def read_csv_text(text: str) -> IngestedCsv:
+    """Ingest CSV text already in memory, e.g. from tests or benchmarks."""
+    parser = CsvStreamParser()
+    data = text.encode("utf-8")
+    for start in range(0, len(data), CHUNK_SIZE):
+        parser.feed(data[start:start + CHUNK_SIZE])
+    return parser.close()
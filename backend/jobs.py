@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", "32"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobQueueFull(Exception):
+    """Raised when the queue is at its depth limit; callers should retry later."""
+
+
+@dataclass
+class Job:
+    job_id: str
+    run: Callable[[], Awaitable[Any]]
+    metadata: dict[str, Any] = field(default_factory=dict)
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    result: Any = None
+    error: str | None = None
+    task: asyncio.Task | None = None
+
+    def describe(self) -> dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            **self.metadata,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """Runs submitted workflows on a fixed pool of async workers behind a bounded queue."""
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queue: int = JOB_QUEUE_DEPTH):
+        self.worker_count = workers
+        self.max_queue = max_queue
+        self.jobs: dict[str, Job] = {}
+        self._queue: asyncio.Queue[Job] | None = None
+        self._workers: list[asyncio.Task] = []
+
+    def _ensure_workers(self) -> asyncio.Queue[Job]:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while len(self._workers) < self.worker_count:
+            self._workers.append(asyncio.create_task(self._work(len(self._workers))))
+        return self._queue
+
+    def submit(self, run: Callable[[], Awaitable[Any]], metadata: dict[str, Any] | None = None) -> Job:
+        """Queue a job; raises JobQueueFull instead of waiting when the queue is at capacity."""
+        queue = self._ensure_workers()
+        self._prune()
+        job = Job(job_id=uuid.uuid4().hex, run=run, metadata=metadata or {})
+        try:
+            queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise self._full() from None
+        self.jobs[job.job_id] = job
+        logger.info(f"Queued job {job.job_id} ({queue.qsize()} waiting)")
+        return job
+
+    def check_capacity(self) -> None:
+        """Raise JobQueueFull if `submit` would refuse a job now, so callers can refuse before expensive setup."""
+        if self._queue is not None and self._queue.full():
+            raise self._full()
+
+    def get(self, job_id: str) -> Job | None:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job. Returns False if it already finished."""
+        job = self.jobs.get(job_id)
+        if job is None or job.status in FINISHED:
+            return False
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            self._finish(job, CANCELLED)
+        return True
+
+    def stats(self) -> dict[str, Any]:
+        counts = {status: 0 for status in (QUEUED, RUNNING, *FINISHED)}
+        for job in self.jobs.values():
+            counts[job.status] += 1
+        return {"workers": self.worker_count, "max_queue": self.max_queue, **counts}
+
+    async def shutdown(self) -> None:
+        for job in self.jobs.values():
+            if job.status not in FINISHED:
+                self.cancel(job.job_id)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _work(self, index: int) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.status == CANCELLED:
+                    continue
+                job.status = RUNNING
+                job.started_at = time.time()
+                job.task = asyncio.create_task(job.run())
+                try:
+                    job.result = await job.task
+                    self._finish(job, SUCCEEDED)
+                except asyncio.CancelledError:
+                    if job.task.cancelled():
+                        self._finish(job, CANCELLED)
+                    # Cancelling the worker (shutdown) also cancels its job; that must not be swallowed
+                    if not job.task.cancelled() or asyncio.current_task().cancelling():
+                        raise
+                except Exception as e:
+                    logger.exception(f"Job {job.job_id} failed on worker {index}")
+                    job.error = str(e)
+                    self._finish(job, FAILED)
+            finally:
+                self._queue.task_done()
+
+    def _finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished_at = time.time()
+        job.run = None
+        logger.info(f"Job {job.job_id} {status}")
+
+    def _full(self) -> JobQueueFull:
+        return JobQueueFull(f"Job queue is full ({self.max_queue} waiting); retry later")
+
+    def _prune(self) -> None:
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j.job_id for j in self.jobs.values() if j.status in FINISHED and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+
+job_manager = JobManager()
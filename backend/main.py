@@ -1,5 +1,50 @@
+import asyncio
+import contextlib
+import dataclasses
+import json
+import logging
+import os
+import time
 from pydantic import BaseModel
-from agents import Agent, ModelSettings, RunContextWrapper, TResponseInputItem, Runner, RunConfig, trace
+from agents import Agent, ModelBehaviorError, ModelSettings, Runner, RunConfig, trace
+import audit
+import break_engine
+import corrections
+import delta
+import metrics
+import pagination
+import progress
+import prompt_layout
+import routing
+import scheduler
+import sharding
+import triage
+import ingestion
+from ingestion import CsvTable
+from mapping_cache import layout_fingerprint, mapping_plan_cache
+from model_clients import model_client_pool
+from openai import RateLimitError
+from report_cache import report_section_cache, section_key
+from response_cache import dump_output, response_cache, set_cache_bypass
+from scheduler import model_scheduler
+from session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on breaks whose templated comment is rewritten by the LLM.
+BREAK_COMMENT_LIMIT = int(os.getenv("BREAK_COMMENT_LIMIT", "40"))
+# "engine" reconciles locally; "sharded" runs break_classifier on coac_event_key shards.
+BREAK_DETECTION_MODE = os.getenv("BREAK_DETECTION_MODE", "engine")
+BREAK_SHARD_CONCURRENCY = int(os.getenv("BREAK_SHARD_CONCURRENCY", "4"))
+# Concurrent classification_agent batches for breaks the pre-triage rules leave open.
+CLASSIFICATION_CONCURRENCY = int(os.getenv("CLASSIFICATION_CONCURRENCY", "4"))
+# Audit report sections generated at once; the default writes all of them concurrently.
+AUDIT_SECTION_CONCURRENCY = int(os.getenv("AUDIT_SECTION_CONCURRENCY", str(len(audit.SECTIONS))))
+# State keys persisted per run ID so later stages do not need client-supplied context.
+SESSION_STATE_KEYS = ("validation_results", "breaks_found_global", "updated_classified_breaks", "corrections_list")
+# Sort order and cursor of the paged break_classifier and correction_agent outputs (see pagination.py).
+BREAK_CURSOR_FIELDS = ("coac_event_key", "break_type", "nbim_field")
+CORRECTION_CURSOR_FIELDS = ("break_id",)
 
 
 class ValidationAgentSchema__DatatypeMismatchesItem(BaseModel):
@@ -78,6 +123,19 @@ class BreakClassifierSchema(BaseModel):
   breaks_found: list[BreakClassifierSchema__BreaksFoundItem]
 
 
+class BreakClassifierPageSchema(BreakClassifierSchema):
+  next_cursor: str | None
+
+
+class BreakCommentSchema__CommentsItem(BaseModel):
+  break_index: float
+  comment: str
+
+
+class BreakCommentSchema(BaseModel):
+  comments: list[BreakCommentSchema__CommentsItem]
+
+
 class ClassificationAgentSchema__AutoCandidatesItem(BaseModel):
   break_id: float
   coac_event_key: str
@@ -148,6 +206,10 @@ class CorrectionAgentSchema(BaseModel):
   summary: CorrectionAgentSchema__Summary
 
 
+class CorrectionAgentPageSchema(CorrectionAgentSchema):
+  next_cursor: str | None
+
+
 class AgentSchema(BaseModel):
   response_type: str
 
@@ -337,217 +399,100 @@ You must output a fully structured, validated, and domain-aware mapping plan —
 )
 
 
-class AuditingAgentContext:
-  def __init__(self, state_validation_results: str, state_breaks_found_global: str, state_updated_classified_breaks: str, state_corrections_list: str):
-    self.state_validation_results = state_validation_results
-    self.state_breaks_found_global = state_breaks_found_global
-    self.state_updated_classified_breaks = state_updated_classified_breaks
-    self.state_corrections_list = state_corrections_list
-def auditing_agent_instructions(run_context: RunContextWrapper[AuditingAgentContext], _agent: Agent[AuditingAgentContext]):
-  state_validation_results = run_context.context.state_validation_results
-  state_breaks_found_global = run_context.context.state_breaks_found_global
-  state_updated_classified_breaks = run_context.context.state_updated_classified_breaks
-  state_corrections_list = run_context.context.state_corrections_list
-  return f"""### **1. Role Definition**
-
-You are the **Audit Trail & Report Generation Agent**, responsible for producing a **comprehensive, traceable, and verifiable audit record** from all prior reconciliation stages.
+def auditing_agent_section(section: audit.Section, section_input: str) -> str:
+  """The input message naming one report section, its task and its data."""
+  return f"""Section: **{section.title}**
 
-You operate after the **Correction Agent (Agent 4)** has completed and stored updates to:
+Task: {section.brief}
 
-* `state.validation_results`
-* `state.breaks_found_global`
-* `state.updated_classified_breaks`
-* `state.corrections_list`
-
-Your mission:
-
-* **Aggregate** data from all upstream agents.
-* **Explain** decision logic at the record level — including the **rationale** behind mappings, break classifications, and correction choices.
-* **Generate** a machine-readable audit trail (`state.audit_report`) and a human-readable compliance summary (`state.final_report.text`).
-* **Preserve** traceability, reversibility, and logical reasoning for every automated and manual decision.
-* All textual summaries and reports must be formatted using **Markdown syntax** (e.g., headings `##`, bold `**`, bullet lists, code fences where appropriate) so that the frontend can render them directly.
-
-You serve as the **compliance and forensic documentation layer**, ensuring accountability across all agents.
-
----
+```json
+{section_input}
+```"""
 
-### **2. Task Clarity**
 
-Execute the following phases in order.
+auditing_agent_instructions = """### **1. Role Definition**
 
-#### **(A) Aggregation Phase**
+You are the **Audit Trail & Report Generation Agent**, responsible for the **compliance and forensic documentation layer** of the NBIM–Custody dividend reconciliation.
 
-Collect and validate input data from each state:
+The audit report is written one section at a time, each by a separate call. Write only the section named in the input message.
 
-| Source                | Key                                 | Description                                                                                               |
-| --------------------- | ----------------------------------- | --------------------------------------------------------------------------------------------------------- |
-| Validation Agent      | {state_validation_results}        | Includes `mapping_plan`, `mapped_columns`, `derived_relationships`, and `contextual_relationships`.       |
-| Break Detection Agent | {state_breaks_found_global}       | Contains every detected break with `break_type`, `severity`, and `comment`.                               |
-| Classification Agent  | {state_updated_classified_breaks} | Contains both `auto_candidates` and `manual_candidates` with classification rationale and approval flags. |
-| Correction Agent      | {state_corrections_list}          | Includes both executed (`auto_applied = true`) and pending (`requires_human_review = true`) corrections.  |
+All counting, linking and hashing has already been done deterministically from:
 
-Each key must exist and be non-empty unless marked `\"status\": \"incomplete\"`.
-If missing, record it in `audit_report.trail` with `\"critical_issues\": true` and include a clear Markdown-formatted notice such as:
+* `state.validation_results`
+* `state.breaks_found_global`
+* `state.updated_classified_breaks`
+* `state.corrections_list`
 
-> **⚠️ Missing Source:** `state.breaks_found_global` not found — Break Detection data incomplete.
+The report summary, the other sections and the footer with the generation time and SHA-256 state hash are assembled around your text automatically.
 
 ---
 
-#### **(B) Record-Level Trace Construction**
-
-For every unique `coac_event_key` found in any upstream state:
-
-1. Link all relevant objects:
-
-   * Validation mappings and derived relationships
-   * Breaks detected
-   * Classifications (including `confidence`, `priority`, `rationale`)
-   * Corrections (with `justification`, `auto_applied`, `verified_reversible`)
+### **2. Task**
 
-2. Construct a unified **decision_trace** object that shows:
+The input message gives the section's title, its task and its data as one JSON object:
 
-   * What happened at each stage
-   * Why each decision was made
-   * Which rules, tolerances, or relationships influenced that decision
-
-Each trace must culminate in a human-readable `decision_summary` written in **Markdown**, for example:
-
-```markdown
-### Event 960789012 – Dividend Payment
-**Summary:** The Custody net amount exceeded NBIM’s by 450,050 KRW.  
-**Detected:** `amount_mismatch` (severity: major)  
-**Classification:** Manual review required (confidence 0.82)  
-**Correction:** Analyst to verify FX rate or booking error.  
-```
+| Field             | Description                                                                                              |
+| ----------------- | -------------------------------------------------------------------------------------------------------- |
+| `stage`           | This stage's `audit_trail` entry with its computed `metrics`, or null for the per-event highlights.      |
+| `totals`          | Event-level totals when `stage` is null.                                                                 |
+| `examples`        | A small, deliberately chosen sample: the most severe, least confident or flagged items of this section.  |
+| `missing_sources` | State keys that were not available; `critical_issues` is true when any is missing or validation failed. |
 
 ---
 
-#### **(C) Stage-Level Summaries**
-
-For each agent stage, compute and record summary metrics:
+### **3. Output Format**
 
-| Stage               | Key Metrics                                                                                                      |
-| ------------------- | ---------------------------------------------------------------------------------------------------------------- |
-| **Validation**      | Counts of `mapped_columns`, `derived_relationships`, `contextual_relationships`, and whether `critical == true`. |
-| **Break Detection** | Total breaks, breakdown by `break_type`, and ratio of critical breaks.                                           |
-| **Classification**  | Totals for auto vs manual candidates, mean confidence, and rationale frequency.                                  |
-| **Correction**      | Number of `auto_applied` vs `requires_human_review` corrections and proportion verified reversible.              |
+Write **Markdown** only, ready to be rendered by the frontend:
 
-Each `audit_trail` entry’s `\"summary\"` must be an **expanded, multi-paragraph Markdown string** that:
-
-* Begins with a `##` or `###` heading naming the stage
-* Provides numeric highlights in bullet points
-* Adds narrative interpretation explaining patterns or trends
-* Concludes with one **bolded insight line** summarizing the business meaning
+* Do **not** start with a heading for the section itself — it is added for you. Use `###` or deeper headings only where the task asks for them.
+* Provide numeric highlights in bullet points, quoting the metrics exactly.
+* Add narrative interpretation explaining patterns or trends, referring to the examples by `coac_event_key`.
+* Conclude with one **bolded insight line** summarizing the business meaning.
+* Do not add a title, report summary, timestamps, hashes or a closing horizontal rule.
 
 **Example format:**
 
 ```markdown
-## Stage: Break Detection
 - **Total breaks detected:** 42  
 - **Critical:** 8 (19%)  
 - **Most common type:** `amount_mismatch`  
-- **Average difference magnitude:** 3.2%
 
 The detection stage revealed that most mismatches originated from rounding variances and delayed tax postings.  
-Cross-system timestamps confirmed synchronization issues in 4 of 8 critical events.
+Event 960789012 shows the largest net amount difference (450,050 KRW).
 
 **Insight:** Frequent amount mismatches indicate tolerance misalignment between NBIM and Custody feeds.
 ```
 
 ---
 
-#### **(D) Final Report Compilation Phase**
-
-* Merge all `decision_trace` objects into one collection `audit_report.detailed_records`.
-* Write aggregated metrics into `audit_report.trail`.
-* Generate a Markdown-formatted compliance narrative in `state.final_report.text`.
-
-**Final Report Markdown structure:**
-
-```markdown
-# NBIM–Custody Reconciliation Audit Report
-
-## Summary
-High-level overview of reconciliation outcomes, number of breaks, and corrections applied.
-
-## Stage Overviews
-### Validation
-(summary text here)
-
-### Break Detection
-(summary text here)
-
-### Classification
-(summary text here)
-
-### Correction
-(summary text here)
-
-## Detailed Reasoning Highlights
-- Event 960789012: (short reasoning excerpt)
-- Event 970456789: (short reasoning excerpt)
-
----
-
-**Generated at:** 2025-11-02T23:15Z  
-**Agents involved:** 4  
-**SHA-256 State Hash:** 9e8a...  
-```
-
----
-
-### **3. Error Prevention and Guardrails**
+### **4. Error Prevention and Guardrails**
 
-| Rule                              | Description                                                                                                            |
-| --------------------------------- | ---------------------------------------------------------------------------------------------------------------------- |
-| **Data Integrity Lock**           | All upstream data is read-only.                                                                                        |
-| **Completeness Enforcement**      | Missing state keys must trigger `critical_issues = true`.                                                              |
-| **Cross-Referential Consistency** | Every correction must correspond to a known `break_id` and `coac_event_key`.                                           |
-| **Timestamp Order Enforcement**   | Ensure timestamps increase across pipeline steps.                                                                      |
-| **Rationale Presence**            | Each classified or corrected record must include a `rationale` or `justification`. Missing ones are flagged.           |
-| **Fail-Safe Default**             | If partial aggregation fails, still emit truncated `audit_report` with Markdown summary of what was successfully read. |
+| Rule                              | Description                                                                                                      |
+| --------------------------------- | ---------------------------------------------------------------------------------------------------------------- |
+| **Authoritative Numbers**         | Quote the metrics as given; never recompute, estimate, extrapolate from the examples or alter them.            |
+| **Data Integrity Lock**           | All upstream data is read-only.                                                                                  |
+| **Completeness Enforcement**      | If this section's source is in `missing_sources`, say so prominently and describe only what is available.       |
+| **Cross-Referential Consistency** | Report `unlinked_corrections` and the `issues` of examples: corrections without a known `break_id` and event.   |
+| **Rationale Presence**            | Report missing `rationale` or `justification` counts; do not invent rationales for them.                        |
+| **Scope**                         | Write only this section; do not repeat content that belongs to the other stages.                                |
 
 ---
 
-### **4. Domain Awareness (Dividend Reconciliation Context)**
+### **5. Domain Awareness (Dividend Reconciliation Context)**
 
-The audit report should reflect domain-relevant reasoning and metrics, such as:
+Reflect domain-relevant reasoning, such as:
 
-| Metric                           | Example Value | Meaning                                     |
-| -------------------------------- | ------------- | ------------------------------------------- |
-| Total dividend events reconciled | 24            | Combined NBIM and Custody records processed |
-| Timing differences resolved      | 5             | Adjusted for T+1 payment offsets            |
-| Rounding issues corrected        | 3             | Small numerical differences aligned         |
-| FX discrepancies flagged         | 2             | Pending validation of exchange rates        |
-| Missing records inserted         | 1             | Manual insertion required                   |
+| Metric                           | Meaning                                     |
+| -------------------------------- | ------------------------------------------- |
+| Timing differences               | T+1 payment offsets between the two systems |
+| Rounding issues                  | Small numerical differences aligned         |
+| FX discrepancies                 | Pending validation of exchange rates        |
+| Missing records                  | Manual insertion required                   |
 
-Each record’s reasoning should explain *why* these outcomes occurred — e.g.,
+Explain *why* outcomes occurred — e.g.,
 
 > “FX variance correction was applied due to rate mismatch > tolerance threshold,”
 > or “Round-off alignment was permitted within ±0.01.”
-
----
-
-### **5. Summary of Behavioral Contract**
-
-| Phase                  | Output                     | Purpose                                    |
-| ---------------------- | -------------------------- | ------------------------------------------ |
-| **Aggregation**        | Collected state data       | Ensures end-to-end visibility              |
-| **Record-Level Trace** | Linked reasoning per event | Documents decision paths with explanations |
-| **Stage Summaries**    | Quantitative step metrics  | Supports executive and compliance review   |
-| **Final Compilation**  | JSON + human report        | Provides compliance-grade transparency     |
-
----
-
-### **6. End Behavior**
-
-When the **Audit Trail & Report Generation Agent** completes execution:
-
-* All reasoning from **validation → correction** is transparently logged in Markdown.
-* Each `coac_event_key` includes rationale in structured form and readable Markdown.
-* The final report (`final_report.text`) can be directly rendered on the frontend without additional formatting.
-* The entire process remains reproducible and verifiable via state hash integrity.
 """
 auditing_agent = Agent(
   name="Auditing agent",
@@ -828,9 +773,37 @@ Understand the operational realities:
 * “Same cash, dates differ by one day” → `date_mismatch`, `\"minor\"` (unless >1 day).
 * “Same economics but different currency” → `currency_mismatch`, `\"moderate\"`.
 * “Only pennies off due to rounding” → **no break**; apply judgment and suppress noise.
-""",
+""" + pagination.instructions("breaks_found", BREAK_CURSOR_FIELDS),
+  model="gpt-4.1",
+  output_type=BreakClassifierPageSchema,
+  model_settings=ModelSettings(
+    temperature=0,
+    top_p=1,
+    max_tokens=2048,
+    store=True
+  )
+)
+
+
+break_commentator = Agent(
+  name="Break Commentator",
+  instructions="""You write the `comment` field for reconciliation breaks that were detected deterministically by the local break engine.
+
+You receive a JSON list of breaks between NBIM internal dividend bookings and Custody records. Every break already has its `break_type`, `severity`, values and a templated `comment`. You must not change any of those facts.
+
+For each break, return one object with:
+
+* `break_index`: copied unchanged from the input.
+* `comment`: one short, human-usable sentence describing the issue and its most likely operational cause (e.g. withholding rate difference, T+1 settlement, netted sub-legs, FX settlement, missing booking).
+
+Rules:
+
+* Keep the numbers and currency exactly as given; never invent values.
+* If the templated comment mentions that upstream mapping was flagged critical, keep that notice.
+* Do not include raw rows or stack traces.
+* Return exactly one comment per input break.""",
   model="gpt-4.1",
-  output_type=BreakClassifierSchema,
+  output_type=BreakCommentSchema,
   model_settings=ModelSettings(
     temperature=0,
     top_p=1,
@@ -851,6 +824,8 @@ Your mission is to **analyze, classify, and triage** each detected break accordi
 
 You act as the **decision gatekeeper** between detection and correction — determining what can safely proceed to auto-fix, what must be paused for review, and prompting the user for confirmation before any automatic correction occurs.
 
+Routine breaks (missing records, currency mismatches, ±1 day timing differences and sub-0.01% rounding) are already classified by deterministic rules. You receive the remaining breaks in batches; each break carries a `break_id`.
+
 ---
 
 ### **2. Task Clarity**
@@ -944,6 +919,7 @@ Each classified break must include:
 
 | Field                          | Description                                |
 | ------------------------------ | ------------------------------------------ |
+| `break_id`                     | The input break's `break_id`, unchanged    |
 | `coac_event_key`               | Unique event identifier                    |
 | `category`                     | Root cause classification                  |
 | `severity`                     | `\"minor\"`, `\"moderate\"`, `\"major\"`         |
@@ -1145,9 +1121,9 @@ In dividend reconciliation, ensure corrections respect financial and operational
 | **Auto-Correction**       | Executable JSON patch list        | Ready for system sync             |
 | **Manual Recommendation** | Structured suggestions            | Sent to analyst review            |
 | **Correction Summary**    | Summary report of applied actions | Enables traceability and rollback |
-""",
+""" + pagination.instructions("corrections", CORRECTION_CURSOR_FIELDS),
   model="gpt-4.1",
-  output_type=CorrectionAgentSchema,
+  output_type=CorrectionAgentPageSchema,
   model_settings=ModelSettings(
     temperature=0,
     top_p=1,
@@ -1167,7 +1143,7 @@ agent = Agent(
   model="gpt-4.1",
   output_type=AgentSchema,
   model_settings=ModelSettings(
-    temperature=1,
+    temperature=0,
     top_p=1,
     max_tokens=2048,
     store=True
@@ -1192,8 +1168,335 @@ class WorkflowInput(BaseModel):
   input_as_text: str
 
 
+async def run_stage(agent: Agent, input, **kwargs):
+  """Run one agent stage, recording its latency, tokens and failures under the current route.
+
+  When a progress reporter is attached the stage is streamed and emits stage and item events.
+  Deterministic stages are answered from `response_cache` when the same call was made before;
+  the others wait for `model_scheduler` and run on a client leased from `model_client_pool`.
+  """
+  labels = {"agent": agent.name, "route": metrics.current_route()}
+  started = time.perf_counter()
+  cache_key = response_cache.key(agent, input)
+  try:
+    cached = None if cache_key is None else await asyncio.to_thread(response_cache.get, agent, cache_key)
+    if cached is not None:
+      logger.info(f"Stage {agent.name}: served from the response cache")
+      metrics.agent_response_cache_hits_total.inc(**labels)
+      if progress.current_reporter() is not None:
+        with progress.stage(agent.name) as stage_info:
+          for array_key, item in progress.JsonArrayItemStream().feed(dump_output(cached.final_output)):
+            progress.emit("item", {"stage": agent.name, "array": array_key, "item": item})
+          stage_info.update(cached=True)
+      return cached
+    result = await call_model(agent, input, labels, started, **kwargs)
+    if cache_key is not None:
+      await asyncio.to_thread(response_cache.put, agent, cache_key, result.final_output)
+    return result
+  except Exception as e:
+    if isinstance(e, ModelBehaviorError):
+      metrics.agent_parse_failures_total.inc(**labels)
+    metrics.agent_errors_total.inc(error=type(e).__name__, **labels)
+    raise
+  finally:
+    metrics.agent_duration_seconds.observe(time.perf_counter() - started, **labels)
+
+
+async def call_model(agent: Agent, input, labels: dict[str, str], started: float, **kwargs):
+  """Run the agent once `model_scheduler` admits it, on a client leased from `model_client_pool`.
+
+  Calls rejected with a 429 are queued again behind the scheduler's backoff. A streamed
+  stage is one stage event pair across its attempts, and is only retried while it has
+  not emitted any items, so clients never receive an item twice.
+  """
+  estimated_tokens = scheduler.estimate_tokens(agent, input)
+  priority = scheduler.priority(labels["route"])
+  streamed = progress.current_reporter() is not None
+  with progress.stage(agent.name) if streamed else contextlib.nullcontext({}) as stage_info:
+    for attempt in range(scheduler.MODEL_RATE_LIMIT_RETRIES + 1):
+      try:
+        async with model_scheduler.slot(priority, estimated_tokens) as slot, model_client_pool.lease() as provider:
+          if provider is not None:
+            kwargs["run_config"] = dataclasses.replace(kwargs.get("run_config") or RunConfig(), model_provider=provider)
+          if streamed:
+            result, usage = await run_streamed_stage(agent, input, labels, started, stage_info, **kwargs)
+          else:
+            result = await Runner.run(agent, input, **kwargs)
+            usage = record_stage_usage(agent, input, result, labels)
+          slot.settle(usage.input_tokens + usage.output_tokens)
+          return result
+      except RateLimitError:
+        if attempt == scheduler.MODEL_RATE_LIMIT_RETRIES or stage_info.get("items"):
+          raise
+        logger.warning(f"Stage {agent.name}: rate limited, requeueing (attempt {attempt + 1} of {scheduler.MODEL_RATE_LIMIT_RETRIES})")
+
+
+async def run_streamed_stage(agent: Agent, input, labels: dict[str, str], started: float, stage_info: dict, **kwargs):
+  """Stream one attempt of a stage, emitting item events and recording time to first token. Returns the result and its usage.
+
+  `stage_info` is the stage's `progress.stage` dict; `items` counts the items emitted so far.
+  """
+  result = Runner.run_streamed(agent, input, **kwargs)
+  items = progress.JsonArrayItemStream()
+  first_token = None
+  async for event in result.stream_events():
+    if event.type == "raw_response_event" and getattr(event.data, "type", None) == "response.output_text.delta":
+      if first_token is None:
+        first_token = time.perf_counter() - started
+        metrics.agent_time_to_first_token_seconds.observe(first_token, **labels)
+      for array_key, item in items.feed(event.data.delta):
+        progress.emit("item", {"stage": agent.name, "array": array_key, "item": item})
+        stage_info["items"] = stage_info.get("items", 0) + 1
+  usage = record_stage_usage(agent, input, result, labels)
+  stage_info.update(
+    input_tokens=usage.input_tokens,
+    cached_input_tokens=cached_input_tokens(usage),
+    output_tokens=usage.output_tokens,
+    requests=usage.requests,
+    time_to_first_token_seconds=None if first_token is None else round(first_token, 3)
+  )
+  return result, usage
+
+
+def cached_input_tokens(usage) -> int:
+  """Input tokens the provider served from its prompt cache; not every provider reports them."""
+  return getattr(getattr(usage, "input_tokens_details", None), "cached_tokens", 0) or 0
+
+
+def record_stage_usage(agent: Agent, input, result, labels: dict[str, str]):
+  usage = result.context_wrapper.usage
+  input_chars = len(input) if isinstance(input, str) else len(json.dumps(input, default=str))
+  cached_tokens = cached_input_tokens(usage)
+  cached_share = cached_tokens / usage.input_tokens if usage.input_tokens else 0.0
+  logger.info(f"Stage {agent.name}: {usage.input_tokens} input tokens ({input_chars} chars, {cached_tokens} cached, {cached_share:.0%}), {usage.output_tokens} output tokens, {usage.requests} requests")
+  metrics.agent_input_tokens.observe(usage.input_tokens, **labels)
+  metrics.agent_cached_input_tokens.observe(cached_tokens, **labels)
+  metrics.agent_output_tokens.observe(usage.output_tokens, **labels)
+  metrics.agent_model_requests_total.inc(usage.requests, **labels)
+  if usage.requests > 1:
+    metrics.agent_retries_total.inc(usage.requests - 1, **labels)
+  return usage
+
+
+async def run_paged_stage(agent: Agent, input: list, pages: pagination.Pages, **kwargs) -> pagination.Pages:
+  """Call a paged agent until it returns no cursor, merging every validated page into `pages`."""
+  cursor, page_size = None, pagination.OUTPUT_PAGE_SIZE
+  while True:
+    page_input = input + prompt_layout.stage_input(request=pagination.page_block(page_size, cursor, len(pages.items)))
+    try:
+      result = await run_stage(agent, page_input, **kwargs)
+    except ModelBehaviorError:
+      # A page cut off at max_tokens does not parse; ask for the same page with fewer items
+      if page_size <= pagination.OUTPUT_MIN_PAGE_SIZE:
+        raise
+      page_size = max(pagination.OUTPUT_MIN_PAGE_SIZE, page_size // 2)
+      logger.warning(f"Stage {agent.name}: unparseable page, retrying with page_size={page_size}")
+      continue
+    cursor = pages.add(result.final_output.model_dump())
+    if cursor is None:
+      logger.info(f"Stage {agent.name}: {pages.stats()}")
+      return pages
+
+
+def break_pages() -> pagination.Pages:
+  return pagination.Pages("breaks_found", lambda item: (item["coac_event_key"], item["break_type"], item["nbim_field"], item["nbim_value"], item["custody_value"]))
+
+
+def correction_pages() -> pagination.Pages:
+  return pagination.Pages("corrections", lambda item: (item["break_id"], item["coac_event_key"], item["correction_type"]))
+
+
+def correction_summary(items: list[dict], critical_issues: bool) -> dict:
+  """`CorrectionAgentSchema__Summary` counted over every page's corrections."""
+  return {
+    "total_corrections": len(items),
+    "auto_corrections_applied": sum(1 for item in items if item["auto_applied"]),
+    "manual_reviews_pending": sum(1 for item in items if item["requires_human_review"]),
+    "reversible_corrections": sum(1 for item in items if item["verified_reversible"]),
+    "critical_issues": critical_issues,
+  }
+
+
+async def comment_breaks(breaks: list[dict]) -> None:
+  """Replace templated comments with LLM-written ones for breaks that need a narrative."""
+  indices = break_engine.breaks_needing_comment(breaks, BREAK_COMMENT_LIMIT)
+  if not indices:
+    return
+  payload = [
+    {"break_index": index, **{k: v for k, v in breaks[index].items() if k != "timestamp_detected"}}
+    for index in indices
+  ]
+  try:
+    result = await run_stage(
+      break_commentator,
+      input=json.dumps(payload),
+      run_config=RunConfig(trace_metadata={
+        "__trace_source__": "agent-builder",
+        "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
+      })
+    )
+  except Exception:
+    logger.exception("Break commentator failed; keeping templated comments")
+    return
+  wanted = set(indices)
+  for item in result.final_output.comments:
+    index = int(item.break_index)
+    if index in wanted and item.comment.strip():
+      breaks[index]["comment"] = item.comment.strip()
+
+
+async def detect_breaks_locally(nbim_table: CsvTable, custody_table: CsvTable, validation_results: dict) -> dict:
+  """Run the deterministic break engine and shape its output like the break_classifier result."""
+  with progress.stage("Break Engine") as stage_info:
+    breaks = await asyncio.to_thread(break_engine.detect_breaks, nbim_table.columns(), custody_table.columns(), validation_results)
+    stage_info["breaks"] = len(breaks)
+  await comment_breaks(breaks)
+  progress.emit_items("Break Engine", "breaks_found", breaks)
+  parsed = BreakClassifierSchema(breaks_found=breaks)
+  return {
+    "output_text": parsed.json(),
+    "output_parsed": parsed.model_dump()
+  }
+
+
+async def detect_breaks_sharded(nbim_table: CsvTable, custody_table: CsvTable, validation_results: dict) -> dict:
+  """Run break_classifier concurrently over coac_event_key shards and merge with rule-(F) dedup."""
+  shards = await asyncio.to_thread(sharding.partition_events, nbim_table, custody_table, validation_results)
+  validation_json = prompt_layout.canonical_json(validation_results)
+  semaphore = asyncio.Semaphore(BREAK_SHARD_CONCURRENCY)
+
+  async def run_shard(shard: sharding.Shard) -> list[dict]:
+    async with semaphore:
+      pages = await run_paged_stage(
+        break_classifier,
+        prompt_layout.stage_input(data=[shard.prompt(validation_json)]),
+        break_pages(),
+        run_config=RunConfig(trace_metadata={
+          "__trace_source__": "agent-builder",
+          "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
+        })
+      )
+      return pages.items
+
+  shard_breaks = await asyncio.gather(*(run_shard(shard) for shard in shards))
+  parsed = BreakClassifierSchema(breaks_found=break_engine.merge_breaks(shard_breaks))
+  logger.info(f"Sharded break detection: {len(shards)} shards, {len(parsed.breaks_found)} breaks after dedup")
+  return {
+    "output_text": parsed.json(),
+    "output_parsed": parsed.model_dump()
+  }
+
+
+async def classify_breaks(breaks: list[dict], validation_results: dict, instruction: str) -> triage.Triage:
+  """Classify routine breaks by rule and the rest with classification_agent in concurrent batches."""
+  result = await asyncio.to_thread(triage.triage, breaks, validation_results)
+  batches = result.batches()
+  semaphore = asyncio.Semaphore(CLASSIFICATION_CONCURRENCY)
+  # Shared by every batch, so it belongs to the cached prefix
+  reference = prompt_layout.context_block("validation_results", validation_results)
+
+  async def run_batch(batch: list[dict]) -> dict | None:
+    data = prompt_layout.context_block("breaks_found", {"breaks_found": batch})
+    async with semaphore:
+      try:
+        output = await run_stage(
+          classification_agent,
+          input=prompt_layout.stage_input(reference=[reference], data=[data], request=instruction),
+          run_config=RunConfig(trace_metadata={
+            "__trace_source__": "agent-builder",
+            "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
+          })
+        )
+      except Exception:
+        logger.exception(f"Classification batch of {len(batch)} breaks failed; routing them to manual review")
+        return None
+      return output.final_output.classified_breaks.model_dump()
+
+  outputs = await asyncio.gather(*(run_batch(batch) for batch in batches))
+  for batch, output in zip(batches, outputs):
+    result.add_model_output(batch, output)
+  logger.info(f"Classification: {result.stats()} across {len(batches)} model batches")
+  return result
+
+
+async def write_audit_report(audit_report: dict, instruction: str, sources: str = "") -> dict[str, bool]:
+  """Generate the report sections concurrently, reusing cached ones, and assemble them in order.
+
+  Returns whether each section came from the cache.
+  """
+  semaphore = asyncio.Semaphore(AUDIT_SECTION_CONCURRENCY)
+
+  async def write(section: audit.Section) -> tuple[str, bool]:
+    section_input = prompt_layout.stage_input(
+      reference=[sources],
+      data=[auditing_agent_section(section, audit.section_input(audit_report, section))],
+      request=instruction
+    )
+    key = section_key(auditing_agent.model, f"{auditing_agent_instructions}\n{prompt_layout.canonical_json(section_input)}")
+    cached = await asyncio.to_thread(report_section_cache.get, key)
+    if cached is not None:
+      return cached, True
+    async with semaphore:
+      try:
+        result = await run_stage(
+          auditing_agent,
+          input=section_input,
+          run_config=RunConfig(trace_metadata={
+            "__trace_source__": "agent-builder",
+            "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
+          })
+        )
+      except Exception:
+        logger.exception(f"Audit section {section.name} failed; falling back to its metrics")
+        return audit.fallback_section(audit_report, section), False
+    text = result.final_output_as(str).strip()
+    await asyncio.to_thread(report_section_cache.put, key, section.name, text)
+    return text, False
+
+  written = await asyncio.gather(*(write(section) for section in audit.SECTIONS))
+  audit_report["final_report"]["text"] = audit.assemble(audit_report, {section.name: text for section, (text, _) in zip(audit.SECTIONS, written)})
+  cached = {section.name: hit for section, (_, hit) in zip(audit.SECTIONS, written)}
+  logger.info(f"Audit report: {sum(cached.values())} of {len(cached)} sections reused from cache")
+  return cached
+
+
+async def plan_delta(nbim_table: CsvTable, custody_table: CsvTable, validation_results: dict, layout: str, baseline_run_id: str | None):
+  """Event digests of this upload and, given a comparable baseline run, the events that changed since.
+
+  Returns `(digests, basis, event_delta, baseline_state)`; `event_delta` is None
+  when there is no baseline or its layout, mapping plan or outputs do not match.
+  """
+  digests = await asyncio.to_thread(delta.event_digests, nbim_table, custody_table, validation_results)
+  digest_basis = delta.basis(layout, validation_results)
+  if baseline_run_id is None:
+    return digests, digest_basis, None, {}
+  baseline = await asyncio.to_thread(session_store.get, baseline_run_id, ["delta_basis", "breaks_found_global", "updated_classified_breaks"])
+  if baseline.get("delta_basis") != digest_basis or len(baseline) < 3:
+    logger.info(f"Baseline run {baseline_run_id} is not comparable (layout, mapping plan or outputs differ); reconciling in full")
+    return digests, digest_basis, None, {}
+  event_delta = delta.diff(await asyncio.to_thread(session_store.get_event_digests, baseline_run_id), digests)
+  logger.info(f"Delta against run {baseline_run_id}: {event_delta.summary()}")
+  return digests, digest_basis, event_delta, baseline
+
+
+async def load_run_table(run_id: str | None, name: str, table: CsvTable | None) -> CsvTable | None:
+  """The uploaded table, or the one stored with the run when this request carries no upload."""
+  if table is not None or run_id is None:
+    return table
+  stored = await asyncio.to_thread(session_store.get_table, run_id, name)
+  return None if stored is None else await asyncio.to_thread(CsvTable.from_bytes, stored[1])
+
+
+def full_sources(sources: str, nbim_table: CsvTable | None, custody_table: CsvTable | None) -> tuple[str, bool]:
+  """`sources` with every CSV preview expanded to its table; False if a preview could not be expanded or was capped."""
+  for label, table in (("NBIM", nbim_table), ("CUSTODY", custody_table)):
+    if table is not None:
+      sources = ingestion.expand_preview(sources, label, table)
+  return sources, not ingestion.has_preview(sources)
+
+
 # Main code entrypoint
-async def run_workflow(workflow_input: WorkflowInput):
+async def run_workflow(workflow_input: WorkflowInput, nbim_table: CsvTable | None = None, custody_table: CsvTable | None = None, run_id: str | None = None, baseline_run_id: str | None = None, bypass_cache: bool = False):
   with trace("agentic-reconcilication"):
     state = {
       "globalstate": {
@@ -1429,53 +1732,77 @@ async def run_workflow(workflow_input: WorkflowInput):
         }
       }
     }
+    stored_keys: set[str] = set()
+    if run_id is not None:
+      stored = await asyncio.to_thread(session_store.get, run_id, list(SESSION_STATE_KEYS))
+      state.update(stored)
+      stored_keys = set(stored)
     workflow = workflow_input.model_dump()
-    conversation_history: list[TResponseInputItem] = [
-      {
-        "role": "user",
-        "content": [
-          {
-            "type": "input_text",
-            "text": workflow["input_as_text"]
-          }
-        ]
+    metrics.set_route("unrouted")
+    set_cache_bypass(bypass_cache)
+    # Each stage gets only the inputs it reads: the CSV blocks where it needs them, otherwise
+    # canonical blocks of the state it uses. Run-stable parts come first and the user's
+    # instruction last, so the provider's prompt cache can reuse the prefix (prompt_layout).
+    instruction, sources = prompt_layout.split_request(workflow["input_as_text"])
+    route_decision = routing.route_locally(workflow["input_as_text"], has_both_files=nbim_table is not None and custody_table is not None)
+    if route_decision is not None:
+      agent_result = {
+        "output_text": AgentSchema(response_type=route_decision.route).json(),
+        "output_parsed": {"response_type": route_decision.route}
       }
-    ]
-    agent_result_temp = await Runner.run(
-      agent,
-      input=[
-        *conversation_history
-      ],
-      run_config=RunConfig(trace_metadata={
-        "__trace_source__": "agent-builder",
-        "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
-      })
-    )
-
-    conversation_history.extend([item.to_input_item() for item in agent_result_temp.new_items])
-
-    agent_result = {
-      "output_text": agent_result_temp.final_output.json(),
-      "output_parsed": agent_result_temp.final_output.model_dump()
-    }
-    if agent_result["output_parsed"]["response_type"] == "breaks_identifier":
-      validation_agent_result_temp = await Runner.run(
-        validation_agent,
-        input=[
-          *conversation_history
-        ],
+    else:
+      agent_result_temp = await run_stage(
+        agent,
+        input=prompt_layout.stage_input(reference=[sources], request=instruction),
         run_config=RunConfig(trace_metadata={
           "__trace_source__": "agent-builder",
           "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
         })
       )
 
-      conversation_history.extend([item.to_input_item() for item in validation_agent_result_temp.new_items])
-
-      validation_agent_result = {
-        "output_text": validation_agent_result_temp.final_output.json(),
-        "output_parsed": validation_agent_result_temp.final_output.model_dump()
+      agent_result = {
+        "output_text": agent_result_temp.final_output.json(),
+        "output_parsed": agent_result_temp.final_output.model_dump()
       }
+      agent_result["output_parsed"]["response_type"] = routing.normalize_route(agent_result["output_parsed"]["response_type"])
+      route_decision = routing.RouteDecision(agent_result["output_parsed"]["response_type"], "llm")
+    routing.record(route_decision)
+    metrics.set_route(route_decision.route)
+    progress.emit("route", route_decision.as_dict())
+    if agent_result["output_parsed"]["response_type"] == "breaks_identifier":
+      # A continued run without re-uploads reconciles the tables stored with it, not the prompt previews
+      nbim_table = await load_run_table(run_id, "nbim", nbim_table)
+      custody_table = await load_run_table(run_id, "custody", custody_table)
+      validation_agent_result = None
+      layout = None
+      if nbim_table is not None and custody_table is not None:
+        layout = layout_fingerprint(nbim_table, custody_table)
+        cached_plan = await asyncio.to_thread(mapping_plan_cache.get, layout)
+        if cached_plan is not None:
+          logger.info(f"Mapping plan cache hit for layout {layout[:12]}; skipping validation_agent")
+          progress.emit("stage_end", {"stage": validation_agent.name, "ok": True, "cached": True, "duration_ms": 0.0})
+          validation_parsed = ValidationAgentSchema(**cached_plan)
+          validation_agent_result = {
+            "output_text": validation_parsed.json(),
+            "output_parsed": validation_parsed.model_dump()
+          }
+      if validation_agent_result is None:
+        validation_agent_result_temp = await run_stage(
+          validation_agent,
+          input=prompt_layout.stage_input(reference=[sources], request=instruction),
+          run_config=RunConfig(trace_metadata={
+            "__trace_source__": "agent-builder",
+            "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
+          })
+        )
+
+        validation_agent_result = {
+          "output_text": validation_agent_result_temp.final_output.json(),
+          "output_parsed": validation_agent_result_temp.final_output.model_dump()
+        }
+        # Critical plans need human validation and must not be replayed on later runs.
+        if layout is not None and not validation_agent_result["output_parsed"]["critical"]:
+          await asyncio.to_thread(mapping_plan_cache.put, layout, validation_agent_result["output_parsed"])
       state["validation_results"]["structural_validation"] = validation_agent_result["output_parsed"]["structural_validation"]
       state["validation_results"]["mapping_plan"]["mapped_columns"] = validation_agent_result["output_parsed"]["mapping_plan"]["mapped_columns"]
       state["validation_results"]["mapping_plan"]["derived_relationships"] = validation_agent_result["output_parsed"]["mapping_plan"]["derived_relationships"]
@@ -1483,111 +1810,164 @@ async def run_workflow(workflow_input: WorkflowInput):
       state["validation_results"]["manual_review"] = validation_agent_result["output_parsed"]["manual_review"]
       state["validation_results"]["critical"] = validation_agent_result["output_parsed"]["critical"]
       state["validation_results"]["summary"] = validation_agent_result["output_parsed"]["summary"]
-      break_classifier_result_temp = await Runner.run(
-        break_classifier,
-        input=[
-          *conversation_history
-        ],
-        run_config=RunConfig(trace_metadata={
-          "__trace_source__": "agent-builder",
-          "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
-        })
-      )
-
-      conversation_history.extend([item.to_input_item() for item in break_classifier_result_temp.new_items])
-
-      break_classifier_result = {
-        "output_text": break_classifier_result_temp.final_output.json(),
-        "output_parsed": break_classifier_result_temp.final_output.model_dump()
-      }
-      state["breaks_found_global"] = break_classifier_result["output_text"]
-      classification_agent_result_temp = await Runner.run(
-        classification_agent,
-        input=[
-          *conversation_history
-        ],
-        run_config=RunConfig(trace_metadata={
-          "__trace_source__": "agent-builder",
-          "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
-        })
-      )
-
-      conversation_history.extend([item.to_input_item() for item in classification_agent_result_temp.new_items])
-
-      classification_agent_result = {
-        "output_text": classification_agent_result_temp.final_output.json(),
-        "output_parsed": classification_agent_result_temp.final_output.model_dump()
-      }
+      if run_id is not None:
+        await asyncio.to_thread(session_store.put, run_id, {"validation_results": state["validation_results"]})
+      break_classifier_result = None
+      digests = event_delta = None
+      baseline: dict = {}
+      if nbim_table is not None and custody_table is not None:
+        try:
+          digests, digest_basis, event_delta, baseline = await plan_delta(nbim_table, custody_table, state["validation_results"], layout, baseline_run_id)
+          detect_nbim, detect_custody = nbim_table, custody_table
+          if event_delta is not None:
+            detect_nbim, detect_custody = await asyncio.to_thread(delta.restrict, nbim_table, custody_table, state["validation_results"], event_delta.reprocess)
+          if event_delta is not None and not event_delta.reprocess:
+            empty = BreakClassifierSchema(breaks_found=[])
+            break_classifier_result = {"output_text": empty.json(), "output_parsed": empty.model_dump()}
+          elif BREAK_DETECTION_MODE == "sharded":
+            break_classifier_result = await detect_breaks_sharded(detect_nbim, detect_custody, state["validation_results"])
+          else:
+            break_classifier_result = await detect_breaks_locally(detect_nbim, detect_custody, state["validation_results"])
+        except break_engine.EngineUnavailable as e:
+          logger.warning(f"Event keys unavailable, falling back to a single break_classifier call: {e}")
+      source_complete = True
+      if break_classifier_result is None:
+        # The model reconciles only what is in its prompt, so it gets every row rather than the preview
+        classifier_sources, source_complete = await asyncio.to_thread(full_sources, sources, nbim_table, custody_table)
+        if not source_complete:
+          logger.warning("break_classifier only sees a CSV preview; breaks beyond it are not reported")
+        pages = await run_paged_stage(
+          break_classifier,
+          prompt_layout.stage_input(
+            reference=[classifier_sources, prompt_layout.context_block("validation_results", state["validation_results"])],
+            request=instruction
+          ),
+          break_pages(),
+          run_config=RunConfig(trace_metadata={
+            "__trace_source__": "agent-builder",
+            "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
+          })
+        )
+        parsed = BreakClassifierSchema(breaks_found=pages.items)
+        break_classifier_result = {
+          "output_text": parsed.json(),
+          "output_parsed": parsed.model_dump(),
+          "pages": pages.stats()
+        }
+      # In delta mode only events inserted or changed since the baseline are detected and classified
+      new_breaks = break_classifier_result["output_parsed"]
+      if event_delta is not None:
+        carried = delta.carry_forward_breaks(baseline["breaks_found_global"]["breaks_found"], event_delta.unchanged)
+        state["breaks_found_global"] = {"breaks_found": break_engine.merge_breaks([carried, new_breaks["breaks_found"]])}
+      else:
+        state["breaks_found_global"] = new_breaks
+      if run_id is not None:
+        # The breaks, their delta basis and the event digests are one snapshot for later delta runs
+        await asyncio.to_thread(
+          session_store.put,
+          run_id,
+          {"breaks_found_global": state["breaks_found_global"], **({"delta_basis": digest_basis} if digests is not None else {})},
+          digests
+        )
+      classification_agent_result = None
+      if event_delta is None or new_breaks["breaks_found"]:
+        classification_triage = await classify_breaks(new_breaks["breaks_found"], state["validation_results"], instruction)
+        classification_parsed = ClassificationAgentSchema(classified_breaks=classification_triage.result())
+        classification_agent_result = {
+          "output_text": classification_parsed.json(),
+          "output_parsed": classification_parsed.model_dump(),
+          "triage": classification_triage.stats()
+        }
+      if event_delta is not None:
+        merged = delta.merge_classified(
+          baseline["updated_classified_breaks"],
+          event_delta.unchanged,
+          classification_agent_result["output_parsed"]["classified_breaks"] if classification_agent_result else None,
+          len(state["breaks_found_global"]["breaks_found"]),
+        )
+        classification_parsed = ClassificationAgentSchema(classified_breaks=merged)
+        classification_agent_result = {
+          "output_text": classification_parsed.json(),
+          "output_parsed": classification_parsed.model_dump(),
+          "delta": {"baseline_run_id": baseline_run_id, **event_delta.summary()},
+          **({"triage": classification_agent_result["triage"]} if classification_agent_result else {})
+        }
       state["updated_classified_breaks"] = classification_agent_result["output_parsed"]["classified_breaks"]
+      if run_id is not None:
+        await asyncio.to_thread(session_store.put, run_id, {"updated_classified_breaks": state["updated_classified_breaks"]})
+      if not source_complete:
+        classification_agent_result["partial"] = True
+        classification_agent_result["warning"] = "Breaks were identified from a CSV preview only; re-upload both files to reconcile every row."
+      classification_agent_result["routing"] = route_decision.as_dict()
       return classification_agent_result
     elif agent_result["output_parsed"]["response_type"] == "breaks_fixes":
-      correction_agent_result_temp = await Runner.run(
+      # Without stored state the client's context blocks in the request text are the only source.
+      if "updated_classified_breaks" in stored_keys:
+        correction_input = prompt_layout.stage_input(data=[prompt_layout.context_block("classified_breaks", state["updated_classified_breaks"])], request=instruction)
+      else:
+        correction_input = prompt_layout.stage_input(reference=[sources], request=instruction)
+      pages = await run_paged_stage(
         correction_agent,
-        input=[
-          *conversation_history
-        ],
+        correction_input,
+        correction_pages(),
         run_config=RunConfig(trace_metadata={
           "__trace_source__": "agent-builder",
           "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
         })
       )
-
-      conversation_history.extend([item.to_input_item() for item in correction_agent_result_temp.new_items])
-
+      # The counts are taken over the merged pages rather than trusted from the last page
+      parsed = CorrectionAgentSchema(
+        corrections=pages.items,
+        summary=correction_summary(pages.items, pages.last_page["summary"]["critical_issues"])
+      )
       correction_agent_result = {
-        "output_text": correction_agent_result_temp.final_output.json(),
-        "output_parsed": correction_agent_result_temp.final_output.model_dump()
+        "output_text": parsed.json(),
+        "output_parsed": parsed.model_dump(),
+        "pages": pages.stats()
       }
       state["corrections_list"] = correction_agent_result["output_parsed"]["corrections"]
+      if run_id is not None:
+        await asyncio.to_thread(session_store.put, run_id, {"corrections_list": state["corrections_list"]})
+        # Approved corrections are applied to the stored NBIM upload and logged as one reversible patch
+        patch = await asyncio.to_thread(corrections.apply_corrections, run_id, state["corrections_list"], state)
+        if patch is not None:
+          correction_agent_result["patch"] = patch
+      correction_agent_result["routing"] = route_decision.as_dict()
       return correction_agent_result
     elif agent_result["output_parsed"]["response_type"] == "report_generation":
-      auditing_agent_result_temp = await Runner.run(
-        auditing_agent,
-        input=[
-          *conversation_history
-        ],
-        run_config=RunConfig(trace_metadata={
-          "__trace_source__": "agent-builder",
-          "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
-        }),
-        context=AuditingAgentContext(state_validation_results=state["validation_results"], state_breaks_found_global=state["breaks_found_global"], state_updated_classified_breaks=state["updated_classified_breaks"], state_corrections_list=state["corrections_list"])
-      )
-
-      conversation_history.extend([item.to_input_item() for item in auditing_agent_result_temp.new_items])
-
+      # Totals, traces and the state hash are computed here; the agent only writes the narrative sections
+      audit_report = await asyncio.to_thread(audit.build, state, stored_keys)
+      cached_sections = await write_audit_report(audit_report, instruction, "" if stored_keys else sources)
       auditing_agent_result = {
-        "output_text": auditing_agent_result_temp.final_output_as(str)
+        "output_text": audit_report["final_report"]["text"],
+        # Per-event records stay in the session store; the response carries the aggregates
+        "audit_trail": {"audit_trail": audit_report["audit_trail"], "final_report": audit_report["final_report"]},
+        "sections": {"cached": cached_sections}
       }
+      if run_id is not None:
+        await asyncio.to_thread(session_store.put, run_id, {"audit_report": auditing_agent_result["output_text"], "audit_trail": audit_report})
+      auditing_agent_result["routing"] = route_decision.as_dict()
       return auditing_agent_result
     else:
-      agent_result_temp1 = await Runner.run(
+      agent_result_temp1 = await run_stage(
         agent1,
-        input=[
-          *conversation_history,
-          {
-            "role": "user",
-            "content": [
-              {
-                "type": "input_text",
-                "text": """The request type does not match the predefined scenarios that can be handled by the agent.
+        input=prompt_layout.stage_input(
+          reference=["""The request type does not match the predefined scenarios that can be handled by the agent.
 
               Here are the possible options:
               1. Breaks Identification: Upload the external and internal dividend bookings to identify breaks.
               2. Breaks Fixes: Approve or reject the different automatic suggested fixes.
-              3. Report Generation: Generate a report based on the breaks identification and fix suggestions in order to gain insight into how the agent makes decision."""
-              }
-            ]
-          }
-        ],
+              3. Report Generation: Generate a report based on the breaks identification and fix suggestions in order to gain insight into how the agent makes decision."""],
+          request=instruction
+        ),
         run_config=RunConfig(trace_metadata={
           "__trace_source__": "agent-builder",
           "workflow_id": "wf_6908b419723c81908a869bb9197755f00edab4504a94865f"
         })
       )
 
-      conversation_history.extend([item.to_input_item() for item in agent_result_temp1.new_items])
-
       agent_result1 = {
         "output_text": agent_result_temp1.final_output_as(str)
       }
+      agent_result1["routing"] = route_decision.as_dict()
       return agent_result1
@@ -0,0 +1,41 @@
+import hashlib
+import json
+import os
+from typing import Any
+
+from ingestion import CsvTable
+from sqlite_cache import SqliteCache
+
+MAPPING_CACHE_PATH = os.getenv("MAPPING_CACHE_PATH", "mapping_cache.sqlite3")
+MAPPING_CACHE_TTL_SECONDS = int(os.getenv("MAPPING_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+MAPPING_CACHE_MAX_ENTRIES = int(os.getenv("MAPPING_CACHE_MAX_ENTRIES", "256"))
+
+
+def layout_fingerprint(nbim: CsvTable, custody: CsvTable) -> str:
+    """SHA-256 over both files' column names and inferred types, in order."""
+    layout = {
+        "nbim": [[name, nbim.types[name]] for name in nbim.header],
+        "custody": [[name, custody.types[name]] for name in custody.header],
+    }
+    return hashlib.sha256(json.dumps(layout, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+class MappingPlanCache(SqliteCache):
+    """Persistent cache of validated `ValidationAgentSchema` outputs keyed by layout fingerprint."""
+
+    name = "Mapping plan cache"
+    table = "mapping_plans"
+    key_column = group_column = "fingerprint"
+    value_column = "validation_results"
+
+    def __init__(self, path: str = MAPPING_CACHE_PATH, ttl_seconds: int = MAPPING_CACHE_TTL_SECONDS, max_entries: int = MAPPING_CACHE_MAX_ENTRIES):
+        super().__init__(path, ttl_seconds, max_entries)
+
+    def get(self, fingerprint: str) -> dict[str, Any] | None:
+        return self._lookup(fingerprint, json.loads)
+
+    def put(self, fingerprint: str, validation_results: dict[str, Any]) -> None:
+        self._store(fingerprint, json.dumps(validation_results))
+
+
+mapping_plan_cache = MappingPlanCache()
@@ -0,0 +1,195 @@
+import bisect
+import contextvars
+import math
+import os
+import threading
+from collections import deque
+from typing import Iterable
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1 KiB .. 1 GiB
+QUANTILES = (0.5, 0.95, 0.99)
+QUANTILE_WINDOW = int(os.getenv("METRICS_QUANTILE_WINDOW", "1024"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry: list["_Metric"] = []
+_route: contextvars.ContextVar[str] = contextvars.ContextVar("metrics_route", default="unrouted")
+
+
+def set_route(route: str) -> None:
+    """Label agent metrics recorded later in this task with the workflow route."""
+    _route.set(route)
+
+
+def current_route() -> str:
+    return _route.get()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Iterable[tuple[str, str]]) -> str:
+    text = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return f"{{{text}}}" if text else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._series: dict[tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _pairs(self, key: tuple[str, ...], *extra: tuple[str, str]) -> str:
+        return _format_labels([*zip(self.labelnames, key), *extra])
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key in sorted(self._series):
+                lines.extend(self._render_series(key, self._series[key]))
+        return lines
+
+    def _render_series(self, key: tuple[str, ...], series) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, key, value) -> list[str]:
+        return [f"{self.name}{self._pairs(key)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def _render_series(self, key, series) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), series["counts"]):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{self._pairs(key, ('le', _format_value(bound)))} {cumulative}")
+        lines.append(f"{self.name}_sum{self._pairs(key)} {_format_value(series['sum'])}")
+        lines.append(f"{self.name}_count{self._pairs(key)} {series['count']}")
+        return lines
+
+
+class Summary(_Metric):
+    """Quantiles over the last `window` observations per label set, plus lifetime sum and count."""
+
+    kind = "summary"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), quantiles: tuple[float, ...] = QUANTILES, window: int = QUANTILE_WINDOW):
+        super().__init__(name, documentation, labelnames)
+        self.quantiles = quantiles
+        self.window = window
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"recent": deque(maxlen=self.window), "sum": 0.0, "count": 0}
+            series["recent"].append(value)
+            series["sum"] += value
+            series["count"] += 1
+
+    def _render_series(self, key, series) -> list[str]:
+        ordered = sorted(series["recent"])
+        lines = []
+        for q in self.quantiles:
+            value = _format_value(ordered[max(0, math.ceil(q * len(ordered)) - 1)]) if ordered else "NaN"
+            lines.append(f"{self.name}{self._pairs(key, ('quantile', _format_value(q)))} {value}")
+        lines.append(f"{self.name}_sum{self._pairs(key)} {_format_value(series['sum'])}")
+        lines.append(f"{self.name}_count{self._pairs(key)} {series['count']}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines: list[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+AGENT_LABELS = ("agent", "route")
+
+agent_duration_seconds = Histogram(
+    "reconciliation_agent_duration_seconds", "Wall time of one agent stage.", AGENT_LABELS)
+agent_input_tokens = Histogram(
+    "reconciliation_agent_input_tokens", "Input tokens consumed by one agent stage.", AGENT_LABELS, TOKEN_BUCKETS)
+agent_cached_input_tokens = Histogram(
+    "reconciliation_agent_cached_input_tokens", "Input tokens of one agent stage served from the provider's prompt cache.", AGENT_LABELS, TOKEN_BUCKETS)
+agent_time_to_first_token_seconds = Histogram(
+    "reconciliation_agent_time_to_first_token_seconds", "Time from the start of a streamed agent stage to its first output delta.", AGENT_LABELS)
+agent_output_tokens = Histogram(
+    "reconciliation_agent_output_tokens", "Output tokens produced by one agent stage.", AGENT_LABELS, TOKEN_BUCKETS)
+agent_model_requests_total = Counter(
+    "reconciliation_agent_model_requests_total", "Model requests issued by agent stages.", AGENT_LABELS)
+agent_retries_total = Counter(
+    "reconciliation_agent_retries_total", "Model requests beyond the first within one agent stage.", AGENT_LABELS)
+agent_response_cache_hits_total = Counter(
+    "reconciliation_agent_response_cache_hits_total", "Agent stages answered from the local response cache.", AGENT_LABELS)
+agent_parse_failures_total = Counter(
+    "reconciliation_agent_parse_failures_total", "Agent outputs that failed structured-output parsing.", AGENT_LABELS)
+agent_errors_total = Counter(
+    "reconciliation_agent_errors_total", "Agent stages that raised, by exception type.", (*AGENT_LABELS, "error"))
+
+route_decisions_total = Counter(
+    "reconciliation_route_decisions_total", "Workflow routing decisions, by deciding path (local rules or router agent) and route.", ("source", "route"))
+
+model_client_connect_seconds = Histogram(
+    "reconciliation_model_client_connect_seconds", "Warm-up request time of a pooled model client, including connection setup.")
+
+model_scheduler_wait_seconds = Histogram(
+    "reconciliation_model_scheduler_wait_seconds", "Time a model call waited for rate-limit budget, by priority.", ("priority",))
+model_rate_limited_total = Counter(
+    "reconciliation_model_rate_limited_total", "Model calls rejected by the provider with HTTP 429.")
+
+http_request_duration_seconds = Histogram(
+    "reconciliation_http_request_duration_seconds", "HTTP request latency.", ("method", "path", "status"))
+http_request_latency_seconds = Summary(
+    "reconciliation_http_request_latency_seconds", "HTTP request latency quantiles over recent requests.", ("method", "path"))
+upload_size_bytes = Histogram(
+    "reconciliation_upload_size_bytes", "Size of uploaded CSV files.", ("file",), SIZE_BUCKETS)
+upload_rows = Histogram(
+    "reconciliation_upload_rows", "Data rows in uploaded CSV files.", ("file",), tuple(10 ** i for i in range(8)))
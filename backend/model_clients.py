@@ -0,0 +1,188 @@
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+import httpx
+from agents import OpenAIProvider
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAIError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 0 leaves every agent on one unpooled client.
+MODEL_CLIENT_POOL_SIZE = int(os.getenv("MODEL_CLIENT_POOL_SIZE", "4"))
+MODEL_CLIENT_MAX_CONNECTIONS = int(os.getenv("MODEL_CLIENT_MAX_CONNECTIONS", "8"))
+MODEL_CLIENT_KEEPALIVE_SECONDS = float(os.getenv("MODEL_CLIENT_KEEPALIVE_SECONDS", "120"))
+MODEL_CLIENT_WARMUP_RETRY_SECONDS = float(os.getenv("MODEL_CLIENT_WARMUP_RETRY_SECONDS", "10"))
+MODEL_CLIENT_HTTP2 = os.getenv("MODEL_CLIENT_HTTP2", "1") == "1"
+
+
+def _http2() -> bool:
+    if not MODEL_CLIENT_HTTP2:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP/2 needs the 'h2' package; model clients fall back to HTTP/1.1 keep-alive")
+        return False
+    return True
+
+
+def _http_client(http2: bool) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=MODEL_CLIENT_MAX_CONNECTIONS,
+        max_keepalive_connections=MODEL_CLIENT_MAX_CONNECTIONS,
+        keepalive_expiry=MODEL_CLIENT_KEEPALIVE_SECONDS,
+    )
+    return DefaultAsyncHttpxClient(http2=http2, limits=limits)
+
+
+@dataclass
+class PooledClient:
+    index: int
+    client: AsyncOpenAI
+    provider: OpenAIProvider
+    http2: bool
+    in_flight: int = 0
+    leases: int = 0
+    connect_seconds: float | None = None
+
+    @property
+    def warm(self) -> bool:
+        return self.connect_seconds is not None
+
+    def describe(self) -> dict[str, Any]:
+        return {
+            "index": self.index,
+            "http2": self.http2,
+            "warm": self.warm,
+            "in_flight": self.in_flight,
+            "leases": self.leases,
+            "connect_seconds": None if self.connect_seconds is None else round(self.connect_seconds, 4),
+        }
+
+
+class ModelClientPool:
+    """Long-lived `AsyncOpenAI` clients shared by every agent stage.
+
+    Clients never retry on their own (`max_retries=0`): a 429 retried inside
+    the SDK would bypass `model_scheduler`, which owns all backoff.
+
+    `start` opens the clients and warms each one with a cheap authenticated
+    request, so TLS and HTTP/2 connections exist before the first workflow.
+    Warm-up of each client is retried in the background until it succeeds;
+    `ready` turns true once at least one client is warm. `lease` hands out the
+    least-loaded warm client, and a cold one only while none is warm.
+    """
+
+    def __init__(self, size: int = MODEL_CLIENT_POOL_SIZE):
+        self.size = size
+        self.clients: list[PooledClient] = []
+        self.ready = False
+        self.error: str | None = None
+        self._warmup: asyncio.Task | None = None
+        self._fallback: PooledClient | None = None
+        self._fallback_failed = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    async def start(self) -> None:
+        if not self.enabled or self.clients:
+            return
+        http2 = _http2()
+        try:
+            for index in range(self.size):
+                client = AsyncOpenAI(http_client=_http_client(http2), max_retries=0)
+                self.clients.append(PooledClient(index, client, OpenAIProvider(openai_client=client, use_responses=True), http2))
+        except Exception as e:
+            # Typically a missing API key; stages keep using the SDK default and readiness stays false
+            self.error = f"{type(e).__name__}: {e}"
+            logger.error(f"Model client pool could not start: {self.error}")
+            await self.close()
+            return
+        self._warmup = asyncio.create_task(self._keep_warming())
+
+    async def _warm(self, pooled: PooledClient) -> None:
+        started = time.perf_counter()
+        await pooled.client.models.list()
+        pooled.connect_seconds = time.perf_counter() - started
+        metrics.model_client_connect_seconds.observe(pooled.connect_seconds)
+
+    async def _keep_warming(self) -> None:
+        while True:
+            cold = [pooled for pooled in self.clients if not pooled.warm]
+            results = await asyncio.gather(*(self._warm(pooled) for pooled in cold), return_exceptions=True)
+            failures = [result for result in results if isinstance(result, Exception)]
+            warm = len(self.clients) - len(failures)
+            if warm and not self.ready:
+                self.ready = True
+                logger.info(f"Model client pool ready: {warm} of {len(self.clients)} clients warm")
+            if not failures:
+                self.error = None
+                return
+            self.error = f"{type(failures[0]).__name__}: {failures[0]}"
+            logger.warning(f"Warm-up of {len(failures)} model clients failed ({self.error}); retrying in {MODEL_CLIENT_WARMUP_RETRY_SECONDS}s")
+            await asyncio.sleep(MODEL_CLIENT_WARMUP_RETRY_SECONDS)
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[OpenAIProvider | None]:
+        """The provider of the least-loaded (preferably warm) client for one stage; the unpooled fallback while the pool is not running."""
+        if not self.clients:
+            fallback = self._fallback_client()
+            yield None if fallback is None else fallback.provider
+            return
+        pooled = min(self.clients, key=lambda item: (not item.warm, item.in_flight, item.leases))
+        pooled.in_flight += 1
+        pooled.leases += 1
+        try:
+            yield pooled.provider
+        finally:
+            pooled.in_flight -= 1
+
+    def _fallback_client(self) -> PooledClient | None:
+        """One unpooled client without SDK retries, used while the pool is disabled or not started."""
+        if self._fallback is None and not self._fallback_failed:
+            try:
+                client = AsyncOpenAI(max_retries=0)
+            except OpenAIError as e:
+                # Typically a missing API key; the SDK default client fails the same way on a real call
+                logger.warning(f"Fallback model client unavailable, using the SDK default: {e}")
+                self._fallback_failed = True
+                return None
+            self._fallback = PooledClient(-1, client, OpenAIProvider(openai_client=client, use_responses=True), http2=False)
+        return self._fallback
+
+    async def close(self) -> None:
+        if self._warmup is not None:
+            self._warmup.cancel()
+            self._warmup = None
+        for pooled in [*self.clients, *([self._fallback] if self._fallback else [])]:
+            await pooled.client.close()
+        self.clients = []
+        self._fallback = None
+        self.ready = False
+
+    def stats(self) -> dict[str, Any]:
+        in_use = sum(1 for pooled in self.clients if pooled.in_flight)
+        connect = [pooled.connect_seconds for pooled in self.clients if pooled.connect_seconds is not None]
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "size": len(self.clients),
+            "in_use": in_use,
+            "idle": len(self.clients) - in_use,
+            "warm": sum(1 for pooled in self.clients if pooled.warm),
+            "in_flight": sum(pooled.in_flight for pooled in self.clients),
+            "mean_connect_seconds": round(sum(connect) / len(connect), 4) if connect else None,
+            "error": self.error,
+            "clients": [pooled.describe() for pooled in self.clients],
+        }
+
+
+model_client_pool = ModelClientPool()
@@ -0,0 +1,102 @@
+"""Continuation protocol for list-valued structured outputs.
+
+A paged agent returns at most `page_size` items per call plus a `next_cursor`
+naming the last item it returned. While the cursor is set, the stage is
+called again with the same input and a PAGE block holding the cursor, so no
+single response has to fit every item into `max_tokens`. Each page is
+validated against the agent's schema by the SDK and merged here, dropping
+items repeated across pages.
+"""
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable, Sequence
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_PAGE_SIZE = int(os.getenv("OUTPUT_PAGE_SIZE", "15"))
+OUTPUT_MIN_PAGE_SIZE = int(os.getenv("OUTPUT_MIN_PAGE_SIZE", "3"))
+OUTPUT_MAX_PAGES = int(os.getenv("OUTPUT_MAX_PAGES", "500"))
+
+
+class PaginationError(RuntimeError):
+    """A paged stage stopped making progress or exceeded `OUTPUT_MAX_PAGES`."""
+
+
+def instructions(items_key: str, cursor_fields: Sequence[str]) -> str:
+    """Prompt section appended to a paged agent's instructions."""
+    cursor = ":".join(f"<{name}>" for name in cursor_fields)
+    order = ", ".join(f"`{name}`" for name in cursor_fields)
+    return f"""
+
+---
+
+### **Output Pages**
+
+`{items_key}` is returned in pages. The last input message is a PAGE block with `page_size` and `cursor`.
+
+* Order `{items_key}` by {order}, ascending, and return at most `page_size` items.
+* If `cursor` is set, start with the first item that comes after it in that order; never repeat an item from an earlier page.
+* If more items remain after this page, set `next_cursor` to `{cursor}` of the last item you returned. Otherwise set `next_cursor` to null.
+* Every other field of the output describes the complete result, not just this page.
+"""
+
+
+def page_block(page_size: int, cursor: str | None, returned: int) -> str:
+    return (
+        "--- PAGE START ---\n"
+        f"page_size: {page_size}\n"
+        f"cursor: {cursor if cursor is not None else 'null'}\n"
+        f"items_returned_so_far: {returned}\n"
+        "--- PAGE END ---"
+    )
+
+
+def cursor_of(item: dict[str, Any], cursor_fields: Sequence[str]) -> str:
+    return ":".join(_cursor_part(item.get(name)) for name in cursor_fields)
+
+
+def _cursor_part(value: Any) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return "" if value is None else str(value)
+
+
+@dataclass
+class Pages:
+    """Items merged from the pages of one paged stage, deduplicated by `identity`."""
+
+    items_key: str
+    identity: Callable[[dict[str, Any]], Hashable]
+    items: list[dict[str, Any]] = field(default_factory=list)
+    pages: int = 0
+    duplicates: int = 0
+    last_page: dict[str, Any] = field(default_factory=dict)
+    _seen: set[Hashable] = field(default_factory=set)
+    _cursors: set[str] = field(default_factory=set)
+
+    def add(self, page: dict[str, Any]) -> str | None:
+        """Merge one validated page; returns the cursor for the next page, or None when the output is complete."""
+        self.pages += 1
+        self.last_page = page
+        added = 0
+        for item in page[self.items_key]:
+            key = self.identity(item)
+            if key in self._seen:
+                self.duplicates += 1
+                continue
+            self._seen.add(key)
+            self.items.append(item)
+            added += 1
+        cursor = page.get("next_cursor")
+        if cursor is None:
+            return None
+        if not added or cursor in self._cursors:
+            raise PaginationError(f"Page {self.pages} of {self.items_key} made no progress (cursor {cursor!r})")
+        if self.pages >= OUTPUT_MAX_PAGES:
+            raise PaginationError(f"{self.items_key} exceeded {OUTPUT_MAX_PAGES} pages")
+        self._cursors.add(cursor)
+        return cursor
+
+    def stats(self) -> dict[str, int]:
+        return {"pages": self.pages, "items": len(self.items), "duplicates": self.duplicates}
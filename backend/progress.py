@@ -0,0 +1,135 @@
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Array keys whose elements are streamed as individual `item` events.
+STREAMED_ARRAYS = {"breaks_found", "auto_candidates", "manual_candidates", "corrections"}
+
+
+class ProgressReporter:
+    """Collects workflow progress events for one streaming request."""
+
+    def __init__(self):
+        self.queue: asyncio.Queue[tuple[str, dict[str, Any]]] = asyncio.Queue()
+        self.started_at = time.perf_counter()
+
+    def emit(self, event: str, data: dict[str, Any]) -> None:
+        data = {**data, "elapsed_ms": round((time.perf_counter() - self.started_at) * 1000, 1)}
+        self.queue.put_nowait((event, data))
+
+
+_current: contextvars.ContextVar[ProgressReporter | None] = contextvars.ContextVar("progress_reporter", default=None)
+
+
+def current_reporter() -> ProgressReporter | None:
+    return _current.get()
+
+
+def use_reporter(reporter: ProgressReporter) -> None:
+    """Attach a reporter to the current task; call from inside the task that runs the workflow."""
+    _current.set(reporter)
+
+
+def emit(event: str, data: dict[str, Any]) -> None:
+    reporter = _current.get()
+    if reporter is not None:
+        reporter.emit(event, data)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[dict[str, Any]]:
+    """Emit `stage_start`/`stage_end` around a block; extra fields can be added to the yielded dict."""
+    extra: dict[str, Any] = {}
+    started = time.perf_counter()
+    emit("stage_start", {"stage": name})
+    try:
+        yield extra
+    except Exception as e:
+        emit("stage_end", {"stage": name, "ok": False, "error": str(e),
+                           "duration_ms": round((time.perf_counter() - started) * 1000, 1)})
+        raise
+    emit("stage_end", {"stage": name, "ok": True, **extra,
+                       "duration_ms": round((time.perf_counter() - started) * 1000, 1)})
+
+
+def emit_items(stage_name: str, array_key: str, items: list[dict[str, Any]]) -> None:
+    for item in items:
+        emit("item", {"stage": stage_name, "array": array_key, "item": item})
+
+
+class JsonArrayItemStream:
+    """Pull complete objects out of named JSON arrays while the JSON text is still streaming.
+
+    `feed` accepts text deltas and returns `(array_key, item)` pairs for every
+    object element that closed inside one of `array_keys`.
+    """
+
+    def __init__(self, array_keys: set[str] = STREAMED_ARRAYS):
+        self.array_keys = array_keys
+        # Unscanned text plus whatever an open string or streamed item may still slice, from `_base` on
+        self._buffer = ""
+        self._base = 0
+        self._offset = 0
+        self._stack: list[tuple[str, str | None, int]] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: str | None = None
+        self._pending_key: str | None = None
+
+    def feed(self, delta: str) -> list[tuple[str, dict[str, Any]]]:
+        self._buffer += delta
+        text, base = self._buffer, self._base
+        found: list[tuple[str, dict[str, Any]]] = []
+        for i in range(self._offset, base + len(text)):
+            char = text[i - base]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1 - base:i - base]
+                continue
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char == ":":
+                self._pending_key = self._last_string
+            elif char == ",":
+                self._pending_key = None
+            elif char in "{[":
+                parent_is_object = bool(self._stack) and self._stack[-1][0] == "{"
+                self._stack.append((char, self._pending_key if parent_is_object else None, i))
+                self._pending_key = None
+            elif char in "}]" and self._stack:
+                opener, _, start = self._stack.pop()
+                if char == "}" and self._stack and self._stack[-1][0] == "[" and self._stack[-1][1] in self.array_keys:
+                    try:
+                        found.append((self._stack[-1][1], json.loads(text[start - base:i + 1 - base])))
+                    except ValueError:
+                        logger.debug("Skipping unparsable streamed item")
+        self._offset = base + len(text)
+        self._trim()
+        return found
+
+    def _trim(self) -> None:
+        """Drop buffered text that no later item or key can reach, so each delta is scanned once."""
+        keep = self._string_start if self._in_string else self._offset
+        for (parent, key, _), (opener, _, start) in zip(self._stack, self._stack[1:]):
+            if parent == "[" and key in self.array_keys and opener == "{":
+                keep = min(keep, start)
+                break
+        self._buffer = self._buffer[keep - self._base:]
+        self._base = keep
+
+
+def format_sse(event: str, data: dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
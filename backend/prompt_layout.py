@@ -0,0 +1,40 @@
+"""Stage input layout with byte-stable prefixes, so provider prompt caching can hit.
+
+Providers reuse the longest request prefix they have seen recently: the agent
+instructions, then the input messages in order. Every stage input is laid out
+as
+
+1. reference data that is identical for every stage and call of a run (the
+   uploaded CSV blocks, the mapping plan),
+2. the data of this stage,
+3. the request text, which changes from call to call, last.
+
+JSON is rendered canonically (sorted keys, compact separators) so equal data
+is always equal bytes.
+"""
+import json
+from typing import Any, Sequence
+
+from agents import TResponseInputItem
+
+import routing
+
+
+def canonical_json(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def context_block(label: str, value: Any) -> str:
+    return f"--- CONTEXT {label} START ---\n{canonical_json(value)}\n--- CONTEXT {label} END ---"
+
+
+def split_request(text: str) -> tuple[str, str]:
+    """The user's instruction and the CSV and context blocks `server.py` appended to it."""
+    instruction = routing.instruction_text(text)
+    return instruction.strip(), text[len(instruction):].strip()
+
+
+def stage_input(reference: Sequence[str] = (), data: Sequence[str] = (), request: str = "") -> list[TResponseInputItem]:
+    """One user message per non-empty part, in cache-friendly order: reference, data, request."""
+    parts = ["\n\n".join(part for part in group if part) for group in (reference, data)] + [request.strip()]
+    return [{"role": "user", "content": [{"type": "input_text", "text": part}]} for part in parts if part]
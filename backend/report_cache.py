@@ -0,0 +1,34 @@
+import hashlib
+import os
+
+from sqlite_cache import SqliteCache
+
+REPORT_CACHE_PATH = os.getenv("REPORT_CACHE_PATH", "report_cache.sqlite3")
+REPORT_CACHE_TTL_SECONDS = int(os.getenv("REPORT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "1024"))
+
+
+def section_key(model: str, prompt: str) -> str:
+    """SHA-256 over the model and the fully rendered section prompt, which embeds the section's input."""
+    return hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+class ReportSectionCache(SqliteCache):
+    """Persistent cache of generated audit report sections keyed by `section_key`; invalidated per section."""
+
+    name = "Report section cache"
+    table = "report_sections"
+    group_column = "section"
+    value_column = "text"
+
+    def __init__(self, path: str = REPORT_CACHE_PATH, ttl_seconds: int = REPORT_CACHE_TTL_SECONDS, max_entries: int = REPORT_CACHE_MAX_ENTRIES):
+        super().__init__(path, ttl_seconds, max_entries)
+
+    def get(self, key: str) -> str | None:
+        return self._lookup(key, str)
+
+    def put(self, key: str, section: str, text: str) -> None:
+        self._store(key, text, section)
+
+
+report_section_cache = ReportSectionCache()
@@ -0,0 +1,103 @@
+import contextvars
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any
+
+from agents import Agent
+from agents.run_context import RunContextWrapper
+from agents.usage import Usage
+from pydantic import BaseModel
+
+from sqlite_cache import SqliteCache
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "4096"))
+
+_bypass: contextvars.ContextVar[bool] = contextvars.ContextVar("response_cache_bypass", default=False)
+
+
+def set_cache_bypass(bypass: bool) -> None:
+    """Skip cache lookups for agent stages run later in this task; fresh responses are still stored."""
+    _bypass.set(bypass)
+
+
+def response_key(agent: Agent, input: str | list) -> str | None:
+    """SHA-256 over everything that determines a deterministic agent's answer, or None if it is not one.
+
+    Only agents with static instructions and `temperature=0` are cached.
+    """
+    if not isinstance(agent.instructions, str) or agent.model_settings.temperature != 0:
+        return None
+    output_type = agent.output_type
+    identity = {
+        "agent": agent.name,
+        "model": str(agent.model),
+        "instructions": agent.instructions,
+        "model_settings": agent.model_settings.to_json_dict(),
+        "output_type": output_type.model_json_schema() if _is_model(output_type) else getattr(output_type, "__name__", None),
+        "tools": [tool.name for tool in agent.tools],
+        "input": input,
+    }
+    canonical = json.dumps(identity, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _is_model(output_type: Any) -> bool:
+    return isinstance(output_type, type) and issubclass(output_type, BaseModel)
+
+
+def dump_output(final_output: Any) -> str:
+    if isinstance(final_output, BaseModel):
+        return final_output.model_dump_json()
+    return final_output if isinstance(final_output, str) else json.dumps(final_output)
+
+
+@dataclass
+class CachedRunResult:
+    """Stands in for a `RunResult` whose output came from the cache; no model requests were made."""
+
+    final_output: Any
+    context_wrapper: RunContextWrapper = field(default_factory=lambda: RunContextWrapper(context=None, usage=Usage()))
+
+    def final_output_as(self, cls: type, raise_if_incorrect_type: bool = False) -> Any:
+        if raise_if_incorrect_type and not isinstance(self.final_output, cls):
+            raise TypeError(f"Final output is not of type {cls.__name__}")
+        return self.final_output
+
+
+class ResponseCache(SqliteCache):
+    """Persistent cache of deterministic agent outputs keyed by `response_key`; invalidated per agent."""
+
+    name = "Response cache"
+    table = "agent_responses"
+    group_column = "agent"
+    value_column = "output"
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, ttl_seconds: int = RESPONSE_CACHE_TTL_SECONDS, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, enabled: bool = RESPONSE_CACHE_ENABLED):
+        super().__init__(path, ttl_seconds, max_entries)
+        self.enabled = enabled
+
+    def key(self, agent: Agent, input: str | list) -> str | None:
+        """The cache key for this call, or None when the cache is disabled or the agent is not deterministic."""
+        return response_key(agent, input) if self.enabled else None
+
+    def get(self, agent: Agent, key: str) -> CachedRunResult | None:
+        if _bypass.get():
+            return None
+        # A stored output that no longer validates against the agent's schema is a miss
+        decode = agent.output_type.model_validate_json if _is_model(agent.output_type) else str
+        output = self._lookup(key, decode)
+        return None if output is None else CachedRunResult(output)
+
+    def put(self, agent: Agent, key: str, final_output: Any) -> None:
+        self._store(key, dump_output(final_output), agent.name)
+
+    def stats(self) -> dict[str, Any]:
+        return {"enabled": self.enabled, **super().stats()}
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,62 @@
+import logging
+import re
+from dataclasses import asdict, dataclass
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BREAKS_IDENTIFIER = "breaks_identifier"
+BREAKS_FIXES = "breaks_fixes"
+REPORT_GENERATION = "report_generation"
+
+# The router prompt names the fixer route "breaks_fixer"; the workflow branches on "breaks_fixes".
+ROUTE_ALIASES = {"breaks_fixer": BREAKS_FIXES}
+
+_TEXT_RULES = (
+    (BREAKS_FIXES, "fixer_phrase", re.compile(r"strawberries\s+and\s+mangoes", re.IGNORECASE)),
+    (BREAKS_FIXES, "fix_breaks", re.compile(r"\b(fix|correct|resolve)\w*\b.*\bbreaks?\b", re.IGNORECASE | re.DOTALL)),
+    (REPORT_GENERATION, "generate_report", re.compile(r"\b(generate|create|produce|write)\w*\b.*\breport\b", re.IGNORECASE | re.DOTALL)),
+    (BREAKS_IDENTIFIER, "identify_breaks", re.compile(r"\b(identify|detect|find)\w*\b.*\bbreaks?\b", re.IGNORECASE | re.DOTALL)),
+)
+
+
+@dataclass
+class RouteDecision:
+    route: str
+    source: str
+    rule: str | None = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def instruction_text(text: str) -> str:
+    """The user's own instruction, without the CSV and context blocks appended to it."""
+    return text.split("\n--- ", 1)[0]
+
+
+def route_locally(text: str, has_both_files: bool) -> RouteDecision | None:
+    """Decide the route without the LLM when the request shape or wording is unambiguous.
+
+    Returns None when no rule matches or rules disagree, so the caller can fall
+    back to the router agent.
+    """
+    if has_both_files:
+        return RouteDecision(BREAKS_IDENTIFIER, "local", "both_files_attached")
+    instruction = instruction_text(text)
+    matches = [(route, rule) for route, rule, pattern in _TEXT_RULES if pattern.search(instruction)]
+    if matches and matches[0][1] == "fixer_phrase":
+        return RouteDecision(BREAKS_FIXES, "local", "fixer_phrase")
+    if len({route for route, _ in matches}) == 1:
+        return RouteDecision(matches[0][0], "local", matches[0][1])
+    return None
+
+
+def normalize_route(route: str) -> str:
+    return ROUTE_ALIASES.get(route, route)
+
+
+def record(decision: RouteDecision) -> None:
+    metrics.route_decisions_total.inc(source=decision.source, route=decision.route)
+    logger.info(f"Routed to {decision.route} via {decision.source} path" + (f" ({decision.rule})" if decision.rule else ""))
@@ -0,0 +1,214 @@
+"""Process-wide admission control for model calls.
+
+Every agent stage that reaches the model waits here for a slot:
+
+* Requests and tokens per minute are budgeted with two token buckets
+  (`MODEL_RPM_LIMIT`, `MODEL_TPM_LIMIT`). A call is charged its estimated
+  input tokens plus its `max_tokens`, and settled against the usage the
+  provider reports once it returns.
+* Waiting calls are served by priority, then in arrival order. Interactive
+  routes go before break identification, which is batch work.
+* A 429 pauses dispatch for an exponential, jittered backoff (or the
+  server's `retry-after`) and empties both buckets. Queued calls then resume
+  at the refill rate instead of all at once.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator
+
+from agents import Agent
+from openai import RateLimitError
+
+import metrics
+from sharding import estimate_tokens as estimate_text_tokens
+
+logger = logging.getLogger(__name__)
+
+# 0 disables the respective budget; with both at 0 calls are not queued at all.
+MODEL_RPM_LIMIT = int(os.getenv("MODEL_RPM_LIMIT", "500"))
+MODEL_TPM_LIMIT = int(os.getenv("MODEL_TPM_LIMIT", "200000"))
+MODEL_RATE_LIMIT_RETRIES = int(os.getenv("MODEL_RATE_LIMIT_RETRIES", "4"))
+BACKOFF_BASE_SECONDS = float(os.getenv("MODEL_BACKOFF_BASE_SECONDS", "1"))
+BACKOFF_MAX_SECONDS = float(os.getenv("MODEL_BACKOFF_MAX_SECONDS", "60"))
+
+# Lower is served first. The router runs before a route is known and is always interactive.
+ROUTE_PRIORITIES = {"unrouted": 0, "report_generation": 0, "breaks_fixes": 1, "breaks_identifier": 2}
+DEFAULT_PRIORITY = 1
+
+
+def priority(route: str) -> int:
+    return ROUTE_PRIORITIES.get(route, DEFAULT_PRIORITY)
+
+
+def estimate_tokens(agent: Agent, input: str | list) -> int:
+    """Tokens a call may consume: instructions and input by character count, plus the output ceiling."""
+    text = input if isinstance(input, str) else json.dumps(input, ensure_ascii=False, default=str)
+    instructions = agent.instructions if isinstance(agent.instructions, str) else ""
+    return estimate_text_tokens(instructions) + estimate_text_tokens(text) + (agent.model_settings.max_tokens or 0)
+
+
+class TokenBucket:
+    """`per_minute` units refilled continuously; 0 means unlimited."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken. A call larger than the whole budget waits for a full bucket."""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.capacity:
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+    def drain(self, now: float, pause: float) -> None:
+        """Empty the bucket so that, after refilling through `pause`, it holds nothing."""
+        if self.capacity:
+            self._refill(now)
+            self.tokens = min(self.tokens, -pause * self.rate)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    tokens: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+@dataclass
+class Slot:
+    """Admission of one model call; `settle` corrects the token charge once real usage is known."""
+
+    scheduler: "ModelScheduler"
+    estimated_tokens: int
+
+    def settle(self, used_tokens: int) -> None:
+        self.scheduler.tokens.take(used_tokens - self.estimated_tokens)
+
+
+class ModelScheduler:
+    def __init__(self, rpm: int = MODEL_RPM_LIMIT, tpm: int = MODEL_TPM_LIMIT):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self.in_flight = 0
+        self.dispatched = 0
+        self.rate_limited = 0
+        self._backoffs = 0
+        self._queue: list[_Waiter] = []
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.requests.capacity or self.tokens.capacity)
+
+    @asynccontextmanager
+    async def slot(self, priority: int, estimated_tokens: int) -> AsyncIterator[Slot]:
+        """Wait for budget, then hold the slot for one model call. A 429 raised inside triggers the backoff."""
+        if self.enabled:
+            started = time.perf_counter()
+            await self._admit(priority, estimated_tokens)
+            metrics.model_scheduler_wait_seconds.observe(time.perf_counter() - started, priority=str(priority))
+        self.in_flight += 1
+        try:
+            yield Slot(self, estimated_tokens)
+        except RateLimitError as e:
+            self._throttle(e)
+            raise
+        else:
+            if time.monotonic() >= self.paused_until:
+                self._backoffs = 0
+        finally:
+            self.in_flight -= 1
+
+    async def _admit(self, priority: int, tokens: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, _Waiter(priority, next(self._seq), tokens, future))
+        self._dispatch()
+        # A cancelled waiter stays in the heap with a done future and is skipped by _dispatch
+        await future
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self._queue:
+            head = self._queue[0]
+            if head.future.done():
+                heapq.heappop(self._queue)
+                continue
+            wait = max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(head.tokens, now))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(head.tokens)
+            self.dispatched += 1
+            head.future.set_result(None)
+
+    def _throttle(self, error: RateLimitError) -> None:
+        now = time.monotonic()
+        self.rate_limited += 1
+        metrics.model_rate_limited_total.inc()
+        # 429s from calls already in flight during a pause belong to the same episode
+        if now < self.paused_until:
+            return
+        self._backoffs += 1
+        backoff = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (self._backoffs - 1))
+        delay = max(random.uniform(backoff / 2, backoff), _retry_after(error))
+        self.paused_until = now + delay
+        self.requests.drain(now, delay)
+        self.tokens.drain(now, delay)
+        logger.warning(f"Model rate limit hit; pausing dispatch for {delay:.1f}s ({len(self._queue)} calls queued)")
+        if self._queue:
+            self._dispatch()
+
+    def stats(self) -> dict[str, Any]:
+        now = time.monotonic()
+        for bucket in (self.requests, self.tokens):
+            bucket.wait_time(0, now)
+        return {
+            "enabled": self.enabled,
+            "rpm_limit": int(self.requests.capacity),
+            "tpm_limit": int(self.tokens.capacity),
+            "queued": sum(1 for waiter in self._queue if not waiter.future.done()),
+            "in_flight": self.in_flight,
+            "dispatched": self.dispatched,
+            "rate_limited": self.rate_limited,
+            "paused_for_seconds": round(max(0.0, self.paused_until - now), 3),
+            "requests_available": None if not self.requests.capacity else round(self.requests.tokens, 1),
+            "tokens_available": None if not self.tokens.capacity else round(self.tokens.tokens),
+        }
+
+
+def _retry_after(error: RateLimitError) -> float:
+    try:
+        return float(error.response.headers.get("retry-after", 0))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+model_scheduler = ModelScheduler()
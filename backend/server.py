@@ -2,9 +2,24 @@ import os
 import asyncio
 import logging
 import json
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from main import run_workflow, WorkflowInput
+from ingestion import ingest_upload
+from mapping_cache import mapping_plan_cache
+from model_clients import model_client_pool
+from report_cache import report_section_cache
+from response_cache import response_cache
+from scheduler import model_scheduler
+from session_store import UnknownRun, session_store
+import corrections
+from jobs import CANCELLED, FAILED, SUCCEEDED, JobQueueFull, job_manager
+import metrics
+import progress
+import prompt_layout
 
 # Configure the logging system
 logging.basicConfig(
@@ -22,7 +37,19 @@ load_dotenv()
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
 
-app = FastAPI(title="Agentic Reconciliation Backend")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Model clients connect and warm up in the background; /api/ready reports when they are usable
+    await model_client_pool.start()
+    yield
+    try:
+        await job_manager.shutdown()
+    finally:
+        await model_client_pool.close()
+
+
+app = FastAPI(title="Agentic Reconciliation Backend", lifespan=lifespan)
 
 # ✅ Allow your frontend origin
 origins = [
@@ -39,6 +66,23 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template so job IDs do not create one series each
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        elapsed = time.perf_counter() - started
+        metrics.http_request_duration_seconds.observe(elapsed, method=request.method, path=path, status=str(status))
+        metrics.http_request_latency_seconds.observe(elapsed, method=request.method, path=path)
+
+
 def _format_context_block(context_str: str) -> str:
     """Format context JSON string into delimited blocks appended to the prompt.
 
@@ -66,11 +110,8 @@ def _format_context_block(context_str: str) -> str:
     included: list[str] = []
     for key in known_keys:
         if key in data and isinstance(data[key], (dict, list)):
-            try:
-                pretty = json.dumps(data[key], indent=2)
-            except Exception:
-                pretty = str(data[key])
-            parts.append(f"\n\n--- CONTEXT {key} START ---\n{pretty}\n--- CONTEXT {key} END ---\n")
+            # Canonical JSON, so the same context is the same prompt prefix on every call
+            parts.append(f"\n\n{prompt_layout.context_block(key, data[key])}\n")
             included.append(key)
 
     if included:
@@ -78,61 +119,367 @@ def _format_context_block(context_str: str) -> str:
     return "".join(parts)
 
 
+async def _prepare_run(
+    input_as_text: str,
+    context: str | None,
+    run_id: str | None,
+    nbim_file: UploadFile | None,
+    custody_file: UploadFile | None,
+    baseline_run_id: str | None = None,
+    bypass_cache: bool = False,
+) -> dict:
+    """Ingest uploads, resolve the run and build the `run_workflow` arguments.
+
+    Raises UnknownRun for an unknown or expired run_id or baseline_run_id.
+    """
+    logger.info(f"User input: {input_as_text[:100]}...")  # log first 100 chars
+
+    # Track uploaded files
+    uploaded_files = []
+    if nbim_file:
+        uploaded_files.append(nbim_file.filename)
+    if custody_file:
+        uploaded_files.append(custody_file.filename)
+    logger.info(f"Uploaded files: {', '.join(uploaded_files) or 'None'}")
+
+    # Stream the CSVs into typed tables; only a preview goes into the prompt
+    extra_text = ""
+    ingested = {}
+
+    if nbim_file:
+        ingested["nbim"] = await ingest_upload(nbim_file)
+        extra_text += ingested["nbim"].prompt_block("NBIM")
+
+    if custody_file:
+        ingested["custody"] = await ingest_upload(custody_file)
+        extra_text += ingested["custody"].prompt_block("CUSTODY")
+
+    if baseline_run_id and not await asyncio.to_thread(session_store.exists, baseline_run_id):
+        raise UnknownRun(f"Unknown or expired baseline_run_id {baseline_run_id}")
+    # Later stages of a run reuse its stored state and CSV previews
+    if run_id:
+        if not await asyncio.to_thread(session_store.exists, run_id):
+            raise UnknownRun(f"Unknown or expired run_id {run_id}")
+        if not extra_text:
+            stored = await asyncio.to_thread(session_store.get, run_id, ["source_blocks"])
+            extra_text = stored.get("source_blocks", "")
+    else:
+        run_id = await asyncio.to_thread(session_store.create)
+    if ingested:
+        await asyncio.to_thread(session_store.put, run_id, {"source_blocks": extra_text})
+    for name, item in ingested.items():
+        # Kept so approved corrections can later be applied to, and exported from, the upload
+        data = await asyncio.to_thread(item.table.to_bytes)
+        await asyncio.to_thread(session_store.put_table, run_id, name, data)
+        metrics.upload_size_bytes.observe(item.byte_count, file=name)
+        metrics.upload_rows.observe(item.row_count, file=name)
+
+    # Merge into one big prompt
+    context_block = _format_context_block(context) if context else ""
+    merged_prompt = f"{input_as_text.strip()}\n\n{extra_text}{context_block}"
+    if context_block:
+        logger.info(f"Context block length added: {len(context_block)} characters")
+    logger.info(f"Final merged prompt length: {len(merged_prompt)} characters")
+
+    return {
+        "run_id": run_id,
+        "uploaded_files": uploaded_files,
+        "ingestion": {name: item.summary() for name, item in ingested.items()},
+        "workflow_kwargs": {
+            "workflow_input": WorkflowInput(input_as_text=merged_prompt),
+            "nbim_table": ingested["nbim"].table if "nbim" in ingested else None,
+            "custody_table": ingested["custody"].table if "custody" in ingested else None,
+            "run_id": run_id,
+            "baseline_run_id": baseline_run_id or None,
+            "bypass_cache": bypass_cache,
+        },
+    }
+
+
+def _success_payload(prepared: dict, result: dict) -> dict:
+    return {
+        "success": True,
+        "run_id": prepared["run_id"],
+        "uploaded_files": prepared["uploaded_files"],
+        "ingestion": prepared["ingestion"],
+        "result": result
+    }
+
+
 @app.post("/api/run-workflow")
 async def run_agent_workflow(
     input_as_text: str = Form(...),
     context: str = Form(None),
+    run_id: str = Form(None),
+    baseline_run_id: str = Form(None),
+    bypass_cache: bool = Form(False),
     nbim_file: UploadFile = File(None),
     custody_file: UploadFile = File(None)
 ):
-    """Run workflow with optional CSV uploads appended as text."""
+    """Run workflow with optional CSV uploads appended as text.
+
+    Passing the `run_id` of an earlier call reuses its server-side state
+    instead of a client-supplied `context` payload. With a `baseline_run_id`,
+    break identification only re-processes events changed since that run.
+    `bypass_cache` forces fresh model calls instead of cached agent responses.
+    """
     logger.info("Workflow request received.")
 
     try:
-        logger.info(f"User input: {input_as_text[:100]}...")  # log first 100 chars
-
-        # Track uploaded files
-        uploaded_files = []
-        if nbim_file:
-            uploaded_files.append(nbim_file.filename)
-        if custody_file:
-            uploaded_files.append(custody_file.filename)
-        logger.info(f"Uploaded files: {', '.join(uploaded_files) or 'None'}")
-
-        # Read the CSVs and turn them into text blocks
-        extra_text = ""
-
-        if nbim_file:
-            nbim_bytes = await nbim_file.read()
-            nbim_text = nbim_bytes.decode("utf-8", errors="ignore")
-            extra_text += f"\n\n--- NBIM CSV START ---\n{nbim_text}\n--- NBIM CSV END ---\n"
-            logger.debug(f"NBIM CSV size: {len(nbim_text)} characters")
-
-        if custody_file:
-            custody_bytes = await custody_file.read()
-            custody_text = custody_bytes.decode("utf-8", errors="ignore")
-            extra_text += f"\n\n--- CUSTODY CSV START ---\n{custody_text}\n--- CUSTODY CSV END ---\n"
-            logger.debug(f"Custody CSV size: {len(custody_text)} characters")
-
-        # Merge into one big prompt
-        context_block = _format_context_block(context) if context else ""
-        merged_prompt = f"{input_as_text.strip()}\n\n{extra_text}{context_block}"
-        if context_block:
-            logger.info(f"Context block length added: {len(context_block)} characters")
-        logger.info(f"Final merged prompt length: {len(merged_prompt)} characters")
+        prepared = await _prepare_run(input_as_text, context, run_id, nbim_file, custody_file, baseline_run_id, bypass_cache)
 
         # Call your workflow
         logger.info("Running agentic workflow...")
-        workflow_input = WorkflowInput(input_as_text=merged_prompt)
-        result = await run_workflow(workflow_input)
+        result = await run_workflow(**prepared["workflow_kwargs"])
         logger.info("Workflow completed successfully.")
 
-        return {
-            "success": True,
-            "uploaded_files": uploaded_files,
-            "result": result
-        }
+        return _success_payload(prepared, result)
 
+    except UnknownRun as e:
+        return {"success": False, "error": e.args[0]}
     except Exception as e:
         logger.exception("Error while running workflow")
         return {"success": False, "error": str(e)}
+
+
+@app.post("/api/run-workflow/stream")
+async def run_agent_workflow_stream(
+    input_as_text: str = Form(...),
+    context: str = Form(None),
+    run_id: str = Form(None),
+    baseline_run_id: str = Form(None),
+    bypass_cache: bool = Form(False),
+    nbim_file: UploadFile = File(None),
+    custody_file: UploadFile = File(None)
+):
+    """Server-Sent Events variant of /api/run-workflow.
+
+    Emits `ingested`, `route`, `stage_start`/`stage_end` (with timing and token
+    usage) and `item` events for each break, classified break or correction
+    as soon as it is parsed, then a final `result` (or `error`) event carrying
+    the same payload as the non-streaming endpoint. An unknown `run_id` or
+    `baseline_run_id` answers 404 before the stream starts.
+    """
+    logger.info("Streaming workflow request received.")
+    try:
+        prepared = await _prepare_run(input_as_text, context, run_id, nbim_file, custody_file, baseline_run_id, bypass_cache)
+    except UnknownRun as e:
+        return JSONResponse(status_code=404, content={"success": False, "error": e.args[0]})
+    except Exception as e:
+        logger.exception("Error while preparing streaming workflow")
+        error = progress.format_sse("error", {"success": False, "error": str(e)})
+        return StreamingResponse(iter([error]), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    reporter = progress.ProgressReporter()
+
+    async def run_with_progress() -> dict:
+        progress.use_reporter(reporter)
+        return await run_workflow(**prepared["workflow_kwargs"])
+
+    async def events():
+        yield progress.format_sse("ingested", {"run_id": prepared["run_id"], "ingestion": prepared["ingestion"]})
+        task = asyncio.create_task(run_with_progress())
+        try:
+            while not (task.done() and reporter.queue.empty()):
+                getter = asyncio.ensure_future(reporter.queue.get())
+                await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield progress.format_sse(*getter.result())
+                else:
+                    getter.cancel()
+            yield progress.format_sse("result", _success_payload(prepared, task.result()))
+            logger.info("Streaming workflow completed successfully.")
+        except Exception as e:
+            logger.exception("Error while running streaming workflow")
+            yield progress.format_sse("error", {"success": False, "error": str(e)})
+        finally:
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+def _queue_full_response(error: JobQueueFull) -> JSONResponse:
+    logger.warning(str(error))
+    return JSONResponse(status_code=429, content={"success": False, "error": str(error)}, headers={"Retry-After": "5"})
+
+
+@app.post("/api/jobs", status_code=202)
+async def submit_workflow_job(
+    input_as_text: str = Form(...),
+    context: str = Form(None),
+    run_id: str = Form(None),
+    baseline_run_id: str = Form(None),
+    bypass_cache: bool = Form(False),
+    nbim_file: UploadFile = File(None),
+    custody_file: UploadFile = File(None)
+):
+    """Queue a workflow run and return its job ID without waiting for the agents.
+
+    Uploads are ingested before the call returns; the workflow itself runs on
+    the bounded worker pool. Answers 429, before ingesting anything, when the
+    queue is full.
+    """
+    logger.info("Workflow job submission received.")
+    try:
+        job_manager.check_capacity()
+        prepared = await _prepare_run(input_as_text, context, run_id, nbim_file, custody_file, baseline_run_id, bypass_cache)
+    except JobQueueFull as e:
+        return _queue_full_response(e)
+    except UnknownRun as e:
+        return JSONResponse(status_code=404, content={"success": False, "error": e.args[0]})
+
+    async def run_job() -> dict:
+        return _success_payload(prepared, await run_workflow(**prepared["workflow_kwargs"]))
+
+    try:
+        job = job_manager.submit(run_job, metadata={"run_id": prepared["run_id"]})
+    except JobQueueFull as e:
+        # The queue filled up while the uploads were ingested; do not leave the new run behind
+        if not run_id:
+            await asyncio.to_thread(session_store.delete, prepared["run_id"])
+        return _queue_full_response(e)
+
+    return {"success": True, "job_id": job.job_id, "run_id": prepared["run_id"], "ingestion": prepared["ingestion"], "status": job.status}
+
+
+@app.get("/api/jobs")
+async def workflow_job_stats():
+    """Worker pool size, queue limit and job counts per status."""
+    return job_manager.stats()
+
+
+@app.get("/api/jobs/{job_id}")
+async def workflow_job_status(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": f"Unknown job_id {job_id}"})
+    return {"success": True, **job.describe()}
+
+
+@app.get("/api/jobs/{job_id}/result")
+async def workflow_job_result(job_id: str):
+    """The `/api/run-workflow` payload of a finished job; 409 while it is still queued or running."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": f"Unknown job_id {job_id}"})
+    if job.status == SUCCEEDED:
+        return job.result
+    if job.status in (FAILED, CANCELLED):
+        return {"success": False, "status": job.status, "error": job.error or f"Job {job.status}"}
+    return JSONResponse(status_code=409, content={"success": False, "status": job.status, "error": f"Job is {job.status}"})
+
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_workflow_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": f"Unknown job_id {job_id}"})
+    cancelled = job_manager.cancel(job_id)
+    return {"success": cancelled, "job_id": job_id, "status": job.status}
+
+
+@app.get("/api/runs/{run_id}/patches")
+async def list_correction_patches(run_id: str):
+    """The run's append-only patch log: one entry per applied correction batch or undo."""
+    try:
+        return {"success": True, "patches": await asyncio.to_thread(corrections.patch_log, run_id)}
+    except UnknownRun:
+        return JSONResponse(status_code=404, content={"success": False, "error": f"Unknown or expired run_id {run_id}"})
+
+
+@app.get("/api/runs/{run_id}/patches/{seq}")
+async def correction_patch_audit(run_id: str, seq: int):
+    """Every cell a patch changed, with previous and new value and the correction behind it."""
+    try:
+        return {"success": True, **await asyncio.to_thread(corrections.audit, run_id, seq)}
+    except (UnknownRun, KeyError) as e:
+        return JSONResponse(status_code=404, content={"success": False, "error": e.args[0]})
+
+
+@app.post("/api/runs/{run_id}/patches/{seq}/undo")
+async def undo_correction_patch(run_id: str, seq: int):
+    """Append the inverse of a patch; 409 if it was already undone or later patches touched its cells."""
+    try:
+        return {"success": True, "patch": await asyncio.to_thread(corrections.undo, run_id, seq)}
+    except corrections.PatchConflict as e:
+        return JSONResponse(status_code=409, content={"success": False, "error": str(e)})
+    except (UnknownRun, KeyError) as e:
+        return JSONResponse(status_code=404, content={"success": False, "error": e.args[0]})
+
+
+@app.get("/api/runs/{run_id}/nbim.csv")
+async def export_corrected_nbim(run_id: str, through: int | None = None):
+    """The uploaded NBIM bookings with all patches replayed, or only those up to `through`."""
+    try:
+        text = await asyncio.to_thread(corrections.corrected_csv, run_id, through)
+    except UnknownRun:
+        text = None
+    if text is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": f"No NBIM upload stored for run {run_id}"})
+    return Response(text, media_type="text/csv", headers={"Content-Disposition": f'attachment; filename="nbim-{run_id}.csv"'})
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Per-agent latency, token, retry and parse-failure metrics plus request and upload distributions."""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/api/ready")
+async def readiness():
+    """Passes once the shared model clients are connected; answers 503 until then."""
+    ready = model_client_pool.ready or not model_client_pool.enabled
+    content = {"ready": ready, "model_clients": model_client_pool.stats()}
+    return content if ready else JSONResponse(status_code=503, content=content)
+
+
+@app.get("/api/model-clients")
+async def model_client_stats():
+    """Size, in-use and idle counts and warm-up connect times of the model client pool."""
+    return model_client_pool.stats()
+
+
+@app.get("/api/scheduler")
+async def model_scheduler_stats():
+    """Queue depth, in-flight calls, remaining request and token budgets and 429 backoff state."""
+    return model_scheduler.stats()
+
+
+@app.get("/api/mapping-cache")
+async def mapping_cache_stats():
+    """Hit/miss counters and size of the mapping plan cache."""
+    return mapping_plan_cache.stats()
+
+
+@app.delete("/api/mapping-cache")
+async def invalidate_mapping_cache(fingerprint: str | None = None):
+    """Invalidate one cached layout, or the whole cache when no fingerprint is given."""
+    removed = mapping_plan_cache.invalidate(fingerprint)
+    return {"success": True, "removed": removed}
+
+
+@app.get("/api/response-cache")
+async def response_cache_stats():
+    """Hit/miss counters and size of the agent response cache."""
+    return response_cache.stats()
+
+
+@app.delete("/api/response-cache")
+async def invalidate_response_cache(agent: str | None = None):
+    """Invalidate one agent's cached responses, or the whole cache when no agent is given."""
+    removed = response_cache.invalidate(agent)
+    return {"success": True, "removed": removed}
+
+
+@app.get("/api/report-cache")
+async def report_cache_stats():
+    """Hit/miss counters and size of the audit report section cache."""
+    return report_section_cache.stats()
+
+
+@app.delete("/api/report-cache")
+async def invalidate_report_cache(section: str | None = None):
+    """Invalidate one section's cached texts, or the whole cache when no section is given."""
+    removed = report_section_cache.invalidate(section)
+    return {"success": True, "removed": removed}
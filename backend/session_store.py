@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "sessions.sqlite3")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+class UnknownRun(KeyError):
+    """Raised when a run ID was never created or has expired."""
+
+
+class SessionStore:
+    """Reconciliation state per run ID, persisted in SQLite one state key per row.
+
+    Stages only rewrite the keys they produce, so a report run does not pay for
+    re-serializing the validation and break outputs it merely reads.
+    """
+
+    def __init__(self, path: str = SESSION_STORE_PATH, ttl_seconds: int = SESSION_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " run_id TEXT PRIMARY KEY,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS run_state ("
+                " run_id TEXT NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " PRIMARY KEY (run_id, key))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS event_digests ("
+                " run_id TEXT NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,"
+                " event_key TEXT NOT NULL,"
+                " digest TEXT NOT NULL,"
+                " PRIMARY KEY (run_id, event_key)) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS run_tables ("
+                " run_id TEXT NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,"
+                " name TEXT NOT NULL,"
+                " sha256 TEXT NOT NULL,"
+                " data BLOB NOT NULL,"
+                " PRIMARY KEY (run_id, name)) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS patches ("
+                " run_id TEXT NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,"
+                " seq INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " summary TEXT NOT NULL,"
+                " data BLOB NOT NULL,"
+                " PRIMARY KEY (run_id, seq))"
+            )
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.commit()
+        return self._conn
+
+    def create(self) -> str:
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM runs WHERE updated_at < ?", (now - self.ttl_seconds,))
+            conn.execute("INSERT INTO runs (run_id, created_at, updated_at) VALUES (?, ?, ?)", (run_id, now, now))
+            conn.commit()
+        logger.info(f"Created reconciliation run {run_id}")
+        return run_id
+
+    def exists(self, run_id: str) -> bool:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT updated_at FROM runs WHERE run_id = ?", (run_id,)
+            ).fetchone()
+        return row is not None and time.time() - row[0] <= self.ttl_seconds
+
+    def get(self, run_id: str, keys: list[str] | None = None) -> dict[str, Any]:
+        """Stored state for a run, optionally limited to `keys`."""
+        if not self.exists(run_id):
+            raise UnknownRun(run_id)
+        with self._lock:
+            conn = self._connect()
+            if keys is None:
+                rows = conn.execute("SELECT key, value FROM run_state WHERE run_id = ?", (run_id,)).fetchall()
+            else:
+                placeholders = ",".join("?" for _ in keys)
+                rows = conn.execute(
+                    f"SELECT key, value FROM run_state WHERE run_id = ? AND key IN ({placeholders})",
+                    (run_id, *keys),
+                ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def put(self, run_id: str, values: dict[str, Any], event_digests: dict[str, str] | None = None) -> None:
+        """Write state keys and, if given, replace the run's event digests, in one transaction."""
+        now = time.time()
+        encoded = [(run_id, key, json.dumps(value, separators=(",", ":"))) for key, value in values.items()]
+        with self._lock:
+            conn = self._connect()
+            # Commits on success and rolls back on error, so readers never see half of the write
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO run_state (run_id, key, value) VALUES (?, ?, ?)", encoded
+                )
+                if event_digests is not None:
+                    # The per-`coac_event_key` row digests a later delta run compares against
+                    conn.execute("DELETE FROM event_digests WHERE run_id = ?", (run_id,))
+                    conn.executemany(
+                        "INSERT INTO event_digests (run_id, event_key, digest) VALUES (?, ?, ?)",
+                        ((run_id, key, digest) for key, digest in event_digests.items()),
+                    )
+                conn.execute("UPDATE runs SET updated_at = ? WHERE run_id = ?", (now, run_id))
+
+    def get_event_digests(self, run_id: str) -> dict[str, str]:
+        if not self.exists(run_id):
+            raise UnknownRun(run_id)
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT event_key, digest FROM event_digests WHERE run_id = ?", (run_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def put_table(self, run_id: str, name: str, data: bytes) -> None:
+        """Store a serialized source dataset of the run, e.g. the uploaded NBIM bookings."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO run_tables (run_id, name, sha256, data) VALUES (?, ?, ?, ?)",
+                (run_id, name, hashlib.sha256(data).hexdigest(), data),
+            )
+            conn.commit()
+
+    def get_table(self, run_id: str, name: str, with_data: bool = True) -> tuple[str, bytes | None] | None:
+        """The SHA-256 and serialized data of a stored dataset, or None if it was never uploaded."""
+        if not self.exists(run_id):
+            raise UnknownRun(run_id)
+        with self._lock:
+            row = self._connect().execute(
+                f"SELECT sha256, {'data' if with_data else 'NULL'} FROM run_tables WHERE run_id = ? AND name = ?",
+                (run_id, name),
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def append_patch(self, run_id: str, summary: dict[str, Any], data: bytes) -> int:
+        """Append one patch to the run's log and return its sequence number; patches are never rewritten."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM patches WHERE run_id = ?", (run_id,)).fetchone()[0]
+            summary = {**summary, "seq": seq, "created_at": now}
+            conn.execute(
+                "INSERT INTO patches (run_id, seq, created_at, summary, data) VALUES (?, ?, ?, ?, ?)",
+                (run_id, seq, now, json.dumps(summary, separators=(",", ":")), data),
+            )
+            conn.execute("UPDATE runs SET updated_at = ? WHERE run_id = ?", (now, run_id))
+            conn.commit()
+        return seq
+
+    def get_patches(self, run_id: str, through: int | None = None, with_data: bool = True) -> list[tuple[dict[str, Any], bytes | None]]:
+        """The run's patch log in order, optionally only up to sequence number `through`."""
+        if not self.exists(run_id):
+            raise UnknownRun(run_id)
+        query = f"SELECT summary, {'data' if with_data else 'NULL'} FROM patches WHERE run_id = ?"
+        params: tuple = (run_id,)
+        if through is not None:
+            query += " AND seq <= ?"
+            params += (through,)
+        with self._lock:
+            rows = self._connect().execute(query + " ORDER BY seq", params).fetchall()
+        return [(json.loads(summary), data) for summary, data in rows]
+
+    def delete(self, run_id: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            conn.commit()
+
+
+session_store = SessionStore()
@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+
+import break_engine
+from ingestion import CsvTable
+
+logger = logging.getLogger(__name__)
+
+# Input budget per break_classifier call; leaves room for the 2048-token completion.
+SHARD_TOKENS = int(os.getenv("BREAK_SHARD_TOKENS", "6000"))
+# Output is the binding limit: a shard never holds more events than one completion can report on.
+SHARD_MAX_EVENTS = int(os.getenv("BREAK_SHARD_MAX_EVENTS", "25"))
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+@dataclass
+class Shard:
+    """A group of whole `coac_event_key` events rendered for one break_classifier call."""
+
+    nbim_header: str
+    custody_header: str
+    keys: list[str] = field(default_factory=list)
+    nbim_rows: list[str] = field(default_factory=list)
+    custody_rows: list[str] = field(default_factory=list)
+    tokens: int = 0
+
+    def prompt(self, validation_json: str) -> str:
+        nbim = "\n".join([self.nbim_header, *self.nbim_rows])
+        custody = "\n".join([self.custody_header, *self.custody_rows])
+        return (
+            "Detect reconciliation breaks for the coac_event_key values below only. "
+            "Every row of these events is included; events outside this shard are handled separately.\n\n"
+            f"--- VALIDATION RESULTS START ---\n{validation_json}\n--- VALIDATION RESULTS END ---\n\n"
+            f"--- NBIM CSV START ---\n{nbim}\n--- NBIM CSV END ---\n\n"
+            f"--- CUSTODY CSV START ---\n{custody}\n--- CUSTODY CSV END ---\n"
+        )
+
+
+def _rows_by_key(codes: np.ndarray, n_keys: int) -> tuple[np.ndarray, np.ndarray]:
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(n_keys + 1))
+    return order, bounds
+
+
+def partition_events(
+    nbim: CsvTable,
+    custody: CsvTable,
+    validation_results: dict[str, Any],
+    max_tokens: int = SHARD_TOKENS,
+    max_events: int = SHARD_MAX_EVENTS,
+) -> list[Shard]:
+    """Split both datasets into shards of whole events, bounded by tokens and event count.
+
+    Events are never split across shards, so a shard can be reconciled on its
+    own; rows without a usable key are dropped as in rule (G).
+    """
+    _, _, nbim_keys, custody_keys = break_engine.event_keys(nbim.columns(), custody.columns(), validation_results)
+    all_keys, inverse = np.unique(np.concatenate([nbim_keys, custody_keys]), return_inverse=True)
+    n_keys = len(all_keys)
+    nbim_order, nbim_bounds = _rows_by_key(inverse[:len(nbim_keys)], n_keys)
+    custody_order, custody_bounds = _rows_by_key(inverse[len(nbim_keys):], n_keys)
+    nbim_text = nbim.render_rows()
+    custody_text = custody.render_rows()
+    nbim_header = ";".join(nbim.header)
+    custody_header = ";".join(custody.header)
+
+    base_tokens = estimate_tokens(json.dumps(validation_results) + nbim_header + custody_header) + 100
+    shards: list[Shard] = []
+    current = Shard(nbim_header, custody_header, tokens=base_tokens)
+    for code in range(n_keys):
+        if all_keys[code] == "":
+            continue
+        nbim_rows = [nbim_text[i] for i in nbim_order[nbim_bounds[code]:nbim_bounds[code + 1]]]
+        custody_rows = [custody_text[i] for i in custody_order[custody_bounds[code]:custody_bounds[code + 1]]]
+        event_tokens = sum(estimate_tokens(row) for row in nbim_rows + custody_rows)
+        full = len(current.keys) >= max_events or current.tokens + event_tokens > max_tokens
+        if current.keys and full:
+            shards.append(current)
+            current = Shard(nbim_header, custody_header, tokens=base_tokens)
+        current.keys.append(str(all_keys[code]))
+        current.nbim_rows.extend(nbim_rows)
+        current.custody_rows.extend(custody_rows)
+        current.tokens += event_tokens
+    if current.keys:
+        shards.append(current)
+    logger.info(f"Partitioned {n_keys} events into {len(shards)} shards (<= {max_tokens} tokens, <= {max_events} events)")
+    return shards
@@ -0,0 +1,129 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteCache:
+    """Persistent key/value cache in one SQLite table.
+
+    Entries expire after `ttl_seconds`; when more than `max_entries` are stored
+    the least recently used ones are evicted. Subclasses name the table and its
+    columns and expose typed `get`/`put` built on `_lookup` and `_store`; the
+    optional `group_column` is what `invalidate` filters on.
+    """
+
+    name = "Cache"
+    table = ""
+    key_column = "key"
+    value_column = "value"
+    group_column: str | None = None
+
+    def __init__(self, path: str, ttl_seconds: int, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _columns(self) -> list[str]:
+        return [self.key_column, *([self.group_column] if self._grouped() else []), self.value_column]
+
+    def _grouped(self) -> bool:
+        return self.group_column is not None and self.group_column != self.key_column
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            key, *rest = self._columns()
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                f" {key} TEXT PRIMARY KEY,"
+                + "".join(f" {column} TEXT NOT NULL," for column in rest)
+                + " created_at REAL NOT NULL,"
+                " last_used_at REAL NOT NULL,"
+                " hit_count INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _lookup(self, key: str, decode: Callable[[str], Any]) -> Any | None:
+        """The decoded value stored under `key`, or None. Expired rows and rows `decode` rejects with ValueError are dropped."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                f"SELECT {self.value_column}, created_at FROM {self.table} WHERE {self.key_column} = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._delete(conn, key)
+                row = None
+            if row is not None:
+                try:
+                    value = decode(row[0])
+                except ValueError as e:
+                    logger.warning(f"{self.name}: dropping entry that no longer decodes ({type(e).__name__})")
+                    self._delete(conn, key)
+                    row = None
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute(
+                f"UPDATE {self.table} SET last_used_at = ?, hit_count = hit_count + 1 WHERE {self.key_column} = ?",
+                (now, key),
+            )
+            conn.commit()
+            self.hits += 1
+        return value
+
+    def _delete(self, conn: sqlite3.Connection, key: str) -> None:
+        conn.execute(f"DELETE FROM {self.table} WHERE {self.key_column} = ?", (key,))
+        conn.commit()
+
+    def _store(self, key: str, text: str, group: str | None = None) -> None:
+        now = time.time()
+        columns = self._columns()
+        values = [key, *([group] if self._grouped() else []), text]
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} ({', '.join(columns)}, created_at, last_used_at, hit_count)"
+                f" VALUES ({', '.join('?' for _ in columns)}, ?, ?, 0)",
+                (*values, now, now),
+            )
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE {self.key_column} NOT IN"
+                f" (SELECT {self.key_column} FROM {self.table} ORDER BY last_used_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
+
+    def invalidate(self, group: str | None = None) -> int:
+        """Drop the entries of one `group_column` value, or every entry when none is given. Returns rows removed."""
+        with self._lock:
+            conn = self._connect()
+            if group is None:
+                cursor = conn.execute(f"DELETE FROM {self.table}")
+            else:
+                cursor = conn.execute(f"DELETE FROM {self.table} WHERE {self.group_column} = ?", (group,))
+            conn.commit()
+        logger.info(f"{self.name} invalidated {cursor.rowcount} entries")
+        return cursor.rowcount
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            entries = self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "ttl_seconds": self.ttl_seconds,
+            "max_entries": self.max_entries,
+        }
@@ -0,0 +1,154 @@
+"""Rule-based pre-triage for `classification_agent`.
+
+Breaks whose classification follows directly from the domain table of the
+classification prompt (missing records, currency mismatches, ±1 day timing
+differences, sub-0.01% rounding) are classified here. Only the remainder is
+sent to the model, in batches of `CLASSIFICATION_BATCH_SIZE`. The prompt's
+guardrails are enforced on the model's output as well, and the `summary`
+counts are computed locally.
+"""
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+CLASSIFICATION_BATCH_SIZE = int(os.getenv("CLASSIFICATION_BATCH_SIZE", "25"))
+MIN_AUTO_CONFIDENCE = 70
+ROUNDING_RELATIVE_TOLERANCE = 1e-4
+CRITICAL_RATIONALE = "Upstream validation critical; auto-fix paused."
+FALLBACK_RATIONALE = "Not classified by the model; routed to manual review."
+
+_PRIORITY = {"critical": "high", "major": "high", "moderate": "medium", "minor": "low"}
+
+
+def _priority(severity: str | None) -> str:
+    return _PRIORITY.get(severity or "", "medium")
+
+
+def _relative_difference(item: dict[str, Any]) -> float | None:
+    try:
+        nbim_value, custody_value = float(item["nbim_value"]), float(item["custody_value"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    scale = max(abs(nbim_value), abs(custody_value))
+    return abs(nbim_value - custody_value) / scale if scale else None
+
+
+def rule(item: dict[str, Any]) -> tuple[str, str, float, str] | None:
+    """`(category, recommended_action, confidence, rationale)` for a routine break, else None."""
+    break_type = item.get("break_type")
+    if not str(item.get("coac_event_key") or "").strip():
+        return "system_mapping_error", "manual_review", 95, "Break has no coac_event_key; the event cannot be matched."
+    if break_type == "missing_record":
+        side = "Custody" if item.get("custody_value") is None else "NBIM"
+        return "missing_record", "manual_review", 95, f"Event has no matching booking in {side}; insertion needs manual review."
+    if break_type == "currency_mismatch":
+        return "FX_variance", "manual_review", 80, f"Currency {item.get('nbim_value')} vs {item.get('custody_value')}; requires confirmation of FX rate."
+    if break_type == "date_mismatch" and item.get("difference_value") is not None and abs(item["difference_value"]) <= 1:
+        return "timing_difference", "auto_fix", 95, f"{item.get('nbim_field')} differs by one day; likely value date shift (T+1)."
+    if break_type == "amount_mismatch":
+        relative = _relative_difference(item)
+        if relative is not None and relative < ROUNDING_RELATIVE_TOLERANCE:
+            return "rounding_issue", "auto_fix", 90, f"{item.get('nbim_field')} differs by {relative:.4%}; minor rounding difference below 0.01%."
+    return None
+
+
+def _guard(candidate: dict[str, Any], item: dict[str, Any], critical: bool) -> bool:
+    """Apply the prompt's batch grouping rules; returns whether the candidate may stay automatic."""
+    if critical or item.get("upstream_critical_flag"):
+        candidate["recommended_action"] = "manual_review"
+        if CRITICAL_RATIONALE not in candidate["rationale"]:
+            candidate["rationale"] = f"{candidate['rationale']} {CRITICAL_RATIONALE}".strip()
+        return False
+    if (candidate["confidence"] or 0) < MIN_AUTO_CONFIDENCE or item.get("severity") == "major":
+        candidate["recommended_action"] = "manual_review"
+    return candidate["recommended_action"] == "auto_fix"
+
+
+@dataclass
+class Triage:
+    """Classification of one list of breaks; `break_id` is the break's 1-based position in it."""
+
+    breaks: list[dict[str, Any]]
+    critical: bool
+    classified: dict[int, tuple[bool, dict[str, Any]]] = field(default_factory=dict)
+    pending: list[int] = field(default_factory=list)
+    rule_classified: int = 0
+    model_classified: int = 0
+    fallback: int = 0
+
+    def add(self, break_id: int, category: str, action: str, confidence: float, rationale: str, priority: str | None = None) -> None:
+        item = self.breaks[break_id - 1]
+        candidate = {
+            "break_id": break_id,
+            "coac_event_key": item.get("coac_event_key") or "",
+            "break_type": item.get("break_type") or "",
+            "mapping_type": item.get("mapping_type") or "",
+            "category": category,
+            "priority": priority or _priority(item.get("severity")),
+            "confidence": confidence,
+            "recommended_action": action,
+            "rationale": rationale,
+        }
+        self.classified[break_id] = (_guard(candidate, item, self.critical), candidate)
+
+    def batches(self, size: int = CLASSIFICATION_BATCH_SIZE) -> list[list[dict[str, Any]]]:
+        """Pending breaks for the model, tagged with their `break_id` and without detection timestamps."""
+        tagged = [
+            {"break_id": break_id, **{k: v for k, v in self.breaks[break_id - 1].items() if k != "timestamp_detected"}}
+            for break_id in self.pending
+        ]
+        return [tagged[start:start + size] for start in range(0, len(tagged), size)]
+
+    def add_model_output(self, batch: list[dict[str, Any]], classified_breaks: dict[str, Any] | None) -> None:
+        """Take the model's classification of `batch`; breaks it skipped go to manual review."""
+        wanted = {item["break_id"] for item in batch}
+        for candidate in (classified_breaks or {}).get("auto_candidates", []) + (classified_breaks or {}).get("manual_candidates", []):
+            break_id = int(candidate["break_id"])
+            if break_id not in wanted:
+                continue
+            wanted.discard(break_id)
+            self.model_classified += 1
+            self.add(break_id, candidate["category"], candidate["recommended_action"], candidate["confidence"], candidate["rationale"], candidate["priority"])
+        for break_id in sorted(wanted):
+            self.fallback += 1
+            self.add(break_id, "system_mapping_error", "manual_review", 0, FALLBACK_RATIONALE)
+
+    def result(self) -> dict[str, Any]:
+        """`ClassificationAgentSchema__ClassifiedBreaks` with locally computed summary counts."""
+        auto, manual = [], []
+        for break_id in sorted(self.classified):
+            automatic, candidate = self.classified[break_id]
+            if automatic:
+                auto.append({**candidate, "approved_for_auto_correction": False})
+            else:
+                manual.append(candidate)
+        return {
+            "auto_candidates": auto,
+            "manual_candidates": manual,
+            "summary": {
+                "total_breaks": len(self.breaks),
+                "auto_batch_size": len(auto),
+                "manual_batch_size": len(manual),
+                "awaiting_user_confirmation": any(not item["approved_for_auto_correction"] for item in auto),
+            },
+        }
+
+    def stats(self) -> dict[str, int]:
+        return {"rule_classified": self.rule_classified, "model_classified": self.model_classified, "fallback": self.fallback}
+
+
+def triage(breaks: list[dict[str, Any]], validation_results: dict[str, Any]) -> Triage:
+    """Classify routine breaks by rule; the others are left in `pending` for the model."""
+    result = Triage(breaks, critical=validation_results.get("critical") is True)
+    for break_id, item in enumerate(breaks, start=1):
+        matched = rule(item)
+        if matched is None:
+            result.pending.append(break_id)
+        else:
+            result.rule_classified += 1
+            result.add(break_id, *matched)
+    logger.info(f"Pre-triage classified {result.rule_classified} of {len(breaks)} breaks by rule")
+    return result
@@ -26,6 +26,8 @@ const LS_CORRECTIONS = 'corrections_list'
 const LS_AUDIT = 'audit_trail'
 const LS_NBIM_TEXT = 'nbim_csv_text'
 const LS_CUSTODY_TEXT = 'custody_csv_text'
+// Server-side session holding all stage state for the current reconciliation
+const LS_RUN_ID = 'run_id'
 
 const buildSignature = (file: File): FileSignature => ({
   name: file.name,
@@ -101,9 +103,20 @@ const buildContext = (): Record<string, any> => {
   return ctx
 }
 
+const getRunId = (): string | null => {
+  try {
+    return localStorage.getItem(LS_RUN_ID)
+  } catch {
+    return null
+  }
+}
+
 // Save any stage outputs found in the response
 const saveStageOutputs = (resp: any): void => {
   try {
+    if (typeof resp?.run_id === 'string') {
+      localStorage.setItem(LS_RUN_ID, resp.run_id)
+    }
     const result = resp?.result
     let parsed: any = result?.output_parsed
     if (!parsed && result?.output_text) {
@@ -187,6 +200,13 @@ export function getCachedIdentifyBreaks(): any | null {
 // 2) Breaks Fixer (feedback flow)
 export async function requestBreaksFixer(): Promise<any> {
   const formData = new FormData()
+  const runId = getRunId()
+  if (runId) {
+    // The server already holds the CSVs and classified breaks for this run
+    formData.append('input_as_text', 'can u fix the breaks based on the classified breaks of this run?')
+    formData.append('run_id', runId)
+    return postFixer(formData)
+  }
   // Build input text by appending saved CSVs to the user instruction
   let inputText = 'can u fix the breaks based on the breaks provided below? the original csv files are also provided as context'
   try {
@@ -206,7 +226,10 @@ export async function requestBreaksFixer(): Promise<any> {
   if (cls && typeof cls === 'object') {
     formData.append('context', JSON.stringify({ classified_breaks: cls }))
   }
+  return postFixer(formData)
+}
 
+const postFixer = async (formData: FormData): Promise<any> => {
   const { data } = await axios.post(`${API_BASE}/api/run-workflow`, formData)
   if (data && data.success === false) {
     throw new Error(data.error || 'Workflow failed')
@@ -221,11 +244,8 @@ export function getCachedBreaksFixer(): any | null {
   return cached?.response ?? null
 }
 
-// 3) Report Generation
-export async function requestReportGeneration(): Promise<any> {
-  const formData = new FormData()
-  formData.append('input_as_text', 'Generate a reconciliation report based on the current state')
-  // Include everything from localStorage as context
+// Without a server-side run, include everything from localStorage as context
+const appendLocalStorageContext = (formData: FormData): void => {
   try {
     const all: Record<string, any> = {}
     const included: string[] = []
@@ -250,6 +270,18 @@ export async function requestReportGeneration(): Promise<any> {
       formData.append('context', JSON.stringify(all))
     }
   } catch {}
+}
+
+// 3) Report Generation
+export async function requestReportGeneration(): Promise<any> {
+  const formData = new FormData()
+  formData.append('input_as_text', 'Generate a reconciliation report based on the current state')
+  const runId = getRunId()
+  if (runId) {
+    formData.append('run_id', runId)
+  } else {
+    appendLocalStorageContext(formData)
+  }
 
   const { data } = await axios.post(`${API_BASE}/api/run-workflow`, formData)
   if (data && data.success === false) {